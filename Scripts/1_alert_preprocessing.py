@@ -1,5 +1,115 @@
+import argparse
+import hashlib
 import json
+import math
+import os
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from alert_tokens import alert_tokens
+
+# orjson parses and serialises several times faster than json and is used by --workers when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Minimise alerts (prune and deduplicate fields) to reduce input tokens
+# Disabled by default so the published dataset can be reproduced, compare both runs with 5_result_evaluation.py --compare
+MINIMISE_ALERTS = False
+# Fields removed from every alert
+PRUNE_FIELDS = [
+    "_index",
+    "_version",
+    "_score",
+    "sort",
+    "fields",
+    "_source.input",
+    "_source.manager"
+]
+# Per decoder (_source.decoder.name): fields to remove and fields that only repeat another field (field -> repeated field)
+DECODER_MINIMISATION = {
+    "windows_eventchannel": {
+        "prune": [
+            "_source.data.win.system.providerGuid",
+            "_source.data.win.system.keywords",
+            "_source.data.win.system.opcode",
+            "_source.data.win.system.version",
+            "_source.data.win.system.task",
+            "_source.data.win.system.eventRecordID",
+            "_source.data.win.system.threadID",
+            "_source.data.win.system.processID",
+            "_source.data.win.system.systemTime"
+        ],
+        "duplicates": {
+            # The rendered event message contains every eventdata field again
+            "_source.data.win.system.message": "_source.data.win.eventdata"
+        }
+    },
+    "json": {
+        "prune": [
+            "_source.data.flow_id",
+            "_source.data.tx_id",
+            "_source.data.pkt_src",
+            "_source.data.in_iface"
+        ],
+        "duplicates": {
+            # Suricata's full_log is the raw eve json that was decoded into data
+            "_source.full_log": "_source.data"
+        }
+    }
+}
+# Sysmon hash fields ("SHA1=...,MD5=...,SHA256=...,IMPHASH=...") and the algorithms kept in them
+HASH_FIELDS = [
+    "_source.data.win.eventdata.hashes",
+    "_source.data.win.eventdata.hash"
+]
+KEEP_HASHES = ["SHA256"]
+# Duplicate detection: the Bloom filter is sized for this many alerts with this false positive rate (about 18 MB),
+# more alerts only make exact lookups in the on-disk id table more frequent
+BLOOM_CAPACITY = 10_000_000
+BLOOM_ERROR_RATE = 0.001
+# Ids buffered in memory before they are written to the on-disk id table
+SEEN_IDS_FLUSH = 10000
+# Bytes of raw export parsed per task by --workers
+CHUNK_BYTES = 8 * 1024 * 1024
+
+def get_field(alert_json, field):
+    node = alert_json
+    for key in field.split("."):
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return node
+
+def remove_field(alert_json, field):
+    *parents, leaf = field.split(".")
+    node = get_field(alert_json, ".".join(parents)) if parents else alert_json
+    if isinstance(node, dict):
+        node.pop(leaf, None)
+
+def minimise_alert(alert_json):
+    # Remove fields that carry no information for triage
+    for field in PRUNE_FIELDS:
+        remove_field(alert_json, field)
+    decoder = get_field(alert_json, "_source.decoder.name")
+    minimisation = DECODER_MINIMISATION.get(decoder, {})
+    for field in minimisation.get("prune", []):
+        remove_field(alert_json, field)
+    # Remove fields whose content is already present in another field
+    for field, repeated_field in minimisation.get("duplicates", {}).items():
+        if get_field(alert_json, repeated_field):
+            remove_field(alert_json, field)
+    # Keep only the configured hash algorithms
+    for field in HASH_FIELDS:
+        hashes = get_field(alert_json, field)
+        if isinstance(hashes, str):
+            kept = [entry for entry in hashes.split(",") if entry.split("=")[0] in KEEP_HASHES]
+            *parents, leaf = field.split(".")
+            get_field(alert_json, ".".join(parents))[leaf] = ",".join(kept)
+    return alert_json
 
 def clean_alert(alert_json):
     # Remove 'highlight' if present
@@ -21,51 +131,198 @@ def map_rule_level(level):
     if level >= 0: return "Low"
     return "MISSING"
 
-def alerts_raw_preprocessing():
-    # Prompt for input file
-    input_file = input("Enter the path to your jsonl file (e.g. alerts.jsonl): ").strip()
-    input_label = input("Enter the label to assign to each row (TP or FP): ").strip()
-    # Create unique output files with timestamp information
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = f"1_{input_label}_alerts_preprocessed_{timestamp}.jsonl"
-    # Set for recording alert_ids and duplicate check
-    seen_ids = set()
-    duplicate_ids = []
+class SeenIds:
+    # Bounded-memory set of alert ids: a Bloom filter answers "not seen" for new ids,
+    # possible duplicates are confirmed exactly against the ids stored in a temporary SQLite table
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.bit_count = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.pending = set()
+        self.exact_checks = 0
+        self.directory = tempfile.TemporaryDirectory(prefix="seen_ids_")
+        self.conn = sqlite3.connect(os.path.join(self.directory.name, "ids.sqlite"))
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def positions(self, id):
+        # Double hashing over one 128 bit digest
+        digest = hashlib.blake2b(id.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, id):
+        # Return True if the id is new, False if it has been added before
+        id = str(id)
+        positions = self.positions(id)
+        if all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions):
+            self.exact_checks += 1
+            if id in self.pending or self.conn.execute("SELECT 1 FROM ids WHERE id = ?", (id,)).fetchone():
+                return False
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.pending.add(id)
+        if len(self.pending) >= SEEN_IDS_FLUSH:
+            self.flush()
+        return True
+
+    def flush(self):
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO ids VALUES (?)", ((id,) for id in self.pending))
+        self.pending.clear()
+
+    def close(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+def preprocess_alert(alert, input_label, minimise):
+    # Labelled row of one parsed raw alert and the alert tokens before and after minimisation
+    # Extract fields
+    id = alert.get('_id', 'MISSING')
+    alert_details = alert.get('_source', 'MISSING')
+    rule = alert_details.get('rule', 'MISSING')
+    rule_level = rule.get('level', -1) # -1 means "missing rule_level"
+    rule_priority = map_rule_level(rule_level)
+    description = rule.get('description', 'MISSING')
+    # Remove unwanted fields from the raw alert to present to LLM
+    cleaned_alert = clean_alert(alert)
+    tokens_before = tokens_after = 0
+    if minimise:
+        tokens_before = alert_tokens(cleaned_alert)
+        cleaned_alert = minimise_alert(cleaned_alert)
+        tokens_after = alert_tokens(cleaned_alert)
+
+    # Structure of rows in output file
+    row = {
+        "id": id,
+        "description": description,
+        "label": input_label,
+        "rule_level": rule_level,
+        "rule_priority": rule_priority,
+        "alert": cleaned_alert
+    }
+    return row, tokens_before, tokens_after
 
-    with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
-        for idx, row in enumerate(in_file):
+def new_preprocessing_stats(stats):
+    stats.setdefault('duplicates', 0)
+    stats.setdefault('alerts', 0)
+    # Token counts of the alerts presented to the LLM before and after minimisation
+    stats.setdefault('tokens_before', 0)
+    stats.setdefault('tokens_after', 0)
+
+def preprocess_alerts(raw_rows, input_label, stats):
+    # Generator turning raw export lines into labelled rows, stats collects duplicate and token counts
+    new_preprocessing_stats(stats)
+    seen_ids = SeenIds()
+    try:
+        for row in raw_rows:
             # Parse json
             alert = json.loads(row.strip())
-            # Extract fields
-            id = alert.get('_id', 'MISSING')
             # If id has been seen already, skip this row
-            if id in seen_ids:
-                duplicate_ids.append(id)
+            if not seen_ids.add(alert.get('_id', 'MISSING')):
+                stats['duplicates'] += 1
                 continue
-            # Add id to set for duplicate check
-            seen_ids.add(id)
-            alert_details = alert.get('_source', 'MISSING')
-            rule = alert_details.get('rule', 'MISSING')
-            rule_level = rule.get('level', -1) # -1 means "missing rule_level"
-            rule_priority = map_rule_level(rule_level)
-            description = rule.get('description', 'MISSING')
-            # Remove unwanted fields from the raw alert to present to LLM
-            cleaned_alert = clean_alert(alert)
-
-            # Structure of rows in output file
-            entry = {
-                "id": id,
-                "description": description,
-                "label": input_label,
-                "rule_level": rule_level,
-                "rule_priority": rule_priority,
-                "alert": cleaned_alert
-            }
-
-            out_file.write(json.dumps(entry) + "\n")
-
-    print(f"\nCleaned alerts saved to: {output_file}\nDuplicate IDs: {duplicate_ids}")
+            stats['alerts'] += 1
+            entry, tokens_before, tokens_after = preprocess_alert(alert, input_label, MINIMISE_ALERTS)
+            stats['tokens_before'] += tokens_before
+            stats['tokens_after'] += tokens_after
+            yield entry
+    finally:
+        seen_ids.close()
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def dumps(row):
+    return orjson.dumps(row) if orjson is not None else json.dumps(row).encode("utf-8")
+
+def preprocess_chunk(lines, input_label, minimise):
+    # Worker: parse and preprocess a chunk of raw lines, returns (id, serialised row, tokens before, tokens after)
+    results = []
+    for line in lines:
+        if line.strip():
+            row, tokens_before, tokens_after = preprocess_alert(loads(line), input_label, minimise)
+            results.append((row['id'], dumps(row), tokens_before, tokens_after))
+    return results
+
+def read_chunks(in_file):
+    while True:
+        lines = in_file.readlines(CHUNK_BYTES)
+        if not lines:
+            return
+        yield lines
+
+def preprocess_file_parallel(input_file, input_label, output_file, stats, workers=None):
+    # Parse chunks of a (multi-GB) export in a process pool, rows are deduplicated and written in input order
+    # by this process and at most two chunks per worker are in flight, so memory does not grow with the file size
+    new_preprocessing_stats(stats)
+    seen_ids = SeenIds()
+    workers = workers or os.cpu_count()
+    try:
+        with ProcessPoolExecutor(workers) as pool, open(input_file, 'rb') as in_file, open(output_file, "wb") as out_file:
+            in_flight = deque()
+            chunks = read_chunks(in_file)
+            for lines in chunks:
+                in_flight.append(pool.submit(preprocess_chunk, lines, input_label, MINIMISE_ALERTS))
+                if len(in_flight) >= workers * 2:
+                    write_chunk(in_flight.popleft().result(), seen_ids, out_file, stats)
+            while in_flight:
+                write_chunk(in_flight.popleft().result(), seen_ids, out_file, stats)
+    finally:
+        stats['exact_id_checks'] = seen_ids.exact_checks
+        seen_ids.close()
+
+def write_chunk(results, seen_ids, out_file, stats):
+    for id, row, tokens_before, tokens_after in results:
+        if not seen_ids.add(id):
+            stats['duplicates'] += 1
+            continue
+        stats['alerts'] += 1
+        stats['tokens_before'] += tokens_before
+        stats['tokens_after'] += tokens_after
+        out_file.write(row + b"\n")
+
+def print_preprocessing_stats(stats):
+    if MINIMISE_ALERTS:
+        alert_count = stats['alerts']
+        tokens_before = stats['tokens_before']
+        tokens_after = stats['tokens_after']
+        print(f"Alert tokens before minimisation: {tokens_before} ({tokens_before/max(alert_count, 1):.0f} per alert)")
+        print(f"Alert tokens after minimisation: {tokens_after} ({tokens_after/max(alert_count, 1):.0f} per alert)")
+        print(f"Token reduction: {1 - tokens_after/max(tokens_before, 1):.2%}")
+
+def alerts_raw_preprocessing(input_file=None, input_label=None, workers=None):
+    # Prompt for input file
+    if input_file is None:
+        input_file = input("Enter the path to your jsonl file (e.g. alerts.jsonl): ").strip()
+    if input_label is None:
+        input_label = input("Enter the label to assign to each row (TP or FP): ").strip()
+    # Create unique output files with timestamp information
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = f"1_{input_label}_alerts_preprocessed_{timestamp}.jsonl"
+    stats = {}
+
+    if workers is not None:
+        preprocess_file_parallel(input_file, input_label, output_file, stats, workers)
+    else:
+        with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
+            for entry in preprocess_alerts(in_file, input_label, stats):
+                out_file.write(json.dumps(entry) + "\n")
+
+    print(f"\nCleaned alerts saved to: {output_file}\nAlerts: {stats['alerts']}\nDuplicate IDs: {stats['duplicates']}")
+    print_preprocessing_stats(stats)
 
 # When the script is run directly, execute the function alerts_raw_preprocessing()
 if __name__ == "__main__":
-    alerts_raw_preprocessing()
+    parser = argparse.ArgumentParser(description="Clean and label a raw Wazuh/OpenSearch export")
+    parser.add_argument("--input", help="raw export jsonl (asked for if not given)")
+    parser.add_argument("--label", help="label of every alert, TP or FP (asked for if not given)")
+    parser.add_argument("--workers", type=int, nargs="?", const=0, metavar="N",
+                        help="parse the export in chunks with N processes (default: one per CPU), for multi-GB exports")
+    parser.add_argument("--minimise", action="store_true", help="minimise alerts (see MINIMISE_ALERTS)")
+    args = parser.parse_args()
+    if args.minimise:
+        MINIMISE_ALERTS = True
+    alerts_raw_preprocessing(args.input, args.label, args.workers)
\ No newline at end of file
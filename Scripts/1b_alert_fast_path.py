@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import re
+
+# Rules that resolve obvious alerts without an LLM, the first matching rule wins
+# match: every given condition must hold
+#   rule_ids: rule.id is one of the ids
+#   groups: rule.groups contains one of the groups
+#   decoders: decoder.name is one of the decoders
+#   fields: every dotted _source field matches its regex (re.search)
+FAST_PATH_RULES = [
+    {
+        "name": "wazuh_stats",
+        "match": {"groups": ["stats"]},
+        "classification": "FP",
+        "priority": "Low",
+        "reason": "Wazuh log volume statistics alert, no security event"
+    },
+    {
+        "name": "explorer_file_stream",
+        "match": {
+            "decoders": ["windows_eventchannel"],
+            "fields": {
+                "data.win.system.eventID": r"^15$",
+                "data.win.eventdata.image": r"(?i)\\explorer\.exe$",
+                "data.win.eventdata.targetFilename": r"(?i):(Zone\.Identifier|StreamedFileState)$"
+            }
+        },
+        "classification": "FP",
+        "priority": "Low",
+        "reason": "File stream metadata written by Explorer for downloaded or previewed files"
+    }
+]
+
+def get_field(source, field):
+    for key in field.split("."):
+        source = source.get(key) if isinstance(source, dict) else None
+    return source
+
+def load_rules(rules_file):
+    # Rules in the same format as FAST_PATH_RULES, from a json file
+    with open(rules_file, 'r', encoding='utf-8') as in_file:
+        return json.load(in_file)
+
+def compile_rules(rules):
+    # Precompile the regexes and index the rules by rule.id so each alert is only checked against its candidates
+    compiled = []
+    for position, rule in enumerate(rules):
+        match = rule.get("match", {})
+        compiled.append({
+            "position": position,
+            "rule": rule,
+            "groups": set(match.get("groups", [])),
+            "decoders": set(match.get("decoders", [])),
+            "fields": [(field, re.compile(pattern)) for field, pattern in match.get("fields", {}).items()]
+        })
+    by_rule_id = {}
+    any_rule_id = []
+    for compiled_rule in compiled:
+        rule_ids = compiled_rule["rule"].get("match", {}).get("rule_ids")
+        if rule_ids:
+            for rule_id in rule_ids:
+                by_rule_id.setdefault(str(rule_id), []).append(compiled_rule)
+        else:
+            any_rule_id.append(compiled_rule)
+    return {"by_rule_id": by_rule_id, "any_rule_id": any_rule_id}
+
+def rule_matches(compiled_rule, source):
+    rule = source.get('rule', {})
+    if compiled_rule["groups"] and not compiled_rule["groups"].intersection(rule.get('groups', [])):
+        return False
+    if compiled_rule["decoders"] and source.get('decoder', {}).get('name') not in compiled_rule["decoders"]:
+        return False
+    for field, pattern in compiled_rule["fields"]:
+        value = get_field(source, field)
+        if value is None or not pattern.search(str(value)):
+            return False
+    return True
+
+def match_alert(index, alert):
+    # Return the first matching rule (in the order of the rule list) or None
+    source = alert.get('_source', {}) if isinstance(alert, dict) else {}
+    rule_id = str(source.get('rule', {}).get('id'))
+    candidates = index["by_rule_id"].get(rule_id, []) + index["any_rule_id"]
+    for compiled_rule in sorted(candidates, key=lambda compiled_rule: compiled_rule["position"]):
+        if rule_matches(compiled_rule, source):
+            return compiled_rule["rule"]
+    return None
+
+def apply_fast_path(alert_rows, index, stats):
+    # Generator attaching a verdict to alerts matched by a rule, stage 3 passes these through without an API call
+    stats.setdefault('alerts', 0)
+    stats.setdefault('resolved', 0)
+    stats.setdefault('rules', {})
+    for alert_row in alert_rows:
+        stats['alerts'] += 1
+        rule = match_alert(index, alert_row.get('alert', {}))
+        if rule is not None:
+            stats['resolved'] += 1
+            stats['rules'][rule['name']] = stats['rules'].get(rule['name'], 0) + 1
+            alert_row.update({
+                'chatgpt_response': {
+                    "alert_id": alert_row.get('id', 'MISSING'),
+                    "classification": rule['classification'],
+                    "priority": rule['priority'],
+                    "justification": f"Fast path rule {rule['name']}: {rule['reason']}"
+                },
+                'triage_source': "fast_path",
+                'fast_path_rule': rule['name']
+            })
+        yield alert_row
+
+def print_fast_path_stats(stats):
+    print(f"\nAlerts: {stats['alerts']}")
+    print(f"Resolved by the fast path: {stats['resolved']} ({stats['resolved']/max(stats['alerts'], 1):.2%})")
+    for name, count in stats['rules'].items():
+        print(f"  {name}: {count}")
+
+def alert_fast_path(rules_file=None):
+    input_file = input("Enter the path to your jsonl file (e.g. alerts_preprocessed.jsonl): ").strip()
+    # remove file extension and keep name only
+    file_name = os.path.splitext(input_file)[0]
+    output_file = f"1b_{file_name}_fast_path.jsonl"
+    index = compile_rules(load_rules(rules_file) if rules_file else FAST_PATH_RULES)
+    stats = {}
+
+    with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
+        alert_rows = (json.loads(row.strip()) for row in in_file if row.strip())
+        for alert_row in apply_fast_path(alert_rows, index, stats):
+            out_file.write(json.dumps(alert_row) + "\n")
+
+    print_fast_path_stats(stats)
+    print(f"\nAlerts with fast path verdicts have been saved to: {output_file}")
+
+# When the script is run directly, execute the function alert_fast_path()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve obvious alerts with declarative rules before they reach the LLM")
+    parser.add_argument("--rules", help="json file with rules in the format of FAST_PATH_RULES (default: the built-in rules)")
+    args = parser.parse_args()
+    alert_fast_path(args.rules)
\ No newline at end of file
@@ -1,36 +1,192 @@
+import argparse
+import heapq
+import itertools
 import json
+import os
 import random
+import tempfile
 from datetime import datetime
 
-def merge_alerts_randomly():
+# Bytes of jsonl held in memory by the external shuffle before a sorted chunk is spilled to disk
+SPILL_BYTES = 64 * 1024 * 1024
+# Chunk files merged at once, more chunks are merged in several passes
+MERGE_FAN_IN = 256
+# Fields defining the strata of --test and --sample
+STRATA_FIELDS = ["label", "rule_priority"]
+
+def merge_rows(row_sources, seed=None):
+    # Combine rows of all sources and return them in random order (seed makes the order reproducible)
+    combined = []
+    for rows in row_sources:
+        combined.extend(rows)
+    random.Random(seed).shuffle(combined)
+    return combined
+
+def row_stratum(line):
+    row = json.loads(line)
+    return tuple(str(row.get(field, 'MISSING')) for field in STRATA_FIELDS)
+
+def spill(chunk, chunk_dir):
+    chunk.sort()
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=chunk_dir, suffix=".chunk", delete=False) as chunk_file:
+        chunk_file.writelines(chunk)
+    chunk.clear()
+    return chunk_file.name
+
+def merge_chunks(chunk_files, chunk_dir):
+    # Merge groups of chunk files until at most MERGE_FAN_IN are left
+    while len(chunk_files) > MERGE_FAN_IN:
+        merged = []
+        for start in range(0, len(chunk_files), MERGE_FAN_IN):
+            group = chunk_files[start:start + MERGE_FAN_IN]
+            in_files = [open(chunk_file, 'r', encoding='utf-8') for chunk_file in group]
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=chunk_dir, suffix=".chunk", delete=False) as out_file:
+                out_file.writelines(heapq.merge(*in_files))
+            for in_file, chunk_file in zip(in_files, group):
+                in_file.close()
+                os.remove(chunk_file)
+            merged.append(out_file.name)
+        chunk_files = merged
+    return chunk_files
+
+def shuffle_lines(input_files, seed, stats, stratify=False, spill_dir=None):
+    # Seeded external shuffle: every row gets a random 64 bit key, chunks of SPILL_BYTES are sorted by key and spilled,
+    # then all chunks are merged by key. The order only depends on the seed and the inputs, not on the chunk size.
+    # Generator of (stratum, line); stats['strata'] holds the rows per stratum (by STRATA_FIELDS with stratify) once the first line is yielded
+    rng = random.Random(seed)
+    # Stratum -> index stored in the chunk records
+    strata = {}
+    stats.setdefault('rows', 0)
+    stats['strata'] = {}
+    with tempfile.TemporaryDirectory(prefix="shuffle_", dir=spill_dir) as chunk_dir:
+        chunk_files = []
+        chunk = []
+        chunk_bytes = 0
+        for input_file in input_files:
+            with open(input_file, 'r', encoding='utf-8') as in_file:
+                for line in in_file:
+                    if not line.strip():
+                        continue
+                    if not line.endswith("\n"):
+                        line += "\n"
+                    stratum = row_stratum(line) if stratify else ()
+                    stratum_index = strata.setdefault(stratum, len(strata))
+                    stats['rows'] += 1
+                    stats['strata'][stratum] = stats['strata'].get(stratum, 0) + 1
+                    # Fixed width hex keys sort like the numbers, so the records are compared as plain strings
+                    chunk.append(f"{rng.getrandbits(64):016x}\t{stratum_index}\t{line}")
+                    chunk_bytes += len(line)
+                    if chunk_bytes >= SPILL_BYTES:
+                        chunk_files.append(spill(chunk, chunk_dir))
+                        chunk_bytes = 0
+        if chunk:
+            chunk_files.append(spill(chunk, chunk_dir))
+        stats['chunks'] = len(chunk_files)
+        chunk_files = merge_chunks(chunk_files, chunk_dir)
+
+        stratum_names = list(strata)
+        in_files = [open(chunk_file, 'r', encoding='utf-8') for chunk_file in chunk_files]
+        try:
+            for record in heapq.merge(*in_files):
+                _, stratum_index, line = record.split("\t", 2)
+                yield stratum_names[int(stratum_index)], line
+        finally:
+            for in_file in in_files:
+                in_file.close()
+
+def stratum_quotas(strata, fraction=None, size=None):
+    # Rows to select per stratum: a fraction of every stratum, or size rows in total split proportionally (largest remainder)
+    total = sum(strata.values())
+    if size is not None:
+        fraction = min(size, total) / max(total, 1)
+    exact = {stratum: count * fraction for stratum, count in strata.items()}
+    quotas = {stratum: int(value) for stratum, value in exact.items()}
+    target = round(total * fraction)
+    for stratum in sorted(exact, key=lambda stratum: exact[stratum] - quotas[stratum], reverse=True)[:max(target - sum(quotas.values()), 0)]:
+        quotas[stratum] += 1
+    return quotas
+
+def stratified_split(shuffled, quotas):
+    # The shuffled rows of a stratum are in random order, so its first quota rows are a random stratified sample
+    # Generator of (selected, line)
+    selected = {stratum: 0 for stratum in quotas}
+    for stratum, line in shuffled:
+        if selected[stratum] < quotas[stratum]:
+            selected[stratum] += 1
+            yield True, line
+        else:
+            yield False, line
+
+def print_strata(name, counts):
+    print(f"{name}: {sum(counts.values())} alerts")
+    for stratum, count in sorted(counts.items()):
+        print(f"  {' / '.join(stratum)}: {count}")
+
+def merge_files(input_files, output_file, seed, test_fraction=None, sample_size=None, spill_dir=None):
+    # Shuffle any number of labelled jsonl files with bounded memory, optionally split off a stratified test set or sample
+    stats = {}
+    stratify = test_fraction is not None or sample_size is not None
+    shuffled = shuffle_lines(input_files, seed, stats, stratify, spill_dir)
+    if not stratify:
+        with open(output_file, 'w', encoding='utf-8') as out_file:
+            out_file.writelines(line for _, line in shuffled)
+        print(f"\nMerged {stats['rows']} alerts (seed {seed}, {stats['chunks']} chunks) have been saved to: {output_file}\n")
+        return stats
+
+    # Start the generator so the strata are counted before the quotas are computed
+    first = next(shuffled, None)
+    rows = shuffled if first is None else itertools.chain([first], shuffled)
+    quotas = stratum_quotas(stats['strata'], test_fraction, sample_size)
+    base_name = os.path.splitext(output_file)[0]
+    if sample_size is not None:
+        output_files = {True: f"{base_name}_sample.jsonl"}
+    else:
+        output_files = {False: f"{base_name}_train.jsonl", True: f"{base_name}_test.jsonl"}
+    out_files = {selected: open(name, 'w', encoding='utf-8') for selected, name in output_files.items()}
+    try:
+        for selected, line in stratified_split(rows, quotas):
+            if selected in out_files:
+                out_files[selected].write(line)
+    finally:
+        for out_file in out_files.values():
+            out_file.close()
+
+    print(f"\nShuffled {stats['rows']} alerts (seed {seed}, {stats['chunks']} chunks)")
+    print_strata("All", stats['strata'])
+    if sample_size is not None:
+        print_strata("Sample", quotas)
+    else:
+        print_strata("Train", {stratum: count - quotas[stratum] for stratum, count in stats['strata'].items()})
+        print_strata("Test", quotas)
+    for name in output_files.values():
+        print(f"Saved to: {name}")
+    return stats
+
+def merge_alerts_randomly(input_files=None, seed=None, test_fraction=None, sample_size=None, spill_dir=None):
     # Prompt for input file
-    input_file_1 = input("Enter the path to your first jsonl file (e.g. TP_alerts.jsonl): ").strip()
-    input_file_2 = input("Enter the path to your second jsonl file (e.g. FP_alerts.jsonl): ").strip()
+    if not input_files:
+        input_file_1 = input("Enter the path to your first jsonl file (e.g. TP_alerts.jsonl): ").strip()
+        input_file_2 = input("Enter the path to your second jsonl file (e.g. FP_alerts.jsonl): ").strip()
+        input_files = [input_file_1, input_file_2]
+    # Without a seed a random one is drawn and printed, so every merged set can be reproduced
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
     # Create unique output files with timestamp information
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = f"2_alerts_merged_{timestamp}.jsonl"
 
-    # Read and combine entries from both files
-    combined = []
-
-    with open(input_file_1, 'r', encoding='utf-8') as in_file_1, open(input_file_2, 'r', encoding='utf-8') as in_file_2:
-        # Add file 1 to combined
-        for idx, row in enumerate(in_file_1):
-            combined.append(json.loads(row))
-        # Add file 2 to combined
-        for idx, row in enumerate(in_file_2):
-            combined.append(json.loads(row))
-    
-    # Shuffle combined entries
-    random.shuffle(combined)
-
-    # Write shuffled order to output
-    with open(output_file, 'w', encoding='utf-8') as out_file:
-        for row in combined:
-            out_file.write(json.dumps(row) + "\n")
-    
-    print(f"\nMerged alerts have been saved to: {output_file}\n")
+    merge_files(input_files, output_file, seed, test_fraction, sample_size, spill_dir)
 
 # When the script is run directly, execute the function merge_alerts_randomly()
 if __name__ == "__main__":
-    merge_alerts_randomly()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Merge labelled jsonl files in a reproducible random order")
+    parser.add_argument("--input", nargs="+", metavar="FILE", help="preprocessed jsonl files, any number (asked for two if not given)")
+    parser.add_argument("--seed", type=int, help="seed of the shuffle (default: random, printed)")
+    split = parser.add_mutually_exclusive_group()
+    split.add_argument("--test", type=float, metavar="FRACTION", help=f"also split into train and test files, stratified by {' and '.join(STRATA_FIELDS)}")
+    split.add_argument("--sample", type=int, metavar="N", help=f"only write a sample of N alerts, stratified by {' and '.join(STRATA_FIELDS)}")
+    parser.add_argument("--spill-dir", help="directory for the temporary chunk files (default: the system temp directory)")
+    args = parser.parse_args()
+    if args.test is not None and not 0 < args.test < 1:
+        parser.error("--test must be between 0 and 1")
+    merge_alerts_randomly(args.input, args.seed, args.test, args.sample, args.spill_dir)
\ No newline at end of file
@@ -0,0 +1,131 @@
+import json
+import hashlib
+import os
+import re
+
+# Fields of the alert's _source that change with every occurrence of the same event and are left out of the signature
+VOLATILE_FIELDS = [
+    "id",
+    "timestamp",
+    "rule.firedtimes",
+    "data.win.system.message",
+    "data.win.system.eventRecordID",
+    "data.win.system.systemTime",
+    "data.win.system.processID",
+    "data.win.system.threadID",
+    "data.win.eventdata.processId",
+    "data.win.eventdata.processGuid",
+    "data.win.eventdata.parentProcessId",
+    "data.win.eventdata.parentProcessGuid",
+    "data.win.eventdata.sourceProcessId",
+    "data.win.eventdata.sourceProcessGUID",
+    "data.win.eventdata.targetProcessId",
+    "data.win.eventdata.targetProcessGUID",
+    "data.win.eventdata.logonGuid",
+    "data.win.eventdata.logonId",
+    "data.win.eventdata.utcTime",
+    "data.win.eventdata.creationUtcTime",
+    "data.win.eventdata.previousCreationUtcTime",
+    "data.win.eventdata.sourcePort",
+    "data.srcport",
+    "data.flow_id",
+    "data.flow.src_port",
+    "data.tx_id"
+]
+# Patterns masked in all remaining string values
+MASK_PATTERNS = [
+    (re.compile(r'\{?[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\}?'), '<GUID>'),
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?'), '<TIME>'),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}\b'), '<TIME>'),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '<HEX>'),
+    (re.compile(r'\b(pid|process id|processid)[=: ]+\d+', re.IGNORECASE), r'\1=<PID>')
+]
+
+def remove_field(node, field):
+    *parents, leaf = field.split(".")
+    for parent in parents:
+        node = node.get(parent) if isinstance(node, dict) else None
+    if isinstance(node, dict):
+        node.pop(leaf, None)
+
+def mask_values(value):
+    # Recursively mask GUIDs, timestamps, hex ids and PIDs in string values
+    if isinstance(value, dict):
+        return {key: mask_values(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [mask_values(item) for item in value]
+    if isinstance(value, str):
+        for pattern, replacement in MASK_PATTERNS:
+            value = pattern.sub(replacement, value)
+    return value
+
+def alert_signature(alert):
+    # Normalised signature: identical for alerts that only differ in GUIDs, PIDs and timestamps
+    source = alert.get('_source', {}) if isinstance(alert, dict) else {}
+    # Copy via json so the alert itself is not modified
+    source = json.loads(json.dumps(source))
+    for field in VOLATILE_FIELDS:
+        remove_field(source, field)
+    normalised = json.dumps(mask_values(source), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(normalised.encode("utf-8")).hexdigest()
+
+def tag_clusters(read_rows, stats):
+    # Generator tagging rows with their cluster, read_rows() must return a fresh iterator over the rows for each pass
+    # First pass: count cluster sizes (only signatures are kept in memory)
+    cluster_sizes = {}
+    cluster_labels = {}
+    for alert_row in read_rows():
+        signature = alert_signature(alert_row.get('alert', {}))
+        cluster_sizes[signature] = cluster_sizes.get(signature, 0) + 1
+        cluster_labels.setdefault(signature, set()).add(alert_row.get('label', 'MISSING'))
+
+    # Clusters whose members carry different ground truth labels indicate an over-eager signature
+    stats.update({
+        'alerts': sum(cluster_sizes.values()),
+        'clusters': len(cluster_sizes),
+        'largest_cluster': max(cluster_sizes.values(), default=0),
+        'mixed_label_clusters': sum(1 for labels in cluster_labels.values() if len(labels) > 1)
+    })
+
+    # Second pass: tag every alert, the first alert of each cluster is its representative
+    seen_signatures = set()
+    for alert_row in read_rows():
+        signature = alert_signature(alert_row.get('alert', {}))
+        alert_row.update({
+            'cluster_id': signature[:16],
+            'cluster_size': cluster_sizes[signature],
+            'cluster_representative': signature not in seen_signatures
+        })
+        seen_signatures.add(signature)
+        yield alert_row
+
+def read_jsonl(input_file):
+    with open(input_file, 'r', encoding='utf-8') as in_file:
+        for row in in_file:
+            yield json.loads(row.strip())
+
+def cluster_alerts(input_file, output_file):
+    stats = {}
+    with open(output_file, "w", encoding="utf-8") as out_file:
+        for alert_row in tag_clusters(lambda: read_jsonl(input_file), stats):
+            out_file.write(json.dumps(alert_row) + "\n")
+    return stats
+
+def alert_clustering():
+    input_file = input("Enter the path to your jsonl file (e.g. alerts_preprocessed_merged.jsonl): ").strip()
+    # remove file extension and keep name only
+    file_name = os.path.splitext(input_file)[0]
+    output_file = f"2b_{file_name}_clustered.jsonl"
+
+    stats = cluster_alerts(input_file, output_file)
+
+    print(f"\nAlerts: {stats['alerts']}")
+    print(f"Clusters (LLM calls needed): {stats['clusters']}")
+    print(f"Reduction: {stats['alerts']/max(stats['clusters'], 1):.2f}x")
+    print(f"Largest cluster: {stats['largest_cluster']}")
+    print(f"Clusters with mixed labels: {stats['mixed_label_clusters']}")
+    print(f"\nClustered alerts have been saved to: {output_file}")
+
+# When the script is run directly, execute the function alert_clustering()
+if __name__ == "__main__":
+    alert_clustering()
\ No newline at end of file
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import pickle
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+from sklearn.pipeline import make_pipeline
+from alert_tokens import alert_tokens, count_tokens
+
+# Alerts whose classification and priority are both predicted with at least this probability are resolved locally,
+# all others are escalated to the LLM in stage 3 (0.6 resolved about a quarter of runs 1-7 with 98% local accuracy, see --simulate)
+CLASSIFICATION_THRESHOLD = 0.6
+PRIORITY_THRESHOLD = 0.6
+MODEL_PATH = "ml_first_tier.pkl"
+# Fields that identify a single occurrence and would only let the model memorise alerts
+IGNORED_FIELDS = ["_index", "_id", "_version", "_score", "sort", "fields", "_source.id", "_source.timestamp"]
+# Thresholds compared by --simulate
+SIMULATION_THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99]
+# Estimated LLM cost for --simulate (USD per million tokens, gpt-4.1-mini)
+INPUT_PRICE_PER_MILLION_TOKENS = 0.40
+OUTPUT_PRICE_PER_MILLION_TOKENS = 1.60
+
+def flatten_alert(node, path=""):
+    # Yield "field=value" tokens for all leaves plus the single words of string values
+    if path in IGNORED_FIELDS:
+        return
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten_alert(value, f"{path}.{key}" if path else key)
+    elif isinstance(node, list):
+        for value in node:
+            yield from flatten_alert(value, path)
+    else:
+        value = str(node).lower()
+        yield f"{path}={value}".replace(" ", "_")
+        if isinstance(node, str):
+            for word in value.replace("\\", " ").replace("/", " ").split():
+                yield f"{path.rsplit('.', 1)[-1]}:{word}"
+
+def alert_text(alert):
+    # Whitespace separated feature tokens, tokenised again by the vectoriser
+    return " ".join(flatten_alert(alert))
+
+def new_model():
+    return make_pipeline(
+        TfidfVectorizer(token_pattern=r"\S+", lowercase=False, sublinear_tf=True),
+        LogisticRegression(max_iter=1000, class_weight="balanced")
+    )
+
+def read_labelled_rows(input_files):
+    # Rows with ground truth from preprocessed files or postprocessed result runs, an id is only used once
+    rows = {}
+    for input_file in input_files:
+        with open(input_file, 'r', encoding='utf-8') as in_file:
+            for row in in_file:
+                if row.strip():
+                    alert_row = json.loads(row)
+                    rows.setdefault(alert_row.get('id', 'MISSING'), alert_row)
+    return list(rows.values())
+
+def training_data(alert_rows):
+    texts = [alert_text(alert_row.get('alert', {})) for alert_row in alert_rows]
+    labels = [alert_row.get('label', 'MISSING').strip().upper() for alert_row in alert_rows]
+    priorities = [alert_row.get('rule_priority', 'MISSING').strip().capitalize() for alert_row in alert_rows]
+    return texts, labels, priorities
+
+def train_models(alert_rows):
+    texts, labels, priorities = training_data(alert_rows)
+    return {
+        "classification": new_model().fit(texts, labels),
+        "priority": new_model().fit(texts, priorities)
+    }
+
+def save_models(models, model_path):
+    with open(model_path, "wb") as model_file:
+        pickle.dump(models, model_file)
+
+def load_models(model_path):
+    with open(model_path, "rb") as model_file:
+        return pickle.load(model_file)
+
+def predict(models, texts):
+    # Return (classifications, classification confidences, priorities, priority confidences)
+    results = []
+    for name in ("classification", "priority"):
+        probabilities = models[name].predict_proba(texts)
+        results.append(models[name].classes_[probabilities.argmax(axis=1)])
+        results.append(probabilities.max(axis=1))
+    return results
+
+def score_alerts(models, alert_rows, stats):
+    # Generator scoring every alert, confident verdicts are attached so stage 3 passes them through without an API call
+    stats.setdefault('alerts', 0)
+    stats.setdefault('resolved', 0)
+    for alert_row in alert_rows:
+        stats['alerts'] += 1
+        # Alerts already resolved (e.g. by the fast path) are left alone
+        if 'chatgpt_response' in alert_row:
+            yield alert_row
+            continue
+        classifications, classification_confidences, priorities, priority_confidences = predict(models, [alert_text(alert_row.get('alert', {}))])
+        alert_row.update({
+            'ml_classification': str(classifications[0]),
+            'ml_priority': str(priorities[0]),
+            'ml_confidence': round(float(min(classification_confidences[0], priority_confidences[0])), 4)
+        })
+        if classification_confidences[0] >= CLASSIFICATION_THRESHOLD and priority_confidences[0] >= PRIORITY_THRESHOLD:
+            stats['resolved'] += 1
+            alert_row.update({
+                'chatgpt_response': {
+                    "alert_id": alert_row.get('id', 'MISSING'),
+                    "classification": str(classifications[0]),
+                    "priority": str(priorities[0]),
+                    "justification": f"Local first tier model (confidence {alert_row['ml_confidence']:.2f})"
+                },
+                'triage_source': "ml"
+            })
+        yield alert_row
+
+def print_scoring_stats(stats):
+    print(f"\nAlerts: {stats['alerts']}")
+    print(f"Resolved by the local model: {stats['resolved']}")
+    print(f"Escalation rate: {1 - stats['resolved']/max(stats['alerts'], 1):.2%}")
+
+def llm_cost(alert_row):
+    # Estimated cost of the LLM call for one alert
+    input_tokens = alert_tokens(alert_row.get('alert', {}))
+    output_tokens = count_tokens(json.dumps(alert_row.get('chatgpt_response', {})))
+    return (input_tokens * INPUT_PRICE_PER_MILLION_TOKENS + output_tokens * OUTPUT_PRICE_PER_MILLION_TOKENS) / 1e6
+
+def simulate_cascade(run_file, n_splits=5):
+    # Compare an LLM run with and without the local first tier, the local verdicts come from cross-validation
+    # so no alert is scored by a model that was trained on it
+    alert_rows = read_labelled_rows([run_file])
+    texts, labels, priorities = training_data(alert_rows)
+    labels = np.array(labels)
+    priorities = np.array(priorities)
+    llm_labels = np.array([alert_row.get('chatgpt_classification', 'MISSING') for alert_row in alert_rows])
+    llm_priorities = np.array([alert_row.get('chatgpt_priority', 'MISSING') for alert_row in alert_rows])
+    costs = np.array([llm_cost(alert_row) for alert_row in alert_rows])
+
+    predictions = {}
+    for name, targets in (("classification", labels), ("priority", priorities)):
+        folds = StratifiedKFold(n_splits=min(n_splits, np.unique(targets, return_counts=True)[1].min()), shuffle=True, random_state=0)
+        model = new_model()
+        probabilities = cross_val_predict(model, texts, targets, cv=folds, method="predict_proba")
+        classes = np.unique(targets)
+        predictions[name] = (classes[probabilities.argmax(axis=1)], probabilities.max(axis=1))
+    ml_labels, label_confidences = predictions["classification"]
+    ml_priorities, priority_confidences = predictions["priority"]
+
+    rows = [{
+        "threshold": "LLM only",
+        "escalation_rate": 1.0,
+        "classification_accuracy": (llm_labels == labels).mean(),
+        "priority_accuracy": (llm_priorities == priorities).mean(),
+        "local_accuracy": np.nan,
+        "estimated_cost_usd": costs.sum()
+    }]
+    for threshold in SIMULATION_THRESHOLDS:
+        # The simulated threshold applies to both classification and priority
+        escalated = (label_confidences < threshold) | (priority_confidences < threshold)
+        cascade_labels = np.where(escalated, llm_labels, ml_labels)
+        cascade_priorities = np.where(escalated, llm_priorities, ml_priorities)
+        local = ~escalated
+        rows.append({
+            "threshold": threshold,
+            "escalation_rate": escalated.mean(),
+            "classification_accuracy": (cascade_labels == labels).mean(),
+            "priority_accuracy": (cascade_priorities == priorities).mean(),
+            "local_accuracy": (ml_labels[local] == labels[local]).mean() if local.any() else np.nan,
+            "estimated_cost_usd": costs[escalated].sum()
+        })
+    return rows
+
+def print_simulation(run_file, rows):
+    print(f"\nCascade simulation for {run_file} (local verdicts cross-validated)")
+    print(f"{'Threshold':>10} {'Escalated':>10} {'Class. acc.':>12} {'Prio. acc.':>11} {'Local acc.':>11} {'Cost (USD)':>11}")
+    for row in rows:
+        threshold = row['threshold'] if isinstance(row['threshold'], str) else f"{row['threshold']:.2f}"
+        print(f"{threshold:>10} {row['escalation_rate']:>10.2%} {row['classification_accuracy']:>12.4f} "
+              f"{row['priority_accuracy']:>11.4f} {row['local_accuracy']:>11.4f} {row['estimated_cost_usd']:>11.4f}")
+
+def alert_ml_first_tier(model_path=MODEL_PATH):
+    input_file = input("Enter the path to your jsonl file (e.g. alerts_preprocessed_merged.jsonl): ").strip()
+    # remove file extension and keep name only
+    file_name = os.path.splitext(input_file)[0]
+    output_file = f"2c_{file_name}_ml_scored.jsonl"
+    models = load_models(model_path)
+    stats = {}
+
+    with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
+        alert_rows = (json.loads(row.strip()) for row in in_file if row.strip())
+        for alert_row in score_alerts(models, alert_rows, stats):
+            out_file.write(json.dumps(alert_row) + "\n")
+
+    print_scoring_stats(stats)
+    print(f"\nScored alerts have been saved to: {output_file}")
+
+# When the script is run directly, execute the function alert_ml_first_tier()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve confidently predicted alerts with a local model and escalate the rest to the LLM")
+    parser.add_argument("--train", nargs="+", metavar="FILE", help="train the model on labelled jsonl files (preprocessed or result runs)")
+    parser.add_argument("--simulate", nargs="+", metavar="RUN_FILE", help="compare postprocessed LLM runs with and without the cascade")
+    parser.add_argument("--model-file", default=MODEL_PATH, help=f"where the trained model is stored (default {MODEL_PATH})")
+    args = parser.parse_args()
+    if args.train:
+        alert_rows = read_labelled_rows(args.train)
+        save_models(train_models(alert_rows), args.model_file)
+        print(f"Trained on {len(alert_rows)} alerts, model saved to: {args.model_file}")
+    elif args.simulate:
+        for run_file in args.simulate:
+            print_simulation(run_file, simulate_cascade(run_file))
+    else:
+        alert_ml_first_tier(args.model_file)
\ No newline at end of file
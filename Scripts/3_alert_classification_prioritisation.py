@@ -1,141 +1,910 @@
-from openai import OpenAI
+from llm_backends import PROVIDERS, build_request, query_model_async, query_model_stream_async, close_async_clients, provider_for_model, batch_request_line, batch_result
+from verdict_cache import VerdictCache, cache_key
+from alert_tokens import alert_tokens
+from prompt_builder import ordered_alert, serialise_alert, load_examples, static_prefix_tokens
+from telemetry import CallTelemetry, call_cost, print_telemetry, write_prometheus
+import argparse
+import asyncio
+import importlib
 import json
+import os
+import re
 import time
+from collections import Counter, deque
+from contextlib import ExitStack
 from datetime import datetime
 
+# Stage 4 decides which verdicts are valid, the stage scripts start with a digit and can only be imported via importlib
+postprocessing = importlib.import_module("4_alert_postprocessing")
+
 # Configuration
 MODEL = "gpt-4.1-mini"
+# Provider from llm_backends.PROVIDERS, None selects it from the model name (e.g. deepseek-reasoner -> deepseek)
+PROVIDER = None
+# Maximum number of API requests running at the same time (1 = one alert after the other)
+CONCURRENCY = 8
+# Maximum number of alerts read ahead of the output writer
+MAX_IN_FLIGHT = 64
+# On-disk verdict cache keyed on the canonicalised alert, model and prompt (None disables caching)
+CACHE_PATH = "verdict_cache.sqlite"
+CACHE_TTL_DAYS = 30
+CACHE_MAX_ENTRIES = 100000
+# Alerts packed into one request (1 = one request per alert)
+BATCH_SIZE = 1
+# Upper bound for the estimated input tokens of one batched request
+BATCH_TOKEN_BUDGET = 60000
+# Flush and fsync the output after every row so a crash loses no finished alert (see --resume)
+FSYNC_EVERY_ROW = True
+# Limits of one offline batch input file (--batch-export), larger exports are split into parts
+BATCH_FILE_MAX_REQUESTS = 50000
+BATCH_FILE_MAX_BYTES = 200 * 1024 * 1024
+# Per-call telemetry (latency, request size, tokens, retries, cost) is appended to this jsonl file (None = only in the rows)
+METRICS_PATH = None
+# Prometheus text file written with the run summary (None = no export)
+PROMETHEUS_PATH = None
+# Stream single-alert responses and hand out the routing decision (classification and priority) as soon as both
+# fields are complete, the justification follows with the finished row
+STREAM_RESPONSES = False
+# Routing decisions are appended to this jsonl file the moment they are known (streaming only, None = not written)
+DECISIONS_PATH = None
+# Cap of generated tokens per request, reasoning included (None = provider default), and the reasoning effort
+# of OpenAI reasoning models (low/medium/high, None = default). A verdict cut off after its decision keeps the decision
+MAX_OUTPUT_TOKENS = None
+REASONING_EFFORT = None
+# Serialise alerts with a deterministic key order, shared fields first, so providers' prompt prefix caching applies
+# to more of each request (see prompt_builder.py). Off by default so the published runs can be reproduced
+PREFIX_CACHE_LAYOUT = False
+# Fixed few-shot (alert, verdict) examples sent after the system prompt with every single-alert request (--few-shot)
+FEW_SHOT_EXAMPLES = []
+# Maximum concurrent requests per provider in a --sweep, providers not listed use CONCURRENCY
+SWEEP_PROVIDER_CONCURRENCY = {
+    "openai": 16,
+    "deepseek": 8
+}
+
+SYSTEM_PROMPT = (
+    "You are a cybersecurity expert working as a SOC analyst assistant. "
+    "Classify the security alert as TP (True Positive) or FP (False Positive) "
+    "and assign a Priority: Low, Medium, High or Critical. "
+)
+# Appended to the system prompt for providers without json schema support (DeepSeek)
+JSON_FORMAT_PROMPT = (
+    "Always respond in this exact JSON format:"
+    '{"id": "alert_id", "classification": "TP or FP", '
+    '"priority": "Low/Medium/High/Critical", "justification": "short explanation"}'
+)
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "alert_id": {
+            "type": "string"
+        },
+        "classification": {
+            "type": "string"
+        },
+        "priority": {
+            "type": "string"
+        },
+        "justification": {
+            "type": "string"
+        }
+    },
+    "required": [
+        "alert_id",
+        "classification",
+        "priority",
+        "justification"
+    ],
+    "additionalProperties": False
+}
+# Batch mode: the user message is a json array of {"alert_id", "alert"} objects
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + (
+    "You receive a JSON array of security alerts, each with its alert_id. "
+    "Return exactly one verdict per alert in the verdicts array and copy the alert_id of the alert it belongs to. "
+)
+BATCH_JSON_FORMAT_PROMPT = (
+    "Always respond in this exact JSON format:"
+    '{"verdicts": [{"alert_id": "alert_id", "classification": "TP or FP", '
+    '"priority": "Low/Medium/High/Critical", "justification": "short explanation"}]}'
+)
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "verdicts": {
+            "type": "array",
+            "items": RESPONSE_SCHEMA
+        }
+    },
+    "required": [
+        "verdicts"
+    ],
+    "additionalProperties": False
+}
+
+def alert_content(alert):
+    # The alert as it is sent in the user message
+    return serialise_alert(alert) if PREFIX_CACHE_LAYOUT else json.dumps(alert)
+
+def alert_request(alert, model=None, provider=None, user_content=None):
+    # Request body for one alert, sent to the API or written to an offline batch file
+    # Static content (system prompt, schema, few-shot examples) comes first, the alert last
+    # user_content: the already serialised alert (a sweep serialises each alert once for all models)
+    if user_content is None:
+        user_content = alert_content(alert)
+    model = model or MODEL
+    return build_request(model, SYSTEM_PROMPT, user_content, "classified_alert", RESPONSE_SCHEMA, JSON_FORMAT_PROMPT, provider or PROVIDER,
+                         MAX_OUTPUT_TOKENS, REASONING_EFFORT, FEW_SHOT_EXAMPLES)
+
+# Completed string values of the routing fields in a partial json response
+DECISION_PATTERNS = {field: re.compile(rf'"{field}"\s*:\s*"((?:[^"\\]|\\.)*)"') for field in ("classification", "priority")}
+# Open file of DECISIONS_PATH
+_decisions_file = None
+
+def partial_decision(text):
+    # {"classification", "priority"} once both fields are complete in the streamed text, None before
+    decision = {}
+    for field, pattern in DECISION_PATTERNS.items():
+        match = pattern.search(text)
+        if match is None:
+            return None
+        decision[field] = json.loads(f'"{match.group(1)}"')
+    return decision
+
+def emit_decision(alert_id, decision):
+    # Hand the routing decision to the analyst queue before the justification is finished
+    global _decisions_file
+    if DECISIONS_PATH is None:
+        return
+    if _decisions_file is None:
+        _decisions_file = open(DECISIONS_PATH, "a", encoding="utf-8")
+    _decisions_file.write(json.dumps({"id": alert_id, "model": MODEL, "timestamp": time.time(), **decision}) + "\n")
+    _decisions_file.flush()
+
+def close_decisions():
+    global _decisions_file
+    if _decisions_file is not None:
+        _decisions_file.close()
+        _decisions_file = None
+
+async def query_chatgpt(semaphore, alert, alert_id=None):
+    # Query the model and return (json response, timing)
+    body = alert_request(alert)
+    # Wait for a free request slot
+    async with semaphore:
+        if not STREAM_RESPONSES:
+            return await query_model_async(body, PROVIDER)
+        decision = {}
+
+        def on_text(text):
+            found = partial_decision(text)
+            if found is None:
+                return False
+            decision.update(found)
+            emit_decision(alert_id, found)
+            return True
+
+        chatgpt_response, timing = await query_model_stream_async(body, PROVIDER, on_text)
+    if chatgpt_response is None and decision:
+        # Cut off (e.g. at MAX_OUTPUT_TOKENS) after the decision was complete
+        chatgpt_response = {"alert_id": alert_id, **decision, "justification": "TRUNCATED"}
+        timing['truncated'] = True
+    return chatgpt_response, timing
+
+async def query_chatgpt_batch(semaphore, alert_rows):
+    # Query the model for several alerts at once and return (json response, timing)
+    user_content = json.dumps([
+        {"alert_id": alert_row.get('id', 'MISSING'), "alert": ordered_alert(alert_row.get('alert', 'MISSING')) if PREFIX_CACHE_LAYOUT else alert_row.get('alert', 'MISSING')}
+        for alert_row in alert_rows
+    ])
+    body = build_request(MODEL, BATCH_SYSTEM_PROMPT, user_content, "classified_alerts", BATCH_RESPONSE_SCHEMA, BATCH_JSON_FORMAT_PROMPT, PROVIDER,
+                         MAX_OUTPUT_TOKENS, REASONING_EFFORT)
+    async with semaphore:
+        return await query_model_async(body, PROVIDER)
+
+def split_batch_response(response, ids):
+    # Map verdicts back to alerts by alert_id, ids that are missing or returned more than once are left out
+    verdicts = response.get('verdicts') if isinstance(response, dict) else None
+    if not isinstance(verdicts, list):
+        return {}
+    verdicts = [verdict for verdict in verdicts if isinstance(verdict, dict)]
+    id_counts = Counter(verdict.get('alert_id') for verdict in verdicts)
+    return {
+        verdict['alert_id']: verdict
+        for verdict in verdicts
+        if verdict.get('alert_id') in ids and id_counts[verdict['alert_id']] == 1
+    }
+
+def build_result_row(alert_row, chatgpt_response):
+    # Extract ChatGPT fields
+    # Malformed values (e.g. null from a model without schema support) are kept as text for stage 4 to repair
+    chatgpt_classification = str(chatgpt_response.get('classification', 'MISSING')).strip().upper()
+    chatgpt_priority = str(chatgpt_response.get('priority', 'MISSING')).strip().capitalize()
+    chatgpt_justification = chatgpt_response.get('justification', 'MISSING')
+
+    # Get ground truth
+    label = alert_row.get('label', 'MISSING').upper()
+    rule_priority = alert_row.get('rule_priority', 'MISSING')
+
+    # Check for matches
+    classification_match = (chatgpt_classification == label)
+    priority_match = (chatgpt_priority == rule_priority)
+
+    # Update alert
+    alert_row.update({
+        'chatgpt_response': chatgpt_response,
+        'chatgpt_classification': chatgpt_classification,
+        'chatgpt_priority': chatgpt_priority,
+        'chatgpt_justification': chatgpt_justification,
+        'classification_match': classification_match,
+        'priority_match': priority_match,
+        # Failed alerts are retried by --resume
+        'triage_status': "error" if chatgpt_classification == "ERROR" else "ok"
+    })
+    return alert_row
+
+def alert_cache_key(alert):
+    # Batched verdicts come from a different prompt and are cached separately
+    if BATCH_SIZE > 1:
+        return cache_key(alert, MODEL, BATCH_SYSTEM_PROMPT, BATCH_JSON_FORMAT_PROMPT, BATCH_RESPONSE_SCHEMA, *prompt_variant())
+    return cache_key(alert, MODEL, SYSTEM_PROMPT, JSON_FORMAT_PROMPT, RESPONSE_SCHEMA, *prompt_variant())
+
+def prompt_variant():
+    # Layout, few-shot examples and output limits shape the verdict too, the default prompt keeps its earlier cache keys
+    variant = []
+    if PREFIX_CACHE_LAYOUT or FEW_SHOT_EXAMPLES:
+        variant += [PREFIX_CACHE_LAYOUT, FEW_SHOT_EXAMPLES]
+    if MAX_OUTPUT_TOKENS or REASONING_EFFORT:
+        variant.append({"max_output_tokens": MAX_OUTPUT_TOKENS, "reasoning_effort": REASONING_EFFORT})
+    return variant
+
+def resolve_locally(cache, alert_row):
+    # Return (alert_row, None) if the alert needs no API call, None otherwise
+    id = alert_row.get('id', 'MISSING')
+    # Reuse the response if the alert has already been processed
+    if 'chatgpt_response' in alert_row:
+        return build_result_row(alert_row, alert_row['chatgpt_response']), None
+    # Serve repeated alerts from the verdict cache
+    if cache is not None:
+        cached_response = cache.get(alert_cache_key(alert_row.get('alert', 'MISSING')))
+        # Invalid verdicts cached by earlier versions are queried again
+        if cached_response is not None and valid_verdict(cached_response):
+            alert_row['cache_hit'] = True
+            alert_row['model'] = MODEL
+            return build_result_row(alert_row, dict(cached_response, alert_id=id)), None
+    return None
 
-def query_chatgpt(alert):
-    client = OpenAI(api_key="<api key removed>")
-    # Query ChatGPT and return json response
-    system_prompt = (
-        "You are a cybersecurity expert working as a SOC analyst assistant. "
-        "Classify the security alert as TP (True Positive) or FP (False Positive) "
-        "and assign a Priority: Low, Medium, High or Critical. "
-    )
-    
+def valid_verdict(chatgpt_response):
+    # Whether the classification and priority of a response normalise to allowed values and it has a justification
+    # (stage 4's validation), only valid verdicts are cached so re-runs and --repair query the invalid ones again
+    if not isinstance(chatgpt_response, dict):
+        return False
+    verdict = {
+        'chatgpt_classification': postprocessing.normalize_classification(chatgpt_response.get('classification', 'MISSING')),
+        'chatgpt_priority': postprocessing.normalize_priority(chatgpt_response.get('priority', 'MISSING')),
+        'chatgpt_justification': chatgpt_response.get('justification', 'MISSING')
+    }
+    return not postprocessing.validation_errors(verdict)
+
+def finish_alert(cache, alert_row, chatgpt_response, timing, batch_size=1, model=None):
+    # Build the result row from a model response (None = failed request)
+    id = alert_row.get('id', 'MISSING')
+    # A repaired verdict replaces the invalid one under the same key (see stage 4 --repair)
+    # Streamed responses cut off before the justification are not cached, a later run queries them in full
+    truncated = timing is not None and timing.get('truncated')
+    if chatgpt_response is not None and cache is not None and not truncated and valid_verdict(chatgpt_response):
+        cache.put(alert_cache_key(alert_row.get('alert', 'MISSING')), MODEL, chatgpt_response)
+    if chatgpt_response is None:
+        chatgpt_response = {
+            "alert_id": id,
+            "classification": "ERROR",
+            "priority": "ERROR",
+            "justification": "ERROR"
+        }
+    # Rows ingested from the Batch API have no per-call timing
+    if timing is not None:
+        timing['cost_usd'] = call_cost(timing)
+        alert_row['telemetry'] = timing
+    alert_row['model'] = model or MODEL
+    alert_row['cache_hit'] = False
+    alert_row['batch_size'] = batch_size
+    return build_result_row(alert_row, chatgpt_response), timing
+
+async def triage_alert(semaphore, cache, alert_row):
+    result = resolve_locally(cache, alert_row)
+    if result is not None:
+        return result
+    # Query the model
+    chatgpt_response, timing = await query_chatgpt(semaphore, alert_row.get('alert', 'MISSING'), alert_row.get('id', 'MISSING'))
+    return finish_alert(cache, alert_row, chatgpt_response, timing)
+
+async def triage_batch(semaphore, cache, batch):
+    # batch: list of (alert_row, result future), every future receives (alert_row, timing)
+    try:
+        alert_rows = [alert_row for alert_row, _ in batch]
+        response, timing = await query_chatgpt_batch(semaphore, alert_rows)
+        verdicts = split_batch_response(response, {alert_row.get('id', 'MISSING') for alert_row in alert_rows})
+        retries = []
+        # The request is counted once per batch, the other rows only carry its timing in their telemetry
+        call_timing = timing
+        for alert_row, result in batch:
+            verdict = verdicts.get(alert_row.get('id', 'MISSING'))
+            if verdict is None:
+                retries.append((alert_row, result))
+                continue
+            alert_row, _ = finish_alert(cache, alert_row, verdict, timing, len(batch))
+            result.set_result((alert_row, call_timing))
+            call_timing = None
+        # Retry alerts without a (unique) verdict one by one
+        if retries:
+            print(f"Batch of {len(batch)} alerts returned no unique verdict for {len(retries)} alerts, retrying individually")
+        for (alert_row, result), (chatgpt_response, retry_timing) in zip(retries, await asyncio.gather(
+            *(query_chatgpt(semaphore, alert_row.get('alert', 'MISSING'), alert_row.get('id', 'MISSING')) for alert_row, _ in retries)
+        )):
+            alert_row['batch_retry'] = True
+            result.set_result(finish_alert(cache, alert_row, chatgpt_response, retry_timing))
+    except Exception as e:
+        for _, result in batch:
+            if not result.done():
+                result.set_exception(e)
+        raise
+
+async def triage_cluster_representative(triage, cluster_verdict):
+    # Triage the first alert of a cluster and share its verdict with the other members
     try:
-        # Start API timing
-        start_time = time.perf_counter()
-        response = client.responses.create(
-            model=MODEL,
-            input=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": json.dumps(alert)}
-            ],
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "classified_alert",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "alert_id": {
-                                "type": "string"
-                            },
-                            "classification": {
-                                "type": "string"
-                            },
-                            "priority": {
-                                "type": "string"
-                            },
-                            "justification": {
-                                "type": "string"
-                            }
-                        },
-                        "required": [
-                            "alert_id",
-                            "classification",
-                            "priority",
-                            "justification"
-                        ],
-                        "additionalProperties": False
-                    }
-                }
-            }
-        )
-        # Calculate API duration
-        api_time = time.perf_counter() - start_time
-        content = response.output_text
-        return json.loads(content), api_time
+        result = await triage
     except Exception as e:
-        print(f"Error querying ChatGPT: {e}")
+        cluster_verdict.set_exception(e)
+        raise
+    cluster_verdict.set_result(result[0]['chatgpt_response'])
+    return result
+
+async def triage_cluster_member(cluster_verdict, alert_row):
+    # Reuse the representative's verdict without another API call
+    chatgpt_response = await cluster_verdict
+    return build_result_row(alert_row, dict(chatgpt_response, alert_id=alert_row.get('id', 'MISSING'))), None
+
+async def triage_alerts(alert_rows, cache=None):
+    # Yield (alert_row, timing) in input order while up to CONCURRENCY requests run in the background
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    in_flight = deque()
+    # Verdict of each cluster seen so far (alerts tagged by 2b_alert_clustering.py)
+    cluster_verdicts = {}
+    # Batch mode: alerts waiting for the next request as (alert_row, result future, entry in in_flight)
+    batch = []
+    batch_tokens = 0
+    batch_tasks = set()
+
+    def send_batch():
+        nonlocal batch, batch_tokens
+        if batch:
+            task = asyncio.create_task(triage_batch(semaphore, cache, [(alert_row, result) for alert_row, result, _ in batch]))
+            # Keep a reference until the batch is done
+            batch_tasks.add(task)
+            task.add_done_callback(batch_tasks.discard)
+            batch, batch_tokens = [], 0
+
+    def queue_for_batch(alert_row):
+        nonlocal batch_tokens
+        result = loop.create_future()
+        local_result = resolve_locally(cache, alert_row)
+        if local_result is not None:
+            result.set_result(local_result)
+            return result
+        # Start a new request if this alert would exceed the token budget
+        tokens = alert_tokens(alert_row.get('alert', 'MISSING'))
+        if batch and batch_tokens + tokens > BATCH_TOKEN_BUDGET:
+            send_batch()
+        batch.append([alert_row, result, None])
+        batch_tokens += tokens
+        return result
+
+    for alert_row in alert_rows:
+        cluster_id = alert_row.get('cluster_id')
+        if cluster_id is not None and cluster_id in cluster_verdicts:
+            entry = asyncio.create_task(triage_cluster_member(cluster_verdicts[cluster_id], alert_row))
+        else:
+            if BATCH_SIZE > 1:
+                triage = queue_for_batch(alert_row)
+            else:
+                triage = triage_alert(semaphore, cache, alert_row)
+            if cluster_id is not None:
+                cluster_verdicts[cluster_id] = loop.create_future()
+                triage = triage_cluster_representative(triage, cluster_verdicts[cluster_id])
+            entry = asyncio.ensure_future(triage)
+        # Remember which in-flight entry waits for the open batch
+        if batch and batch[-1][2] is None:
+            batch[-1][2] = entry
+        in_flight.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            send_batch()
+        # Hand out every alert at the head of the queue that is already finished
+        while in_flight and in_flight[0].done():
+            yield in_flight.popleft().result()
+        # Stop reading ahead once the in-flight queue is full
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            # The oldest alert cannot finish while its batch has not been sent
+            if batch and batch[0][2] is in_flight[0]:
+                send_batch()
+            yield await in_flight.popleft()
+    # Send the last partial batch and drain remaining alerts
+    send_batch()
+    while in_flight:
+        yield await in_flight.popleft()
+
+def parse_sweep_model(spec):
+    # "MODEL" or "MODEL:PROVIDER" of --sweep
+    model, _, provider = spec.partition(":")
+    provider = provider or provider_for_model(model)
+    if provider not in PROVIDERS:
+        raise SystemExit(f"Unknown provider {provider} for {model} (known: {', '.join(PROVIDERS)})")
+    return {"name": spec.replace(":", "_"), "model": model, "provider": provider}
+
+async def sweep_model(semaphores, sweep_model_config, user_content, alert_row):
+    # One model's verdict for an alert as (model name, alert_row, timing), the row is a copy per model
+    alert_row = dict(alert_row)
+    name = sweep_model_config['name']
+    # Verdicts from the fast path or the local model are the same for every model
+    if 'chatgpt_response' in alert_row:
+        return name, build_result_row(alert_row, alert_row['chatgpt_response']), None
+    body = alert_request(None, sweep_model_config['model'], sweep_model_config['provider'], user_content)
+    async with semaphores[sweep_model_config['provider']]:
+        chatgpt_response, timing = await query_model_async(body, sweep_model_config['provider'])
+    alert_row, timing = finish_alert(None, alert_row, chatgpt_response, timing, model=sweep_model_config['model'])
+    return name, alert_row, timing
+
+async def sweep_alerts(alert_rows, sweep_models):
+    # Yield (model name, alert_row, timing) for every alert and model, alerts in input order,
+    # the requests of all models run concurrently under one limit per provider
+    semaphores = {
+        provider: asyncio.Semaphore(SWEEP_PROVIDER_CONCURRENCY.get(provider, CONCURRENCY))
+        for provider in {sweep_model_config['provider'] for sweep_model_config in sweep_models}
+    }
+    in_flight = deque()
+    for alert_row in alert_rows:
+        # The alert is serialised once and sent to every model
+        user_content = alert_content(alert_row.get('alert', 'MISSING'))
+        in_flight.append(asyncio.ensure_future(asyncio.gather(*(
+            sweep_model(semaphores, sweep_model_config, user_content, alert_row) for sweep_model_config in sweep_models
+        ))))
+        while in_flight and in_flight[0].done():
+            for result in in_flight.popleft().result():
+                yield result
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            for result in await in_flight.popleft():
+                yield result
+    while in_flight:
+        for result in await in_flight.popleft():
+            yield result
+
+async def write_sweep(input_file, output_files, sweep_models, stats):
+    try:
+        with ExitStack() as files, open(input_file, 'r', encoding='utf-8') as in_file:
+            out_files = {name: files.enter_context(open(output_file, "w", encoding="utf-8")) for name, output_file in output_files.items()}
+            alert_rows = (json.loads(row.strip()) for row in in_file if row.strip())
+            async for name, alert_row, timing in sweep_alerts(alert_rows, sweep_models):
+                record_stats(stats, alert_row, timing)
+                append_row(out_files[name], alert_row)
+    finally:
+        await close_async_clients()
+
+def sweep(input_file, model_specs):
+    # Triage the alerts with several models in one pass, one output file per model
+    # The verdict cache is not used so every model is actually queried
+    script_start = time.perf_counter()
+    sweep_models = [parse_sweep_model(spec) for spec in model_specs]
+    stats = new_stats()
+    stats['models'] = [sweep_model_config['model'] for sweep_model_config in sweep_models]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_files = {
+        sweep_model_config['name']: f"3_alerts_classified_prioritised_{timestamp}_{sweep_model_config['name']}.jsonl"
+        for sweep_model_config in sweep_models
+    }
+    asyncio.run(write_sweep(input_file, output_files, sweep_models, stats))
+
+    print_stats(stats, time.perf_counter() - script_start)
+    print("\nAlerts processed by each model have been saved to:")
+    for output_file in output_files.values():
+        print(f"  {output_file}")
+    print(f"Compare the models with: python 5_result_evaluation.py --runs {' '.join(output_files.values())}")
+
+def open_cache():
+    if CACHE_PATH is None:
         return None
-    
-def process_alerts():
+    return VerdictCache(CACHE_PATH, ttl_seconds=CACHE_TTL_DAYS * 86400, max_entries=CACHE_MAX_ENTRIES)
+
+def read_journal(output_file):
+    # Status of every alert in an existing output file, the last entry of an id wins
+    statuses = {}
+    with open(output_file, 'r', encoding='utf-8') as journal:
+        for row in journal:
+            try:
+                alert_row = json.loads(row)
+            except json.JSONDecodeError:
+                # Incomplete last row of a crashed run
+                continue
+            error = alert_row.get('chatgpt_classification') == "ERROR"
+            statuses[alert_row.get('id', 'MISSING')] = alert_row.get('triage_status', "error" if error else "ok")
+    return statuses
+
+def compact_journal(output_file):
+    # Rewrite the output with one row per alert id (the last one) after retries were appended
+    last_rows = {}
+    with open(output_file, 'r', encoding='utf-8') as journal:
+        for line_number, row in enumerate(journal):
+            try:
+                last_rows[json.loads(row).get('id', 'MISSING')] = line_number
+            except json.JSONDecodeError:
+                continue
+    temp_file = output_file + ".tmp"
+    with open(output_file, 'r', encoding='utf-8') as journal, open(temp_file, 'w', encoding='utf-8') as out_file:
+        for line_number, row in enumerate(journal):
+            try:
+                id = json.loads(row).get('id', 'MISSING')
+            except json.JSONDecodeError:
+                continue
+            if last_rows[id] == line_number:
+                out_file.write(row if row.endswith("\n") else row + "\n")
+    os.replace(temp_file, output_file)
+
+def append_row(out_file, alert_row):
+    out_file.write(json.dumps(alert_row) + "\n")
+    if FSYNC_EVERY_ROW:
+        out_file.flush()
+        os.fsync(out_file.fileno())
+
+def new_stats(telemetry_window=None):
+    # telemetry_window: calls per model kept for the latency percentiles (None = all calls of the run)
+    return {'processed_count': 0, 'failed': 0, 'skipped': 0, 'cluster_fanout': 0, 'fast_path': 0, 'api_calls': 0, 'api_total_time': 0, 'connect_total_time': 0, 'new_connections': 0, 'telemetry': CallTelemetry(METRICS_PATH, telemetry_window)}
+
+def record_stats(stats, alert_row, timing):
+    stats['processed_count'] += 1
+    if alert_row['triage_status'] == "error":
+        stats['failed'] += 1
+    if alert_row.get('cluster_representative') is False:
+        stats['cluster_fanout'] += 1
+    if alert_row.get('triage_source') == "fast_path":
+        stats['fast_path'] += 1
+    if timing is not None:
+        stats['api_calls'] += 1
+        stats['api_total_time'] += timing['api_time']
+        stats['connect_total_time'] += timing['connect_time']
+        stats['new_connections'] += timing['new_connections']
+        stats['telemetry'].record(timing, alert_row.get('id', 'MISSING'))
+
+async def write_triaged_alerts(input_file, output_file, stats, cache=None, completed_ids=None):
+    # completed_ids: alerts that are already in output_file (--resume), new rows are appended
+    completed_ids = completed_ids or set()
+    mode = "a" if completed_ids else "w"
+    try:
+        with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, mode, encoding="utf-8") as out_file:
+            # Start on a new line if the last row of a crashed run is incomplete
+            if mode == "a" and out_file.tell() > 0:
+                with open(output_file, 'rb') as journal:
+                    journal.seek(-1, os.SEEK_END)
+                    if journal.read(1) != b"\n":
+                        out_file.write("\n")
+            # Parse json rows lazily so only MAX_IN_FLIGHT alerts are held in memory
+            alert_rows = (json.loads(row.strip()) for row in in_file if row.strip())
+            # Skip alerts that were finished by a previous run
+            alert_rows = (alert_row for alert_row in alert_rows if alert_row.get('id', 'MISSING') not in completed_ids)
+            async for alert_row, timing in triage_alerts(alert_rows, cache):
+                record_stats(stats, alert_row, timing)
+                append_row(out_file, alert_row)
+    finally:
+        # Close pooled connections while the event loop is still running
+        await close_async_clients()
+        close_decisions()
+
+def read_alert_rows(input_file):
+    with open(input_file, 'r', encoding='utf-8') as in_file:
+        for row in in_file:
+            if row.strip():
+                yield json.loads(row.strip())
+
+def batch_file_parts(batch_file):
+    # batch.jsonl, batch_part2.jsonl, batch_part3.jsonl, ...
+    stem, extension = os.path.splitext(batch_file)
+    yield batch_file
+    part = 2
+    while True:
+        yield f"{stem}_part{part}{extension}"
+        part += 1
+
+def write_batch_file(input_file, batch_file, cache=None):
+    # Write one batch request per alert that needs the model, returns (stats, written files)
+    # Cached alerts and cluster members are left out, --batch-ingest resolves them locally
+    provider = PROVIDER or provider_for_model(MODEL)
+    stats = {'alerts': 0, 'requests': 0, 'resolved_locally': 0, 'cluster_members': 0}
+    part_names = batch_file_parts(batch_file)
+    batch_files = []
+    out_file = None
+    try:
+        for alert_row in read_alert_rows(input_file):
+            stats['alerts'] += 1
+            if alert_row.get('cluster_representative') is False:
+                stats['cluster_members'] += 1
+                continue
+            # The same rule as --batch-ingest, so every alert left out is resolved there
+            if resolve_locally(cache, alert_row) is not None:
+                stats['resolved_locally'] += 1
+                continue
+            line = json.dumps(batch_request_line(alert_row.get('id', 'MISSING'), alert_request(alert_row.get('alert', 'MISSING')), provider)) + "\n"
+            line_bytes = len(line.encode("utf-8"))
+            # Start a new part when the current one is full
+            if out_file is None or part_requests >= BATCH_FILE_MAX_REQUESTS or part_bytes + line_bytes > BATCH_FILE_MAX_BYTES:
+                if out_file is not None:
+                    out_file.close()
+                batch_files.append(next(part_names))
+                out_file = open(batch_files[-1], "w", encoding="utf-8")
+                part_requests = 0
+                part_bytes = 0
+            out_file.write(line)
+            part_requests += 1
+            part_bytes += line_bytes
+            stats['requests'] += 1
+    finally:
+        if out_file is not None:
+            out_file.close()
+    return stats, batch_files
+
+def validate_batch_file(batch_file):
+    # Check a batch input file offline before it is uploaded, returns a list of problems (empty = valid)
+    problems = []
+    custom_ids = set()
+    models = set()
+    requests = 0
+    with open(batch_file, 'r', encoding='utf-8') as in_file:
+        for line_number, row in enumerate(in_file, 1):
+            requests += 1
+            try:
+                line = json.loads(row)
+            except json.JSONDecodeError:
+                problems.append(f"line {line_number}: invalid json")
+                continue
+            custom_id = line.get('custom_id')
+            if not isinstance(custom_id, str) or not custom_id:
+                problems.append(f"line {line_number}: missing custom_id")
+            elif custom_id in custom_ids:
+                problems.append(f"line {line_number}: duplicate custom_id {custom_id}")
+            custom_ids.add(custom_id)
+            body = line.get('body')
+            if line.get('method') != "POST" or not isinstance(body, dict) or 'model' not in body:
+                problems.append(f"line {line_number}: not a POST request with a model")
+                continue
+            models.add(body['model'])
+            provider = PROVIDER or provider_for_model(body['model'])
+            if line.get('url') != PROVIDERS[provider]['batch_url']:
+                problems.append(f"line {line_number}: url {line.get('url')} is not the batch endpoint of {provider}")
+            # The request must be exactly what stage 3 sends for this alert with the current prompt and schema
+            messages = body.get('input') or body.get('messages') or [{}]
+            try:
+                expected = alert_request(json.loads(messages[-1].get('content', '')))
+            except (json.JSONDecodeError, AttributeError):
+                expected = None
+            if body != expected:
+                problems.append(f"line {line_number}: request does not match the current prompt, schema or model")
+    if len(models) > 1:
+        problems.append(f"all requests of a batch must use the same model, found {sorted(models)}")
+    if requests > BATCH_FILE_MAX_REQUESTS:
+        problems.append(f"{requests} requests exceed the limit of {BATCH_FILE_MAX_REQUESTS}")
+    if os.path.getsize(batch_file) > BATCH_FILE_MAX_BYTES:
+        problems.append(f"file size exceeds the limit of {BATCH_FILE_MAX_BYTES} bytes")
+    return problems
+
+def read_batch_results(result_files):
+    # Verdicts and errors of batch output files by custom_id (= alert id)
+    provider = PROVIDER or provider_for_model(MODEL)
+    responses = {}
+    errors = {}
+    for result_file in result_files:
+        with open(result_file, 'r', encoding='utf-8') as in_file:
+            for row in in_file:
+                if not row.strip():
+                    continue
+                custom_id, chatgpt_response, error = batch_result(provider, json.loads(row))
+                if chatgpt_response is None:
+                    errors[custom_id] = error
+                else:
+                    responses[custom_id] = chatgpt_response
+                    errors.pop(custom_id, None)
+    return responses, errors
+
+def write_batch_triaged_alerts(input_file, result_files, output_file, stats, cache=None):
+    # Turn batch output files into a normal stage 3 output, alerts without a verdict are written as errors (see --resume)
+    responses, errors = read_batch_results(result_files)
+    cluster_responses = {}
+    with open(output_file, "w", encoding="utf-8") as out_file:
+        for alert_row in read_alert_rows(input_file):
+            id = alert_row.get('id', 'MISSING')
+            cluster_id = alert_row.get('cluster_id')
+            if alert_row.get('cluster_representative') is False and cluster_id in cluster_responses:
+                alert_row = build_result_row(alert_row, dict(cluster_responses[cluster_id], alert_id=id))
+            elif id in responses:
+                alert_row, _ = finish_alert(cache, alert_row, responses[id], None)
+                alert_row['batch_api'] = True
+            else:
+                result = resolve_locally(cache, alert_row)
+                if result is not None:
+                    alert_row = result[0]
+                else:
+                    print(f"No batch result for alert {id}: {errors.get(id, 'missing')}")
+                    alert_row, _ = finish_alert(cache, alert_row, None, None)
+            if alert_row.get('cluster_representative'):
+                cluster_responses[cluster_id] = alert_row['chatgpt_response']
+            record_stats(stats, alert_row, None)
+            append_row(out_file, alert_row)
+    stats['batch_results'] = len(responses)
+    stats['batch_errors'] = len(errors)
+
+def print_batch_problems(batch_file, problems):
+    if problems:
+        print(f"{batch_file} is not valid:")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        if len(problems) > 20:
+            print(f"  ... and {len(problems) - 20} more")
+    else:
+        print(f"{batch_file} is valid")
+
+def export_batch(input_file, batch_file):
+    cache = open_cache()
+    try:
+        stats, batch_files = write_batch_file(input_file, batch_file, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    print(f"Alerts: {stats['alerts']}")
+    print(f"Batch requests: {stats['requests']} (resolved locally: {stats['resolved_locally']}, cluster members: {stats['cluster_members']})")
+    for written_file in batch_files:
+        print_batch_problems(written_file, validate_batch_file(written_file))
+    print(f"\nUpload the batch file(s) and ingest the results with: --input {input_file} --batch-ingest <result files>")
+
+def ingest_batch(input_file, result_files):
+    script_start = time.perf_counter()
+    stats = new_stats()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = f"3_alerts_classified_prioritised_{timestamp}.jsonl"
+    cache = open_cache()
+    try:
+        write_batch_triaged_alerts(input_file, result_files, output_file, stats, cache)
+    finally:
+        if cache is not None:
+            stats['cache'] = cache.stats()
+            cache.close()
+    print_stats(stats, time.perf_counter() - script_start)
+    print(f"Batch results: {stats['batch_results']} verdicts, {stats['batch_errors']} failed requests")
+    print(f"\nAlerts processed by ChatGPT have been saved to: {output_file}")
+    if stats['failed']:
+        print(f"Retry the failed alerts with: --input {input_file} --resume {output_file}")
+
+def process_alerts(input_file=None, resume_file=None):
     # Start overall timing
     script_start = time.perf_counter()
-    api_total_time = 0
-    processed_count = 0
+    stats = new_stats()
 
     # Prompt for input file
-    input_file = input("Enter the path to your jsonl file (e.g. preprocessed_alerts.jsonl): ").strip()
-    # Create unique output files with timestamp information
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = f"3_alerts_classified_prioritised_{timestamp}.jsonl"
+    if input_file is None:
+        input_file = input("Enter the path to your jsonl file (e.g. preprocessed_alerts.jsonl): ").strip()
+    completed_ids = set()
+    if resume_file is not None:
+        # Continue a previous run: keep its successful alerts and retry everything else
+        output_file = resume_file
+        statuses = read_journal(resume_file)
+        completed_ids = {id for id, status in statuses.items() if status == "ok"}
+        stats['skipped'] = len(completed_ids)
+        print(f"Resuming {resume_file}: {len(completed_ids)} alerts done, {len(statuses) - len(completed_ids)} failed alerts to retry")
+    else:
+        # Create unique output files with timestamp information
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_file = f"3_alerts_classified_prioritised_{timestamp}.jsonl"
+
+    cache = open_cache()
+    try:
+        asyncio.run(write_triaged_alerts(input_file, output_file, stats, cache, completed_ids))
+    finally:
+        if cache is not None:
+            stats['cache'] = cache.stats()
+            cache.close()
+    # Drop the superseded rows of retried alerts
+    if resume_file is not None:
+        compact_journal(output_file)
 
-    with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
-        for idx, row in enumerate(in_file):
-            # Parse json row
-            alert_row = json.loads(row.strip())
-            processed_count += 1
-            # Extract fields
-            alert = alert_row.get('alert', 'MISSING')
-            id = alert_row.get('id', 'MISSING')
-            # Query ChatGPT if response doesn't exist
-            if 'chatgpt_response' not in alert_row:
-                chatgpt_response, api_time = query_chatgpt(alert)
-                api_total_time += api_time
-                if chatgpt_response is None:
-                    chatgpt_response = {
-                        "alert_id": id,
-                        "classification": "ERROR",
-                        "priority": "ERROR",
-                        "justification": "ERROR"
-                    }
-            
-            # Extract ChatGPT fields
-            chatgpt_classification = chatgpt_response.get('classification', 'MISSING').strip().upper()
-            chatgpt_priority = chatgpt_response.get('priority', 'MISSING').strip().capitalize()
-            chatgpt_justification = chatgpt_response.get('justification', 'MISSING')
-
-            # Get ground truth
-            label = alert_row.get('label', 'MISSING').upper()
-            rule_priority = alert_row.get('rule_priority', 'MISSING')
-
-            # Check for matches
-            classification_match = (chatgpt_classification == label)
-            priority_match = (chatgpt_priority == rule_priority)
-
-            # Update alert
-            alert_row.update({
-                'chatgpt_response': chatgpt_response,
-                'chatgpt_classification': chatgpt_classification,
-                'chatgpt_priority': chatgpt_priority,
-                'chatgpt_justification': chatgpt_justification,
-                'classification_match': classification_match,
-                'priority_match': priority_match
-            })
-
-            out_file.write(json.dumps(alert_row) + "\n")
-    
     # Calculate final statistics
     script_time = time.perf_counter() - script_start
-    
+    print_stats(stats, script_time)
+    print(f"\nAlerts processed by ChatGPT have been saved to: {output_file}")
+    if stats['failed']:
+        print(f"Retry the failed alerts with: --input {input_file} --resume {output_file}")
+
+def print_stats(stats, script_time):
+    processed_count = stats['processed_count']
+    api_total_time = stats['api_total_time']
+    api_calls = stats['api_calls']
+
     # Print statistics to console
     print("\n" + "=" * 50)
     print("PROCESSING STATISTICS")
     print("=" * 50)
     print(f"Total alerts processed: {processed_count}")
+    print(f"Failed alerts: {stats['failed']}")
+    if stats['skipped']:
+        print(f"Skipped (done in previous run): {stats['skipped']}")
     print(f"Total script time: {script_time:.2f} seconds")
     print(f"Total API time: {api_total_time:.2f} seconds")
-    print(f"Average API time per alert: {api_total_time/processed_count:.4f} seconds")
-    print(f"Model used: {MODEL}")
+    print(f"Average API time per call: {api_total_time/max(api_calls, 1):.4f} seconds")
+    print(f"Total connect time: {stats['connect_total_time']:.2f} seconds ({stats['new_connections']} new connections)")
+    print(f"Total model time: {api_total_time - stats['connect_total_time']:.2f} seconds")
+    print(f"Throughput: {processed_count/script_time:.2f} alerts per second")
+    print(f"Concurrency: {CONCURRENCY} requests")
+    print(f"Batch size: {BATCH_SIZE} alerts (token budget {BATCH_TOKEN_BUDGET})")
+    print(f"API calls: {api_calls} (verdicts shared within clusters: {stats['cluster_fanout']})")
+    if stats['fast_path']:
+        print(f"Resolved by the fast path: {stats['fast_path']}")
+    if 'cache' in stats:
+        cache_stats = stats['cache']
+        print(f"Cache hits: {cache_stats['hits']} / misses: {cache_stats['misses']} (hit rate {cache_stats['hit_rate']:.2%})")
+        print(f"Cache entries: {cache_stats['entries']} (evicted {cache_stats['evictions']})")
+    if PREFIX_CACHE_LAYOUT or FEW_SHOT_EXAMPLES:
+        print(f"Static prompt prefix: about {static_prefix_tokens(alert_request({}))} tokens ({len(FEW_SHOT_EXAMPLES)} few-shot examples,"
+              f" OpenAI caches prefixes from 1024 tokens on)")
+    if stats.get('models'):
+        print(f"Models used: {', '.join(stats['models'])}")
+    else:
+        print(f"Model used: {MODEL} ({PROVIDER or provider_for_model(MODEL)})")
+    # Latency distribution, tokens and cost per model from the per-call telemetry
+    telemetry_summary = stats['telemetry'].summary(script_time)
+    print_telemetry(telemetry_summary)
+    stats['telemetry'].close()
+    if PROMETHEUS_PATH is not None:
+        write_prometheus(telemetry_summary, PROMETHEUS_PATH)
+        print(f"\nPrometheus metrics have been saved to: {PROMETHEUS_PATH}")
+    if METRICS_PATH is not None:
+        print(f"Per-call metrics have been appended to: {METRICS_PATH}")
     print("=" * 50)
-    print(f"\nAlerts processed by ChatGPT have been saved to: {output_file}")
 
 # When the script is run directly, execute the function process_alerts()
 if __name__ == "__main__":
-    process_alerts()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Classify and prioritise alerts with an LLM")
+    parser.add_argument("--input", help="preprocessed alerts jsonl (prompted for if omitted)")
+    parser.add_argument("--resume", metavar="OUTPUT_FILE", help="continue an interrupted run: skip alerts already done in OUTPUT_FILE and retry failed ones")
+    parser.add_argument("--batch-export", metavar="BATCH_FILE", help="write the requests of --input as an offline batch file instead of calling the API")
+    parser.add_argument("--batch-ingest", nargs="+", metavar="RESULT_FILE", help="build the output for --input from batch output files")
+    parser.add_argument("--batch-validate", metavar="BATCH_FILE", help="check a batch file against the current model, prompt and limits")
+    parser.add_argument("--sweep", nargs="+", metavar="MODEL[:PROVIDER]", help="triage --input with several models in one pass, one output file per model")
+    parser.add_argument("--stream", action="store_true", help="stream responses and record time to first token and time to decision")
+    parser.add_argument("--decisions", metavar="DECISIONS_FILE", help="with --stream, append each routing decision to this jsonl file as soon as it is known")
+    parser.add_argument("--max-output-tokens", type=int, help="cap of generated tokens per request (reasoning included)")
+    parser.add_argument("--reasoning-effort", choices=["low", "medium", "high"], help="reasoning effort of OpenAI reasoning models")
+    parser.add_argument("--prefix-cache", action="store_true", help="serialise alerts with shared fields first so provider prompt caching applies (see prompt_builder.py)")
+    parser.add_argument("--few-shot", metavar="EXAMPLES_FILE", help="labelled jsonl whose alerts are sent as fixed few-shot examples before every alert")
+    parser.add_argument("--metrics", metavar="METRICS_FILE", help="append per-call latency, token and cost records to this jsonl file")
+    parser.add_argument("--prometheus", metavar="PROM_FILE", help="write the run summary in Prometheus text format (e.g. for the node_exporter textfile collector)")
+    args = parser.parse_args()
+    METRICS_PATH = args.metrics
+    STREAM_RESPONSES = args.stream or args.decisions is not None
+    DECISIONS_PATH = args.decisions
+    MAX_OUTPUT_TOKENS = args.max_output_tokens
+    REASONING_EFFORT = args.reasoning_effort
+    if REASONING_EFFORT is not None:
+        # Only the Responses API takes a reasoning effort, reject it before any request is sent
+        providers = {parse_sweep_model(spec)['provider'] for spec in args.sweep} if args.sweep else {PROVIDER or provider_for_model(MODEL)}
+        unsupported = sorted(provider for provider in providers if PROVIDERS[provider]['api'] != "responses")
+        if unsupported:
+            parser.error(f"--reasoning-effort is only supported by OpenAI reasoning models, not by {', '.join(unsupported)}")
+    PREFIX_CACHE_LAYOUT = args.prefix_cache
+    if args.few_shot:
+        FEW_SHOT_EXAMPLES = load_examples(args.few_shot, alert_content)
+    PROMETHEUS_PATH = args.prometheus
+    if args.batch_validate:
+        print_batch_problems(args.batch_validate, validate_batch_file(args.batch_validate))
+    elif (args.batch_export or args.batch_ingest or args.sweep) and not args.input:
+        parser.error("--batch-export, --batch-ingest and --sweep need --input")
+    elif args.sweep:
+        sweep(args.input, args.sweep)
+    elif args.batch_export:
+        export_batch(args.input, args.batch_export)
+    elif args.batch_ingest:
+        ingest_batch(args.input, args.batch_ingest)
+    else:
+        process_alerts(args.input, args.resume)
\ No newline at end of file
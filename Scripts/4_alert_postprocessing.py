@@ -1,29 +1,98 @@
+import argparse
+import asyncio
+import importlib
 import json
 import re
 import unicodedata
 import os
+from results_store import ResultStore, run_name
+
+# Allowed verdict values
+CLASSIFICATIONS = ["TP", "FP"]
+PRIORITIES = ["Low", "Medium", "High", "Critical"]
+# Normalisers for answers like TRUE POSITIVE (TP) or Priority: HIGH, compiled once for all rows
+CLASSIFICATION_PATTERNS = {
+    "TP": re.compile(r'\b(TP|TRUE\s*POSITIVE)\b'),
+    "FP": re.compile(r'\b(FP|FALSE\s*POSITIVE)\b')
+}
+PRIORITY_PATTERN = re.compile(r'\b(LOW|MEDIUM|HIGH|CRITICAL)\b')
+# Repair requests for verdicts that are still invalid after normalisation (--repair): the model sees the alert,
+# its previous answer and what was wrong with it, and answers with a schema that only allows the enum values
+REPAIR_ATTEMPTS = 2
+REPAIR_PROMPT = (
+    "Your previous answer for this alert is invalid: {errors}. "
+    "Answer again for the same alert. classification must be exactly TP or FP, "
+    "priority must be exactly one of Low, Medium, High or Critical, and justification must not be empty."
+)
+REPAIR_JSON_FORMAT_PROMPT = (
+    "Always respond in this exact JSON format:"
+    '{"alert_id": "alert_id", "classification": "TP" or "FP", '
+    '"priority": "Low" or "Medium" or "High" or "Critical", "justification": "short explanation"}'
+)
+REPAIR_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "alert_id": {
+            "type": "string"
+        },
+        "classification": {
+            "type": "string",
+            "enum": CLASSIFICATIONS
+        },
+        "priority": {
+            "type": "string",
+            "enum": PRIORITIES
+        },
+        "justification": {
+            "type": "string"
+        }
+    },
+    "required": [
+        "alert_id",
+        "classification",
+        "priority",
+        "justification"
+    ],
+    "additionalProperties": False
+}
 
 def normalize_classification(input_str):
     # Convert to uppercase and remove extra spaces
-    clean_str = input_str.strip().upper()
-    # Check for TP patterns
-    if re.search(r'\b(TP|TRUE\s*POSITIVE)\b', clean_str):
-        return "TP"
-    # Check for FP patterns
-    if re.search(r'\b(FP|FALSE\s*POSITIVE)\b', clean_str):
-        return "FP"
-    # Return original if no match
+    clean_str = str(input_str).strip().upper()
+    # Check for TP and FP patterns, answers naming both (e.g. FP (NOT A TP)) are left for the repair
+    matches = [classification for classification, pattern in CLASSIFICATION_PATTERNS.items() if pattern.search(clean_str)]
+    if len(matches) == 1:
+        return matches[0]
+    # Return original if no unique match
+    return clean_str
+
+def normalize_priority(input_str):
+    # Priority named in a longer answer (e.g. Priority: HIGH), answers naming several (e.g. Medium-High) are left for the repair
+    clean_str = str(input_str).strip().capitalize()
+    matches = set(PRIORITY_PATTERN.findall(clean_str.upper()))
+    if len(matches) == 1:
+        return matches.pop().capitalize()
     return clean_str
 
 def allowed_priority(priority_str):
-    allowed_priorities = ["Low", "Medium", "High", "Critical"]
     # Clean the input string
-    clean_str = priority_str.strip().capitalize()
-    # Check for exact match first
-    if clean_str in allowed_priorities:
-        return True
-    else:
-        return False
+    clean_str = str(priority_str).strip().capitalize()
+    # Check for exact match
+    return clean_str in PRIORITIES
+
+def validation_errors(alert_row):
+    # What is wrong with the verdict of a row (empty if it is valid)
+    errors = []
+    classification = alert_row.get('chatgpt_classification', 'MISSING')
+    if classification not in CLASSIFICATIONS:
+        errors.append(f"classification {classification!r} is not TP or FP")
+    priority = alert_row.get('chatgpt_priority', 'MISSING')
+    if priority not in PRIORITIES:
+        errors.append(f"priority {priority!r} is not one of {', '.join(PRIORITIES)}")
+    justification = alert_row.get('chatgpt_justification')
+    if not isinstance(justification, str) or not justification.strip() or justification == "MISSING":
+        errors.append("justification is empty")
+    return errors
 
 def clean_justification(text):
     # Convert to string
@@ -41,49 +110,195 @@ def clean_justification(text):
         text = text[:MAX_LENGTH] + " [TRUNCATED]"
     return text
 
-def alert_postprocesing_from_jsonl():
-    input_file = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl): ").strip()
+def postprocess_row(alert_row, bad_priorities):
+    # Extract fields from json
+    chatgpt_classification = alert_row.get('chatgpt_classification', 'MISSING')
+    chatgpt_priority = alert_row.get('chatgpt_priority', 'MISSING')
+    label = alert_row.get('label', 'MISSING')
+    chatgpt_justification = alert_row.get('chatgpt_justification', 'MISSING')
+    classification_match = alert_row.get('classification_match', 'MISSING')
+    priority_match = alert_row.get('priority_match', 'MISSING')
+    # Check whether false match due to improper formatting
+    if classification_match == False:
+        # Normalize classification in case gpt returned something like: TRUE POSITIVE (TP) or TP (TRUE POSITIVE) instead of TP only
+        chatgpt_classification = normalize_classification(chatgpt_classification)
+        # Check again for match
+        classification_match = (chatgpt_classification == label)
+        # Update alert row
+        alert_row.update({
+            'chatgpt_classification': chatgpt_classification,
+            'classification_match': classification_match
+        })
+    # Check whether false match due to improper formatting
+    if priority_match == False:
+        # If priority is not one of the allowed ones
+        if allowed_priority(chatgpt_priority) == False:
+            # Normalize priority in case gpt returned something like: Priority: HIGH and check again for match
+            chatgpt_priority = normalize_priority(chatgpt_priority)
+            alert_row.update({
+                'chatgpt_priority': chatgpt_priority,
+                'priority_match': (chatgpt_priority == alert_row.get('rule_priority', 'MISSING'))
+            })
+            if allowed_priority(chatgpt_priority) == False:
+                # Append the alert id to bad_priorities
+                bad_priorities.append(alert_row.get('id', 'MISSING'))
+    # Clean chatgpt_justification string
+    chatgpt_justification = clean_justification(chatgpt_justification)
+    alert_row.update({
+            'chatgpt_justification': chatgpt_justification
+        })
+    # Verdicts that are still invalid are re-queried by --repair
+    errors = validation_errors(alert_row)
+    if errors:
+        alert_row['validation_errors'] = errors
+    else:
+        alert_row.pop('validation_errors', None)
+    return alert_row
+
+def postprocess_rows(rows, bad_priorities, invalid_rows):
+    # Postprocess rows as they stream past and keep the (few) rows with an invalid verdict by id for the repair
+    for alert_row in rows:
+        alert_row = postprocess_row(alert_row, bad_priorities)
+        if 'validation_errors' in alert_row:
+            invalid_rows[alert_row.get('id', 'MISSING')] = alert_row
+        yield alert_row
+
+def repair_request(triage, alert_row, model, provider):
+    # The alert and the previous answer as one exchange, followed by what was wrong with it
+    previous_response = alert_row.get('chatgpt_response')
+    examples = ()
+    # Failed requests have no answer to correct, their alert is simply asked again with the strict schema
+    if alert_row.get('triage_status') != "error" and previous_response is not None:
+        examples = [(triage.alert_content(alert_row.get('alert', 'MISSING')), json.dumps(previous_response))]
+        user_content = REPAIR_PROMPT.format(errors="; ".join(alert_row['validation_errors']))
+    else:
+        user_content = triage.alert_content(alert_row.get('alert', 'MISSING'))
+    return triage.build_request(model, triage.SYSTEM_PROMPT, user_content, "classified_alert", REPAIR_RESPONSE_SCHEMA, REPAIR_JSON_FORMAT_PROMPT,
+                                provider, triage.MAX_OUTPUT_TOKENS, triage.REASONING_EFFORT, examples)
+
+async def repair_row(triage, semaphore, cache, alert_row, stats):
+    # Re-query one invalid verdict up to REPAIR_ATTEMPTS times, returns the repaired row (or the last invalid one)
+    id = alert_row.get('id', 'MISSING')
+    # Repair with the model that produced the verdict
+    model = alert_row.get('model') or triage.MODEL
+    provider = triage.PROVIDER if model == triage.MODEL and triage.PROVIDER else triage.provider_for_model(model)
+    invalid_responses = []
+    for attempt in range(1, REPAIR_ATTEMPTS + 1):
+        invalid_responses.append({'chatgpt_response': alert_row.get('chatgpt_response'), 'validation_errors': alert_row['validation_errors']})
+        async with semaphore:
+            chatgpt_response, timing = await triage.query_model_async(repair_request(triage, alert_row, model, provider), provider)
+        if chatgpt_response is not None:
+            chatgpt_response['alert_id'] = id
+        # Only the verdict cache of the configured model uses the same key
+        alert_row, timing = triage.finish_alert(cache if model == triage.MODEL else None, dict(alert_row), chatgpt_response, timing, model=model)
+        alert_row = postprocess_row(alert_row, [])
+        alert_row.update({'repair_attempts': attempt, 'invalid_responses': invalid_responses})
+        # Repair calls count towards the run's telemetry (latency, tokens, cost), not its processed alerts
+        if stats is not None:
+            stats['telemetry'].record(timing, id)
+        if 'validation_errors' not in alert_row:
+            break
+    return alert_row
+
+async def repair_rows_async(invalid_rows, stats=None):
+    # Re-query only the invalid verdicts, CONCURRENCY of stage 3 at a time, returns {id: repaired row}
+    triage = importlib.import_module("3_alert_classification_prioritisation")
+    semaphore = asyncio.Semaphore(triage.CONCURRENCY)
+    cache = triage.open_cache()
+    try:
+        repaired_rows = await asyncio.gather(*(repair_row(triage, semaphore, cache, alert_row, stats) for alert_row in invalid_rows.values()))
+    finally:
+        if cache is not None:
+            cache.close()
+    return {alert_row.get('id', 'MISSING'): alert_row for alert_row in repaired_rows}
+
+async def repair_rows_and_close(invalid_rows, stats=None):
+    triage = importlib.import_module("3_alert_classification_prioritisation")
+    try:
+        return await repair_rows_async(invalid_rows, stats)
+    finally:
+        # Close pooled connections while the event loop is still running
+        await triage.close_async_clients()
+
+def merge_repaired(output_file, repaired_rows):
+    # Replace the rows of repaired alerts by id, the file is streamed so only the repaired rows are held in memory
+    temp_file = output_file + ".tmp"
+    with open(output_file, 'r', encoding='utf-8') as in_file, open(temp_file, 'w', encoding='utf-8') as out_file:
+        for row in in_file:
+            if not row.strip():
+                continue
+            alert_row = json.loads(row)
+            out_file.write(json.dumps(repaired_rows.get(alert_row.get('id', 'MISSING'), alert_row)) + "\n")
+    os.replace(temp_file, output_file)
+
+def print_repair_stats(invalid_rows, repaired_rows):
+    still_invalid = [id for id, alert_row in repaired_rows.items() if 'validation_errors' in alert_row]
+    repair_calls = sum(alert_row.get('repair_attempts', 0) for alert_row in repaired_rows.values())
+    print(f"Repaired verdicts: {len(repaired_rows) - len(still_invalid)} of {len(invalid_rows)} invalid ({repair_calls} API calls)")
+    if still_invalid:
+        print(f"Still invalid after {REPAIR_ATTEMPTS} attempts: {still_invalid}")
+
+def alert_postprocesing_from_jsonl(input_file=None, repair=False):
+    if input_file is None:
+        input_file = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl): ").strip()
     # remove file extension and keep name only
     file_name = os.path.splitext(input_file)[0]
     output_file = f"4_{file_name}_postprocessed.jsonl"
     bad_priorities = []
+    invalid_rows = {}
 
     with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, "w", encoding="utf-8") as out_file:
-        for idx, row in enumerate(in_file):
-            alert_row = json.loads(row.strip())
-            # Extract fields from json
-            chatgpt_classification = alert_row.get('chatgpt_classification', 'MISSING')
-            chatgpt_priority = alert_row.get('chatgpt_priority', 'MISSING')
-            label = alert_row.get('label', 'MISSING')
-            chatgpt_justification = alert_row.get('chatgpt_justification', 'MISSING')
-            classification_match = alert_row.get('classification_match', 'MISSING')
-            priority_match = alert_row.get('chatgpt_priority', 'MISSING')
-            # Check whether false match due to improper formatting
-            if classification_match == False:
-                # Normalize classification in case gpt returned something like: TRUE POSITIVE (TP) or TP (TRUE POSITIVE) instead of TP only
-                chatgpt_classification = normalize_classification(chatgpt_classification)
-                # Check again for match
-                classification_match = (chatgpt_classification == label)
-                # Update alert row
-                alert_row.update({
-                    'chatgpt_classification': chatgpt_classification,
-                    'classification_match': classification_match
-                })
-            # Check whether false match due to improper formatting
-            if priority_match == False:
-                # If priority is not one of the allowed ones
-                if allowed_priority(chatgpt_priority) == False:
-                    # Append the alert id to bad_priorities
-                    bad_priorities.append(id)
-            # Clean chatgpt_justification string
-            chatgpt_justification = clean_justification(chatgpt_justification)
-            alert_row.update({
-                    'chatgpt_justification': chatgpt_justification
-                })
+        rows = (json.loads(row.strip()) for row in in_file if row.strip())
+        for alert_row in postprocess_rows(rows, bad_priorities, invalid_rows):
             # Write row to new file
             out_file.write(json.dumps(alert_row) + "\n")
 
     print(f"\nPost processed alerts have been saved to: {output_file}\nBad Priorities: {bad_priorities}")
+    print(f"Invalid verdicts: {len(invalid_rows)}")
+    if invalid_rows and repair:
+        # Re-query only the invalid verdicts and merge the fixes back by id
+        repaired_rows = asyncio.run(repair_rows_and_close(invalid_rows))
+        merge_repaired(output_file, repaired_rows)
+        print_repair_stats(invalid_rows, repaired_rows)
+    elif invalid_rows:
+        print(f"Re-query only these alerts with: --input {input_file} --repair")
+
+def alert_postprocessing_to_store(store_path, run=None, input_file=None, repair=False):
+    # Postprocess a stage 3 output (or a run already in the store) and write the rows to the results store
+    store = ResultStore(store_path)
+    bad_priorities = []
+    invalid_rows = {}
+    try:
+        if input_file is not None:
+            run = run or run_name(input_file)
+            store.add_run(run, source=input_file)
+            with open(input_file, 'r', encoding='utf-8') as in_file:
+                rows = postprocess_rows((json.loads(row.strip()) for row in in_file if row.strip()), bad_priorities, invalid_rows)
+                count = store.write_rows(run, rows)
+        else:
+            # Materialise first, the rows are written back to the run they are read from
+            rows = list(postprocess_rows(store.iter_rows(run), bad_priorities, invalid_rows))
+            count = store.write_rows(run, rows)
+        print(f"\nPost processed {count} alerts have been saved to run {run} of: {store_path}\nBad Priorities: {bad_priorities}")
+        print(f"Invalid verdicts: {len(invalid_rows)}")
+        if invalid_rows and repair:
+            # Rows are keyed by run and id, the repaired rows replace the invalid ones
+            repaired_rows = asyncio.run(repair_rows_and_close(invalid_rows))
+            store.write_rows(run, repaired_rows.values())
+            print_repair_stats(invalid_rows, repaired_rows)
+    finally:
+        store.close()
 
 if __name__ == "__main__":
-    alert_postprocesing_from_jsonl()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Postprocess classified alerts")
+    parser.add_argument("--store", help="write the postprocessed rows to this results store (results_store.py) instead of a JSONL file")
+    parser.add_argument("--input", help="stage 3 output to postprocess (with --store, without --input the stored --run is postprocessed again)")
+    parser.add_argument("--run", help="run name in the results store (default: derived from --input)")
+    parser.add_argument("--repair", action="store_true", help="re-query the model for verdicts that are still invalid after normalisation and merge the fixes back by id")
+    args = parser.parse_args()
+    if args.store:
+        if not args.input and not args.run:
+            parser.error("--store needs --input or --run")
+        alert_postprocessing_to_store(args.store, args.run, args.input, args.repair)
+    else:
+        alert_postprocesing_from_jsonl(args.input, args.repair)
\ No newline at end of file
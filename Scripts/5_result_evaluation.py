@@ -1,44 +1,379 @@
+import argparse
+import hashlib
 import json
+import numpy as np
 import pandas as pd
 from sklearn.metrics import classification_report, confusion_matrix, f1_score, ConfusionMatrixDisplay
-import matplotlib.pyplot as plt
+import matplotlib
+# Figures are only written to files, never shown
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
 import os
+from alert_tokens import alert_tokens
+from results_store import ResultStore
+from datetime import datetime
+
+# Metrics compared by --compare and whether higher values are better
+COMPARISON_METRICS = {
+    "Classification Accuracy": True,
+    "TPR": True,
+    "FPR": False,
+    "Prioritisation Accuracy": True,
+    "Prioritisation Macro F1": True,
+    "HC Recall": True
+}
+
+# Labels of the multi-run evaluation (--runs), predictions outside these count as wrong
+CLASS_LABELS = ["FP", "TP"]
+PRIORITY_LABELS = ["Critical", "High", "Medium", "Low"]
+# Bootstrap resamples for the confidence intervals of --runs
+BOOTSTRAP_SAMPLES = 1000
+CONFIDENCE_LEVEL = 0.95
+# Upper bound for the number of predictions resampled at once (memory of one bootstrap chunk)
+BOOTSTRAP_CHUNK_ELEMENTS = 20000000
+
+# Confusion matrix figures: "png", "svg" (smaller and faster for headless batch evaluation) or "none"
+PLOT_FORMAT = "png"
+PLOT_DPI = 300
+# Processes rendering figures in parallel (1 = render in this process)
+RENDER_WORKERS = os.cpu_count() or 1
+# Content hashes of rendered figures per output folder, unchanged confusion matrices are not rendered again
+RENDER_CACHE_FILE = ".confusion_matrix_hashes.json"
 
 def map_high_critical(prio):
     # HC = High+Critical
     return "HC" if prio in ["High", "Critical"] else "Other"
 
-def evaluate_from_jsonl():
-    input_file = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl):\n").strip()
+def batch_size_report(true_labels, pred_labels, true_priorities, pred_priorities, batch_sizes):
+    # Accuracy per number of alerts that shared one request (stage 3 batch mode)
+    df = pd.DataFrame({
+        'batch_size': batch_sizes,
+        'classification_correct': [t == p for t, p in zip(true_labels, pred_labels)],
+        'priority_correct': [t == p for t, p in zip(true_priorities, pred_priorities)]
+    }).dropna(subset=['batch_size'])
+    report = df.groupby('batch_size').agg(
+        alerts=('classification_correct', 'size'),
+        classification_accuracy=('classification_correct', 'mean'),
+        priority_accuracy=('priority_correct', 'mean')
+    )
+    report.index = report.index.astype(int)
+    return report
+
+def encode_labels(values, labels):
+    # Index of each value in labels, values that are not a label (e.g. ERROR) get the extra index len(labels)
+    lookup = {label: index for index, label in enumerate(labels)}
+    return np.array([lookup.get(value, len(labels)) for value in values], dtype=np.int64)
+
+def read_run_file(input_file):
+    # {id: (label, rule_priority, classification, priority)} of a postprocessed JSONL run
+    run = {}
+    with open(input_file, "r", encoding="utf-8") as in_file:
+        for row in in_file:
+            if not row.strip():
+                continue
+            alert_row = json.loads(row)
+            run[alert_row.get("id", "MISSING")] = (
+                alert_row["label"], alert_row["rule_priority"], alert_row["chatgpt_classification"], alert_row["chatgpt_priority"]
+            )
+    return run
+
+def load_runs(input_files, store=None):
+    # Align runs by alert id and return (ids, true labels, true priorities, predicted labels, predicted priorities)
+    # as label index arrays, predictions have one row per run
+    # input_files are run names if a ResultStore is given
+    runs = []
+    for input_file in input_files:
+        run = store.run_predictions(input_file) if store is not None else read_run_file(input_file)
+        runs.append({
+            id: (label.strip().upper(), rule_priority.strip().capitalize(), classification.strip().upper(), priority.strip().capitalize())
+            for id, (label, rule_priority, classification, priority) in run.items()
+        })
+    ids = sorted(set.intersection(*(set(run) for run in runs)))
+    for input_file, run in zip(input_files, runs):
+        if len(run) != len(ids):
+            print(f"{input_file}: {len(run) - len(ids)} alerts are not in every run and were left out")
+    true_labels = encode_labels([runs[0][id][0] for id in ids], CLASS_LABELS)
+    true_priorities = encode_labels([runs[0][id][1] for id in ids], PRIORITY_LABELS)
+    pred_labels = np.stack([encode_labels([run[id][2] for id in ids], CLASS_LABELS) for run in runs])
+    pred_priorities = np.stack([encode_labels([run[id][3] for id in ids], PRIORITY_LABELS) for run in runs])
+    return ids, true_labels, true_priorities, pred_labels, pred_priorities
+
+def confusion_matrices(true, pred, label_count):
+    # Confusion matrices of every row of pred (any number of leading axes) against true in one bincount
+    # The last row/column counts values outside the labels
+    size = label_count + 1
+    codes = true * size + pred
+    leading_shape = codes.shape[:-1]
+    codes = codes.reshape(-1, codes.shape[-1]) + (np.arange(int(np.prod(leading_shape))) * size * size)[:, None]
+    counts = np.bincount(codes.ravel(), minlength=int(np.prod(leading_shape)) * size * size)
+    return counts.reshape(*leading_shape, size, size)
+
+def safe_divide(numerator, denominator):
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+def metrics_from_confusion(cm_class, cm_priority):
+    # Summary metrics from stacks of confusion matrices (last two axes), vectorised over all leading axes
+    # Rates follow sklearn: predictions outside the labels are wrong but do not count as TP/FP
+    tn, fp = cm_class[..., 0, 0], cm_class[..., 0, 1]
+    fn, tp = cm_class[..., 1, 0], cm_class[..., 1, 1]
+    alerts = cm_class.sum(axis=(-2, -1))
+    correct_priorities = np.diagonal(cm_priority, axis1=-2, axis2=-1)[..., :len(PRIORITY_LABELS)]
+    priority_support = cm_priority.sum(axis=-1)[..., :len(PRIORITY_LABELS)]
+    priority_predicted = cm_priority.sum(axis=-2)[..., :len(PRIORITY_LABELS)]
+    recall = safe_divide(correct_priorities, priority_support)
+    precision = safe_divide(correct_priorities, priority_predicted)
+    f1 = safe_divide(2 * precision * recall, precision + recall)
+    # High+Critical are the first two priority labels, everything else (including invalid predictions) is Other
+    hc_tp = cm_priority[..., :2, :2].sum(axis=(-2, -1))
+    hc_actual = cm_priority[..., :2, :].sum(axis=(-2, -1))
+    hc_fp = cm_priority[..., 2:, :2].sum(axis=(-2, -1))
+    hc_other = cm_priority[..., 2:, :].sum(axis=(-2, -1))
+    return {
+        "Classification Accuracy": safe_divide(tn + tp, alerts),
+        "TPR": safe_divide(tp, tp + fn),
+        "FPR": safe_divide(fp, fp + tn),
+        "FNR": safe_divide(fn, tp + fn),
+        "Prioritisation Accuracy": safe_divide(correct_priorities.sum(axis=-1), alerts),
+        "Prioritisation Macro F1": f1.mean(axis=-1),
+        "Prioritisation Macro Recall": recall.mean(axis=-1),
+        "HC Recall": safe_divide(hc_tp, hc_actual),
+        "HC FPR": safe_divide(hc_fp, hc_other)
+    }
+
+def run_metrics(true_labels, true_priorities, pred_labels, pred_priorities):
+    return metrics_from_confusion(
+        confusion_matrices(true_labels, pred_labels, len(CLASS_LABELS)),
+        confusion_matrices(true_priorities, pred_priorities, len(PRIORITY_LABELS))
+    )
+
+def bootstrap_intervals(true_labels, true_priorities, pred_labels, pred_priorities, samples=BOOTSTRAP_SAMPLES, confidence=CONFIDENCE_LEVEL, seed=0):
+    # Percentile bootstrap over alerts, all runs are evaluated on the same resamples so their intervals are comparable
+    rng = np.random.default_rng(seed)
+    run_count, alert_count = pred_labels.shape
+    chunk_size = max(1, BOOTSTRAP_CHUNK_ELEMENTS // max(run_count * alert_count, 1))
+    chunks = []
+    for start in range(0, samples, chunk_size):
+        resample = rng.integers(0, alert_count, size=(min(chunk_size, samples - start), alert_count))
+        chunks.append(run_metrics(true_labels[resample], true_priorities[resample], pred_labels[:, resample], pred_priorities[:, resample]))
+    alpha = (1 - confidence) / 2
+    intervals = {}
+    for metric in chunks[0]:
+        values = np.concatenate([chunk[metric] for chunk in chunks], axis=1)
+        intervals[metric] = np.quantile(values, [alpha, 1 - alpha], axis=1)
+    return intervals
+
+def run_names(input_files, store=None):
+    if store is not None:
+        return list(input_files)
+    # The result folder names (e.g. 20250712_Run_1_gpt-4o) if they tell the runs apart, the file names otherwise
+    folders = [os.path.basename(os.path.dirname(os.path.abspath(input_file))) for input_file in input_files]
+    if len(set(folders)) == len(folders):
+        return folders
+    return [os.path.splitext(os.path.basename(input_file))[0] for input_file in input_files]
+
+def evaluate_runs(input_files, samples=BOOTSTRAP_SAMPLES, seed=0, store=None):
+    # One comparison table of any number of runs with bootstrap confidence intervals
+    ids, true_labels, true_priorities, pred_labels, pred_priorities = load_runs(input_files, store)
+    metrics = run_metrics(true_labels, true_priorities, pred_labels, pred_priorities)
+    intervals = bootstrap_intervals(true_labels, true_priorities, pred_labels, pred_priorities, samples, CONFIDENCE_LEVEL, seed)
+    columns = {"Alerts": len(ids)}
+    for metric, values in metrics.items():
+        columns[metric] = values
+        columns[f"{metric} CI Low"] = intervals[metric][0]
+        columns[f"{metric} CI High"] = intervals[metric][1]
+    comparison_df = pd.DataFrame(columns, index=pd.Index(run_names(input_files, store), name="Run"))
+    matrices = {
+        "classification": confusion_matrices(true_labels, pred_labels, len(CLASS_LABELS)),
+        "priority": confusion_matrices(true_priorities, pred_priorities, len(PRIORITY_LABELS))
+    }
+    return comparison_df, matrices
+
+def run_figures(run_names, matrices):
+    # Confusion matrix figures of every run, in the label order of the single run report
+    figures = []
+    for run, cm_class, cm_priority in zip(run_names, matrices["classification"], matrices["priority"]):
+        # Like sklearn, the figures leave out predictions outside the labels, except for HC where they count as Other
+        cm_hc = np.array([
+            [cm_priority[2:, 2:].sum(), cm_priority[2:, :2].sum()],
+            [cm_priority[:2, 2:].sum(), cm_priority[:2, :2].sum()]
+        ])
+        figures.extend([
+            (cm_class[:2, :2], CLASS_LABELS, 'Classification Confusion Matrix', f'5_{run}_classification_cm'),
+            (cm_priority[:4, :4], PRIORITY_LABELS, 'Prioritisation Confusion Matrix', f'5_{run}_prioritisation_cm'),
+            (cm_hc, ["Other", "HC"], 'High+Critical Confusion Matrix', f'5_{run}_hc_cm')
+        ])
+    return figures
+
+def print_run_comparison(comparison_df):
+    print(f"\nRun comparison ({CONFIDENCE_LEVEL:.0%} bootstrap confidence intervals, {comparison_df['Alerts'].iloc[0]} alerts)")
+    for run, row in comparison_df.iterrows():
+        print(f"\n{run}")
+        for metric in row.index:
+            if metric != "Alerts" and not metric.endswith((" CI Low", " CI High")):
+                print(f"  {metric:<28} {row[metric]:.4f} [{row[f'{metric} CI Low']:.4f}, {row[f'{metric} CI High']:.4f}]")
+
+def compare_all_runs(input_files, samples=BOOTSTRAP_SAMPLES, seed=0, store=None):
+    comparison_df, matrices = evaluate_runs(input_files, samples, seed, store)
+    print_run_comparison(comparison_df)
+    figure_paths = render_figures(run_figures(comparison_df.index, matrices))
+    if figure_paths:
+        print(f"\nSaved {len(figure_paths)} confusion matrix visualisations (5_<run>_*_cm.{PLOT_FORMAT})")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    excel_path = f"5_run_comparison_{timestamp}.xlsx"
+    comparison_df.to_excel(excel_path, sheet_name="Comparison")
+    print(f"\nSaved run comparison to:\n{excel_path}")
+    return comparison_df
+
+def summary_metrics(input_file, store=None):
+    # Key classification and prioritisation metrics of one postprocessed run
+    _, true_labels, true_priorities, pred_labels, pred_priorities = load_runs([input_file], store)
+    metrics = run_metrics(true_labels, true_priorities, pred_labels, pred_priorities)
+    return {metric: float(values[0]) for metric, values in metrics.items()}
+
+def compare_runs(baseline_file, candidate_file, tolerance=0.01, store=None):
+    # Regression check of a candidate run (e.g. minimised alerts) against a baseline run on the same alerts
+    baseline = summary_metrics(baseline_file, store)
+    candidate = summary_metrics(candidate_file, store)
+    rows = []
+    for metric, higher_is_better in COMPARISON_METRICS.items():
+        delta = candidate[metric] - baseline[metric]
+        regression = (delta < -tolerance) if higher_is_better else (delta > tolerance)
+        rows.append({"Metric": metric, "Baseline": baseline[metric], "Candidate": candidate[metric], "Delta": delta, "Regression": regression})
+    comparison_df = pd.DataFrame(rows)
+    print(f"\nBaseline: {baseline_file}\nCandidate: {candidate_file}\n")
+    print(comparison_df.to_string(index=False))
+    if comparison_df["Regression"].any():
+        print(f"\nREGRESSION: {', '.join(comparison_df.loc[comparison_df['Regression'], 'Metric'])} worse by more than {tolerance}")
+    else:
+        print(f"\nNo metric regressed by more than {tolerance}")
+    return comparison_df
+
+def render_confusion_matrix(cm, labels, title, path, dpi):
+    # Explicit figure on an Agg canvas, nothing is kept in pyplot's global state between figures
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.subplots()
+    ConfusionMatrixDisplay(np.asarray(cm), display_labels=labels).plot(ax=ax)
+    ax.set_title(title)
+    figure.savefig(path, dpi=dpi)
+    return path
+
+def figure_hash(cm, labels, title):
+    content = json.dumps([np.asarray(cm).tolist(), labels, title, PLOT_FORMAT, PLOT_DPI])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def render_figures(figures):
+    # figures: list of (confusion matrix, labels, title, path without extension), returns the paths of all figures
+    if PLOT_FORMAT == "none":
+        return []
+    jobs = [(cm, labels, title, f"{path}.{PLOT_FORMAT}") for cm, labels, title, path in figures]
+    caches = {}
+    pending = []
+    for cm, labels, title, path in jobs:
+        folder = os.path.dirname(os.path.abspath(path))
+        if folder not in caches:
+            cache_path = os.path.join(folder, RENDER_CACHE_FILE)
+            try:
+                with open(cache_path, "r", encoding="utf-8") as cache_file:
+                    caches[folder] = json.load(cache_file)
+            except (OSError, json.JSONDecodeError):
+                caches[folder] = {}
+        content_hash = figure_hash(cm, labels, title)
+        name = os.path.basename(path)
+        if not (os.path.exists(path) and caches[folder].get(name) == content_hash):
+            pending.append((cm, labels, title, path))
+            caches[folder][name] = content_hash
+
+    if len(pending) > 1 and RENDER_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=min(RENDER_WORKERS, len(pending))) as pool:
+            list(pool.map(render_confusion_matrix, *zip(*pending), [PLOT_DPI] * len(pending)))
+    else:
+        for cm, labels, title, path in pending:
+            render_confusion_matrix(cm, labels, title, path, PLOT_DPI)
+
+    for folder, cache in caches.items():
+        with open(os.path.join(folder, RENDER_CACHE_FILE), "w", encoding="utf-8") as cache_file:
+            json.dump(cache, cache_file, indent=1)
+    if len(pending) < len(jobs):
+        print(f"\n{len(jobs) - len(pending)} of {len(jobs)} confusion matrices unchanged, not rendered again")
+    return [path for _, _, _, path in jobs]
+
+def new_predictions(alert_rows):
+    # alert_rows returns the evaluated rows again in the same order, their alerts are only read for the token
+    # estimates of the triage source report (runs with fast path or ML tier verdicts)
+    return {'true_labels': [], 'pred_labels': [], 'true_priorities': [], 'pred_priorities': [], 'batch_sizes': [], 'triage_sources': [], 'alert_rows': alert_rows}
+
+def add_prediction(predictions, alert_row):
+    # Extract ground truth and prediction
+    predictions['true_labels'].append(alert_row["label"].strip().upper())
+    predictions['pred_labels'].append(alert_row["chatgpt_classification"].strip().upper())
+    predictions['true_priorities'].append(alert_row["rule_priority"].strip().capitalize())
+    predictions['pred_priorities'].append(alert_row["chatgpt_priority"].strip().capitalize())
+    # Number of alerts sent in the same request (missing for runs without batch mode)
+    predictions['batch_sizes'].append(alert_row.get("batch_size"))
+    # Where the verdict came from (missing for runs without the fast path)
+    predictions['triage_sources'].append(alert_row.get("triage_source", "llm"))
+
+def evaluate_from_jsonl(input_file=None):
+    if input_file is None:
+        input_file = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl):\n").strip()
     # remove file extension and keep name only
     file_name = os.path.splitext(input_file)[0]
-    true_labels = []
-    pred_labels = []
-    true_priorities = []
-    pred_priorities = []
-
-    # Create Excel writer
-    excel_path = f'5_{file_name}_evaluation_report.xlsx'
-    writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
-    workbook = writer.book
+    predictions = new_predictions(lambda: read_rows(input_file))
 
     with open(input_file, "r", encoding="utf-8") as in_file:
         for idx, row in enumerate(in_file):
-            alert_row = json.loads(row.strip())
+            add_prediction(predictions, json.loads(row.strip()))
 
-            # Extract ground truth and prediction
-            true_label = alert_row["label"].strip().upper()
-            pred_label = alert_row["chatgpt_classification"].strip().upper()
+    evaluate_predictions(predictions, f'5_{file_name}')
 
-            true_priority = alert_row["rule_priority"].strip().capitalize()
-            pred_priority = alert_row["chatgpt_priority"].strip().capitalize()
+def read_rows(input_file):
+    with open(input_file, "r", encoding="utf-8") as in_file:
+        for row in in_file:
+            if row.strip():
+                yield json.loads(row)
 
-            true_labels.append(true_label)
-            pred_labels.append(pred_label)
+def evaluate_from_store(store, run):
+    predictions = new_predictions(lambda: store.iter_rows(run))
+    # The metrics only need the narrow verdict columns, not the alert blobs
+    for alert_row in store.iter_rows(run, with_alert=False):
+        add_prediction(predictions, alert_row)
+    evaluate_predictions(predictions, f'5_{run}')
+
+def triage_source_report(true_labels, pred_labels, true_priorities, pred_priorities, triage_sources, tokens):
+    # Share, accuracy and estimated alert tokens of the verdicts per source (fast path rules, local model or LLM)
+    df = pd.DataFrame({
+        'triage_source': triage_sources,
+        'alert_tokens': tokens,
+        'classification_correct': [t == p for t, p in zip(true_labels, pred_labels)],
+        'priority_correct': [t == p for t, p in zip(true_priorities, pred_priorities)]
+    })
+    report = df.groupby('triage_source').agg(
+        alerts=('classification_correct', 'size'),
+        classification_accuracy=('classification_correct', 'mean'),
+        priority_accuracy=('priority_correct', 'mean'),
+        alert_tokens=('alert_tokens', 'sum')
+    )
+    report.insert(1, 'share', report['alerts'] / len(df))
+    return report
+
+def evaluate_predictions(predictions, output_prefix):
+    # Write the evaluation report and confusion matrices to files starting with output_prefix
+    true_labels = predictions['true_labels']
+    pred_labels = predictions['pred_labels']
+    true_priorities = predictions['true_priorities']
+    pred_priorities = predictions['pred_priorities']
+    batch_sizes = predictions['batch_sizes']
+    triage_sources = predictions['triage_sources']
+
+    # Create Excel writer
+    excel_path = f'{output_prefix}_evaluation_report.xlsx'
+    writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
+    workbook = writer.book
 
-            true_priorities.append(true_priority)
-            pred_priorities.append(pred_priority)
-    
     # --- Classification Metrics ---
     print("\nClassification Report (TP vs FP):")
     class_labels = ["FP", "TP"]
@@ -176,29 +511,70 @@ def evaluate_from_jsonl():
     worksheet_prio.write(row_pos, 0, "High+Critical Metrics")
     hc_metrics_df.to_excel(writer, sheet_name='Prioritisation', startrow=row_pos + 1, index=False)
 
+    # --- Batch Size Metrics ---
+    if any(size is not None for size in batch_sizes):
+        print("\nAccuracy by Batch Size:")
+        batch_df = batch_size_report(true_labels, pred_labels, true_priorities, pred_priorities, batch_sizes)
+        print(batch_df.to_string())
+        worksheet_batch = workbook.add_worksheet('Batch Size')
+        worksheet_batch.write(0, 0, "Accuracy by Batch Size")
+        batch_df.to_excel(writer, sheet_name='Batch Size', startrow=1)
+
+    # --- Triage Source Metrics ---
+    if any(source != "llm" for source in triage_sources):
+        # Estimated input tokens of every alert, what an LLM call for it costs
+        tokens = [alert_tokens(alert_row.get("alert", {})) for alert_row in predictions['alert_rows']()]
+        source_df = triage_source_report(true_labels, pred_labels, true_priorities, pred_priorities, triage_sources, tokens)
+        short_circuit_rate = 1 - source_df['share'].get('llm', 0)
+        print(f"\nShort-circuit rate (no LLM call): {short_circuit_rate:.4f}")
+        print(f"Escalation rate (sent to the LLM): {1 - short_circuit_rate:.4f}")
+        print(f"Estimated LLM input tokens: {source_df['alert_tokens'].get('llm', 0)} with cascade, {source_df['alert_tokens'].sum()} without")
+        print("Accuracy by Triage Source:")
+        print(source_df.to_string())
+        worksheet_source = workbook.add_worksheet('Triage Source')
+        worksheet_source.write(0, 0, "Accuracy by Triage Source")
+        source_df.to_excel(writer, sheet_name='Triage Source', startrow=1)
+        worksheet_source.write(len(source_df) + 4, 0, "Short-circuit rate")
+        worksheet_source.write(len(source_df) + 4, 1, short_circuit_rate)
+
     # Visualise confusion matrices
-    # cm classification
-    disp = ConfusionMatrixDisplay(cm,display_labels=class_labels)
-    disp.plot()
-    plt.title('Classification Confusion Matrix')
-    plt.savefig(f'5_{file_name}_classification_cm.png', dpi=300)
-    print(f"\nSaved confusion matrix visualisations to\n'5_{file_name}_classification_cm.png'")
-    # cm prioritisation
-    disp = ConfusionMatrixDisplay(cm_priority, display_labels=priority_labels)
-    disp.plot()
-    plt.title('Prioritisation Confusion Matrix')
-    plt.savefig(f'5_{file_name}_prioritisation_cm.png', dpi=300)
-    print(f"'5_{file_name}_prioritisation_cm.png'")
-    # cm hc combined
-    disp = ConfusionMatrixDisplay(cm_hc,display_labels=hc_labels)
-    disp.plot()
-    plt.title('High+Critical Confusion Matrix')
-    plt.savefig(f'5_{file_name}_hc_cm.png', dpi=300)
-    print(f"'5_{file_name}_hc_cm.png'")
+    figure_paths = render_figures([
+        (cm, class_labels, 'Classification Confusion Matrix', f'{output_prefix}_classification_cm'),
+        (cm_priority, priority_labels, 'Prioritisation Confusion Matrix', f'{output_prefix}_prioritisation_cm'),
+        (cm_hc, hc_labels, 'High+Critical Confusion Matrix', f'{output_prefix}_hc_cm')
+    ])
+    if figure_paths:
+        print("\nSaved confusion matrix visualisations to")
+        for path in figure_paths:
+            print(f"'{path}'")
 
     # Save Excel file
     writer.close()
     print(f"\nSaved full evaluation report to:\n{excel_path}")
 
 if __name__ == "__main__":
-    evaluate_from_jsonl()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate classification and prioritisation results")
+    parser.add_argument("--input", help="postprocessed jsonl file to evaluate (asked for if not given)")
+    parser.add_argument("--store", help="read runs from this results store (results_store.py), --run/--runs/--compare then take run names")
+    parser.add_argument("--run", help="evaluate one run of the results store")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="compare two postprocessed runs and flag metric regressions")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="allowed metric drop for --compare")
+    parser.add_argument("--runs", nargs="+", metavar="RUN_FILE", help="evaluate any number of postprocessed runs into one comparison table")
+    parser.add_argument("--bootstrap", type=int, default=BOOTSTRAP_SAMPLES, help="bootstrap resamples for the confidence intervals of --runs")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the bootstrap")
+    parser.add_argument("--plot-format", choices=["png", "svg", "none"], default=PLOT_FORMAT, help="format of the confusion matrix figures")
+    args = parser.parse_args()
+    PLOT_FORMAT = args.plot_format
+    store = ResultStore(args.store) if args.store else None
+    if args.run and store is None:
+        parser.error("--run needs --store")
+    if args.runs:
+        compare_all_runs(args.runs, args.bootstrap, args.seed, store)
+    elif args.compare:
+        compare_runs(*args.compare, tolerance=args.tolerance, store=store)
+    elif args.run:
+        evaluate_from_store(store, args.run)
+    else:
+        evaluate_from_jsonl(args.input)
+    if store is not None:
+        store.close()
\ No newline at end of file
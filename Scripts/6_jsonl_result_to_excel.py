@@ -1,55 +1,196 @@
+import argparse
+import csv
 import json
-import pandas as pd
 import os
+import xlsxwriter
+from results_store import ResultStore
 
-# Convert enriched JSONL to formatted Excel file
-def jsonl_to_excel():
-    input_jsonl = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl): ").strip()
-    # Give the xlsx file the same name for easier identification
-    # Get the filename without extension
-    file_name = os.path.splitext(input_jsonl)[0]
-    output_xlsx = f"6_{file_name}.xlsx"
-    
-    # Collect data for Excel
-    excel_data = []
-    
+# Column order of the Excel file
+COLUMN_ORDER = [
+    'ID', 'Description', 'True Label', 'ChatGPT Classification', 'Classification Match', 
+    'Rule Level', 'Rule Priority','ChatGPT Priority', 'Priority Match', 
+    'Justification'
+]
+# Excel limits: rows per sheet (including the header) and characters per cell
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_CELL_LENGTH = 32767
+# Rows buffered per Parquet row group
+PARQUET_BATCH_ROWS = 10000
+OUTPUT_FORMATS = ["xlsx", "csv", "parquet"]
+
+def excel_row(alert):
+    # Extract key fields
+    return {
+        "ID": alert.get('id', ''),
+        "Description": alert.get('description', ''),
+        "True Label": alert.get('label', ''),
+        "Rule Level": alert.get('rule_level', ''),
+        "Rule Priority": alert.get('rule_priority', ''),
+        "ChatGPT Classification": alert.get('chatgpt_classification', 'MISSING'),
+        "Classification Match": alert.get('classification_match', False),
+        "ChatGPT Priority": alert.get('chatgpt_priority', 'MISSING'),
+        "Priority Match": alert.get('priority_match', False),
+        "Justification": alert.get('chatgpt_justification', '')
+    }
+
+class XlsxRowWriter:
+    # Rows go straight to disk (constant_memory), a new sheet is started when one is full
+    def __init__(self, output_file, columns):
+        self.workbook = xlsxwriter.Workbook(output_file, {"constant_memory": True})
+        self.columns = columns
+        self.sheets = 0
+        self.new_sheet()
+
+    def new_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.add_worksheet(f"Sheet{self.sheets}")
+        self.sheet.write_row(0, 0, self.columns)
+        self.row_number = 1
+
+    def write(self, row):
+        if self.row_number >= EXCEL_MAX_ROWS:
+            self.new_sheet()
+        values = []
+        for column in self.columns:
+            value = row.get(column)
+            if isinstance(value, str) and len(value) > EXCEL_MAX_CELL_LENGTH:
+                value = value[:EXCEL_MAX_CELL_LENGTH]
+            values.append(value)
+        self.sheet.write_row(self.row_number, 0, values)
+        self.row_number += 1
+
+    def close(self):
+        self.workbook.close()
+
+class CsvRowWriter:
+    def __init__(self, output_file, columns):
+        self.out_file = open(output_file, "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.out_file, fieldnames=columns, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.out_file.close()
+
+class ParquetRowWriter:
+    # Rows are buffered into row groups of PARQUET_BATCH_ROWS, pyarrow is only needed for this format
+    def __init__(self, output_file, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet export needs pyarrow (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.batch = []
+        # Every column is written as text except the match flags and the rule level
+        types = {"Classification Match": pyarrow.bool_(), "Priority Match": pyarrow.bool_(), "Rule Level": pyarrow.int64()}
+        self.schema = pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(output_file, self.schema)
+
+    def value(self, row, column):
+        value = row.get(column)
+        if value == '' or value is None:
+            return None
+        if column == "Rule Level":
+            return int(value)
+        if self.schema.field(column).type == self.pyarrow.string():
+            return str(value)
+        return value
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= PARQUET_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            table = self.pyarrow.table(
+                {column: [self.value(row, column) for row in self.batch] for column in self.columns}, schema=self.schema
+            )
+            self.writer.write_table(table)
+            self.batch.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+ROW_WRITERS = {"xlsx": XlsxRowWriter, "csv": CsvRowWriter, "parquet": ParquetRowWriter}
+
+def output_format(output_file):
+    extension = os.path.splitext(output_file)[1].lstrip(".").lower()
+    return extension if extension in ROW_WRITERS else "xlsx"
+
+def write_excel(excel_data, output_xlsx, columns=None):
+    # Stream rows (any iterable of excel_row dicts) to an xlsx, csv or parquet file chosen by the extension,
+    # only the current row (or Parquet row group) is held in memory
+    columns = columns or COLUMN_ORDER
+    writer = ROW_WRITERS[output_format(output_xlsx)](output_xlsx, columns)
+    count = 0
+    try:
+        for row in excel_data:
+            writer.write(row)
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+def read_excel_rows(input_jsonl):
     with open(input_jsonl, 'r', encoding='utf-8') as f:
         for line in f:
+            if not line.strip():
+                continue
             try:
-                alert = json.loads(line)
-                
-                # Extract key fields
-                row = {
-                    "ID": alert.get('id', ''),
-                    "Description": alert.get('description', ''),
-                    "True Label": alert.get('label', ''),
-                    "Rule Level": alert.get('rule_level', ''),
-                    "Rule Priority": alert.get('rule_priority', ''),
-                    "ChatGPT Classification": alert.get('chatgpt_classification', 'MISSING'),
-                    "Classification Match": alert.get('classification_match', False),
-                    "ChatGPT Priority": alert.get('chatgpt_priority', 'MISSING'),
-                    "Priority Match": alert.get('priority_match', False),
-                    "Justification": alert.get('chatgpt_justification', '')
-                }
-                
-                excel_data.append(row)
+                yield excel_row(json.loads(line))
             except json.JSONDecodeError:
                 print(f"Skipping malformed line: {line[:100]}...")
+
+# Convert enriched JSONL to formatted Excel file
+def jsonl_to_excel(input_jsonl=None, file_format="xlsx", columns=None):
+    if input_jsonl is None:
+        input_jsonl = input("Enter the path to your jsonl file (e.g. classified_alerts.jsonl): ").strip()
+    # Give the xlsx file the same name for easier identification
+    # Get the filename without extension
+    file_name = os.path.splitext(input_jsonl)[0]
+    output_xlsx = f"6_{file_name}.{file_format}"
     
-    # Create DataFrame
-    df = pd.DataFrame(excel_data)
-    
-    # Reorder columns
-    column_order = [
-        'ID', 'Description', 'True Label', 'ChatGPT Classification', 'Classification Match', 
-        'Rule Level', 'Rule Priority','ChatGPT Priority', 'Priority Match', 
-        'Justification'
-    ]
-    df = df[column_order]
-    
-    # Save to Excel
-    df.to_excel(output_xlsx, index=False)
-    print(f"Excel saved to {output_xlsx}")
+    count = write_excel(read_excel_rows(input_jsonl), output_xlsx, columns)
+    print(f"{count} rows saved to {output_xlsx}")
+
+def store_to_excel(store_path, run, file_format="xlsx", columns=None):
+    # Export one run of the results store, the raw alerts are not read
+    store = ResultStore(store_path)
+    output_xlsx = f"6_{run}.{file_format}"
+    try:
+        count = write_excel((excel_row(alert) for alert in store.iter_rows(run, with_alert=False)), output_xlsx, columns)
+    finally:
+        store.close()
+    print(f"{count} rows saved to {output_xlsx}")
+
+def parse_columns(columns):
+    # Comma separated subset of COLUMN_ORDER, in the given order
+    if not columns:
+        return None
+    selected = [column.strip() for column in columns.split(",") if column.strip()]
+    unknown = [column for column in selected if column not in COLUMN_ORDER]
+    if unknown:
+        raise SystemExit(f"Unknown columns: {', '.join(unknown)} (available: {', '.join(COLUMN_ORDER)})")
+    return selected
 
 if __name__ == "__main__":
-    jsonl_to_excel()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert results to an Excel, CSV or Parquet file")
+    parser.add_argument("--input", help="postprocessed jsonl file (asked for if neither --input nor --store is given)")
+    parser.add_argument("--store", help="results store (results_store.py) to read --run from")
+    parser.add_argument("--run", help="run of the results store to export")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="xlsx", help="output format (parquet needs pyarrow)")
+    parser.add_argument("--columns", help=f"comma separated columns to export (default: all of {', '.join(COLUMN_ORDER)})")
+    args = parser.parse_args()
+    columns = parse_columns(args.columns)
+    if args.store:
+        if not args.run:
+            parser.error("--store needs --run")
+        store_to_excel(args.store, args.run, args.format, columns)
+    else:
+        jsonl_to_excel(args.input, args.format, columns)
\ No newline at end of file
@@ -0,0 +1,18 @@
+import json
+
+# Exact token counts need the optional tiktoken package (and its encoding file), otherwise they are estimated
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+def count_tokens(text):
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # Rough estimate: about 4 characters per token for English text and json
+    return len(text) // 4 + 1
+
+def alert_tokens(alert):
+    # Tokens of the alert as it is sent to the model
+    return count_tokens(json.dumps(alert))
\ No newline at end of file
@@ -0,0 +1,197 @@
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from mock_llm_server import MockState, start_mock_server, client_environment, LATENCY, SEED
+
+# End-to-end benchmark of pipeline.py against the mock server (mock_llm_server.py), one fresh process per execution
+# mode so peak memory is measured per mode. Results go to a json file that can be compared across commits (--compare)
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "2_Merged", "2_alerts_preprocessed_merged_20250712_123030.jsonl")
+# Execution modes: stage 3 settings ("triage") and run_pipeline options ("pipeline") on top of the defaults.
+# The verdict cache is disabled in every mode so every alert reaches the (mock) API
+BENCHMARK_MODES = {
+    "sequential": {"triage": {"CONCURRENCY": 1}},
+    "concurrent": {},
+    "streaming": {"triage": {"STREAM_RESPONSES": True}},
+    "batch": {"triage": {"BATCH_SIZE": 10}},
+    "prefix_cache": {"triage": {"PREFIX_CACHE_LAYOUT": True}},
+    "cluster": {"pipeline": {"cluster": True}},
+    "fast_path": {"pipeline": {"fast_path": True}},
+    "repair": {"pipeline": {"repair": True}}
+}
+# Latency percentiles of the API calls reported per mode
+BENCHMARK_PERCENTILES = [50, 95, 99]
+# Relative change above which --compare flags a metric
+COMPARE_THRESHOLD = 0.10
+
+def run_mode(mode, input_file, output_dir, metrics_file, model=None):
+    # Child process: run the whole pipeline in one mode
+    pipeline = importlib.import_module("pipeline")
+    settings = BENCHMARK_MODES[mode]
+    pipeline.triage.CACHE_PATH = None
+    pipeline.triage.METRICS_PATH = metrics_file
+    if model:
+        pipeline.triage.MODEL = model
+    for name, value in settings.get("triage", {}).items():
+        setattr(pipeline.triage, name, value)
+    pipeline.evaluation.PLOT_FORMAT = "none"
+    options = dict(settings.get("pipeline", {}))
+    if options.pop("fast_path", False):
+        options["fast_path_rules"] = pipeline.fast_path.FAST_PATH_RULES
+    pipeline.run_pipeline(preprocessed_inputs=[input_file], output_dir=output_dir, seed=1, **options)
+
+def git_commit():
+    # Commit of the benchmarked scripts and whether they have uncommitted changes
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=repository).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True, cwd=repository).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def read_jsonl(input_file):
+    with open(input_file, 'r', encoding='utf-8') as in_file:
+        return [json.loads(row) for row in in_file if row.strip()]
+
+def measure_mode(mode, input_file, work_dir, mock_state, base_url, model=None):
+    # Run one mode in a fresh process and collect throughput, latency, memory and error counts
+    mode_dir = os.path.join(work_dir, mode)
+    os.makedirs(mode_dir, exist_ok=True)
+    metrics_file = os.path.join(mode_dir, "calls.jsonl")
+    command = [sys.executable, os.path.abspath(__file__), "--run-mode", mode, "--input", input_file, "--work-dir", mode_dir, "--metrics", metrics_file]
+    if model:
+        command += ["--model", model]
+    mock_state.reset()
+    with open(os.path.join(mode_dir, "pipeline.log"), "w", encoding="utf-8") as log_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env={**os.environ, **client_environment(base_url)})
+        # wait4 returns the resource usage of this child only
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.perf_counter() - start_time
+    output_files = glob.glob(os.path.join(mode_dir, "4_*_postprocessed.jsonl"))
+    rows = read_jsonl(output_files[0]) if output_files else []
+    calls = read_jsonl(metrics_file) if os.path.exists(metrics_file) else []
+    latencies = [call['api_time'] for call in calls]
+    percentiles = dict(zip(BENCHMARK_PERCENTILES, np.percentile(latencies, BENCHMARK_PERCENTILES))) if latencies else {}
+    return {
+        "exit_code": process.returncode,
+        "alerts": len(rows),
+        "wall_time": wall_time,
+        "alerts_per_second": len(rows) / wall_time if wall_time else 0.0,
+        **{f"latency_p{p}": percentiles.get(p) for p in BENCHMARK_PERCENTILES},
+        "api_calls": len(calls),
+        "retries": sum(call.get('retries', 0) for call in calls),
+        "input_tokens": sum(call.get('input_tokens') or 0 for call in calls),
+        "cached_tokens": sum(call.get('cached_tokens') or 0 for call in calls),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "error_rows": sum(1 for row in rows if row.get('triage_status') == "error"),
+        "invalid_rows": sum(1 for row in rows if 'validation_errors' in row),
+        "mock": dict(mock_state.stats)
+    }
+
+def run_benchmark(input_file, modes, output_file=None, latency=LATENCY, seed=SEED, rate_limit_rate=0.0, server_error_rate=0.0,
+                  malformed_rate=0.0, invalid_rate=0.0, model=None, work_dir=None):
+    commit, dirty = git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = output_file or f"benchmark_{commit or 'nogit'}_{timestamp}.json"
+    work_dir = work_dir or f"benchmark_{timestamp}"
+    mock_state = MockState(latency=latency, seed=seed, rate_limit_rate=rate_limit_rate, server_error_rate=server_error_rate,
+                           malformed_rate=malformed_rate, invalid_rate=invalid_rate)
+    server, base_url = start_mock_server(mock_state)
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "input": os.path.abspath(input_file),
+        "input_alerts": len(read_jsonl(input_file)),
+        "model": model,
+        "mock": mock_state.settings(),
+        "modes": {}
+    }
+    try:
+        for mode in modes:
+            print(f"Running {mode} ...", flush=True)
+            metrics = measure_mode(mode, os.path.abspath(input_file), os.path.abspath(work_dir), mock_state, base_url, model)
+            results["modes"][mode] = metrics
+            status = "" if metrics['exit_code'] == 0 else f" (exit code {metrics['exit_code']}, see {os.path.join(work_dir, mode, 'pipeline.log')})"
+            print(f"  {metrics['alerts']} alerts in {metrics['wall_time']:.2f}s ({metrics['alerts_per_second']:.1f} per second), "
+                  f"{metrics['api_calls']} calls, p99 {metrics['latency_p99'] or 0:.3f}s, peak RSS {metrics['peak_rss_mb']:.0f} MB{status}")
+    finally:
+        server.shutdown()
+    with open(output_file, "w", encoding="utf-8") as out_file:
+        json.dump(results, out_file, indent=2)
+    print(f"\nBenchmark results have been saved to: {output_file}")
+    return results
+
+def compare_benchmarks(baseline_file, candidate_file):
+    # Side by side comparison of two benchmark files (or two stage_benchmark.py files), changes above COMPARE_THRESHOLD are flagged
+    with open(baseline_file, 'r', encoding='utf-8') as in_file:
+        baseline = json.load(in_file)
+    with open(candidate_file, 'r', encoding='utf-8') as in_file:
+        candidate = json.load(in_file)
+    print(f"Baseline: {baseline.get('commit')} ({baseline.get('created_at')}), candidate: {candidate.get('commit')} ({candidate.get('created_at')})")
+    if baseline.get('mock') != candidate.get('mock') or baseline.get('input_alerts') != candidate.get('input_alerts') \
+            or baseline.get('synthetic') != candidate.get('synthetic'):
+        print("Warning: the runs used different mock settings or inputs")
+    runs = "stages" if "stages" in candidate else "modes"
+    # Metric and whether higher is better
+    metrics = [("alerts_per_second", True), ("latency_p99", False), ("peak_rss_mb", False), ("cpu_time", False), ("api_calls", False)]
+    print(f"{'mode':<14}" + "".join(f"{metric:>32}" for metric, _ in metrics))
+    for mode in candidate[runs]:
+        if mode not in baseline.get(runs, {}):
+            continue
+        cells = []
+        for metric, higher_is_better in metrics:
+            before = baseline[runs][mode].get(metric)
+            after = candidate[runs][mode].get(metric)
+            if before is None or after is None:
+                cells.append(f"{'-':>32}")
+                continue
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if abs(change) > COMPARE_THRESHOLD:
+                flag = " better" if (change > 0) == higher_is_better else " WORSE"
+            cells.append(f"{f'{before:.2f} -> {after:.2f} ({change:+.0%}){flag}':>32}")
+        print(f"{mode:<14}" + "".join(cells))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline in each execution mode against the mock LLM server")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help="preprocessed (merged) jsonl to triage (default: the published dataset)")
+    parser.add_argument("--modes", nargs="+", choices=list(BENCHMARK_MODES), default=list(BENCHMARK_MODES), help="execution modes to run")
+    parser.add_argument("--output", help="benchmark json file (default benchmark_<commit>_<timestamp>.json)")
+    parser.add_argument("--work-dir", help="directory for the pipeline outputs and logs of every mode")
+    parser.add_argument("--model", help="model requested from the mock server (selects the replayed run)")
+    parser.add_argument("--latency", default=LATENCY, help="latency distribution of the mock server (see mock_llm_server.py)")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="compare two benchmark files instead of running")
+    # Internal: run the pipeline of one mode in this process
+    parser.add_argument("--run-mode", choices=list(BENCHMARK_MODES), help=argparse.SUPPRESS)
+    parser.add_argument("--metrics", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.compare:
+        compare_benchmarks(*args.compare)
+    elif args.run_mode:
+        run_mode(args.run_mode, args.input, args.work_dir, args.metrics, args.model)
+    else:
+        run_benchmark(args.input, args.modes, args.output, args.latency, args.seed, args.rate_limit_rate, args.server_error_rate,
+                      args.malformed_rate, args.invalid_rate, args.model, args.work_dir)
\ No newline at end of file
@@ -0,0 +1,350 @@
+from openai import OpenAI, AsyncOpenAI
+import httpx
+import json
+import os
+import time
+from contextvars import ContextVar
+
+# Provider configuration
+# base_url: API endpoint, can be overridden with the environment variable named in base_url_env (e.g. for a local stand-in server)
+# api_key_env: environment variable holding the API key
+# api: "responses" (OpenAI Responses API with strict json schema) or "chat_completions" (json mode only)
+# batch_url: endpoint named in the lines of an offline batch file (None = the provider has no batch API)
+PROVIDERS = {
+    "openai": {
+        "base_url": "https://api.openai.com/v1",
+        "base_url_env": "OPENAI_BASE_URL",
+        "api_key_env": "OPENAI_API_KEY",
+        "api": "responses",
+        "batch_url": "/v1/responses"
+    },
+    "deepseek": {
+        "base_url": "https://api.deepseek.com",
+        "base_url_env": "DEEPSEEK_BASE_URL",
+        "api_key_env": "DEEPSEEK_API_KEY",
+        "api": "chat_completions",
+        "batch_url": None
+    }
+}
+# Model name prefixes that select a provider, everything else goes to DEFAULT_PROVIDER
+MODEL_PREFIX_PROVIDERS = {
+    "deepseek-": "deepseek"
+}
+DEFAULT_PROVIDER = "openai"
+
+# Connection pool per provider, kept alive for the whole run
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+KEEPALIVE_EXPIRY = 120
+REQUEST_TIMEOUT = 600
+# HTTP/2 is used when the optional h2 package is installed
+try:
+    import h2
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# Connection setup events reported by httpcore (TCP connect and TLS handshake)
+CONNECT_EVENTS = ("connection.connect_tcp", "connection.start_tls")
+
+# Long-lived clients, one per provider
+_clients = {}
+_async_clients = {}
+# Timing of the call that is currently running in this thread / asyncio task
+_call_timing = ContextVar("call_timing", default=None)
+
+def provider_for_model(model):
+    for prefix, provider in MODEL_PREFIX_PROVIDERS.items():
+        if model.startswith(prefix):
+            return provider
+    return DEFAULT_PROVIDER
+
+def _record_trace(event_name, info):
+    timing = _call_timing.get()
+    if timing is None:
+        return
+    # Measure how long new connections took, reused connections emit no connect events
+    for event in CONNECT_EVENTS:
+        if event_name == f"{event}.started":
+            timing["_connect_started"] = time.perf_counter()
+        elif event_name in (f"{event}.complete", f"{event}.failed") and "_connect_started" in timing:
+            timing["connect_time"] += time.perf_counter() - timing.pop("_connect_started")
+            if event == "connection.connect_tcp":
+                timing["new_connections"] += 1
+
+async def _record_trace_async(event_name, info):
+    _record_trace(event_name, info)
+
+def _count_attempt():
+    # The request hook runs once per HTTP request, so every attempt after the first is a retry of the client
+    timing = _call_timing.get()
+    if timing is not None:
+        timing["attempts"] += 1
+
+def _attach_trace(request):
+    _count_attempt()
+    request.extensions["trace"] = _record_trace
+
+async def _attach_trace_async(request):
+    _count_attempt()
+    request.extensions["trace"] = _record_trace_async
+
+def _client_settings(provider):
+    config = PROVIDERS[provider]
+    return {
+        "api_key": os.environ.get(config["api_key_env"], "<api key removed>"),
+        "base_url": os.environ.get(config["base_url_env"], config["base_url"]),
+        "timeout": REQUEST_TIMEOUT
+    }
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+def get_client(provider):
+    # Create the client on first use and reuse it (and its connections) afterwards
+    if provider not in _clients:
+        http_client = httpx.Client(
+            http2=HTTP2,
+            limits=_pool_limits(),
+            timeout=REQUEST_TIMEOUT,
+            event_hooks={"request": [_attach_trace]}
+        )
+        _clients[provider] = OpenAI(http_client=http_client, **_client_settings(provider))
+    return _clients[provider]
+
+def get_async_client(provider):
+    # Async clients are bound to the running event loop, close them with close_async_clients() before the loop ends
+    if provider not in _async_clients:
+        http_client = httpx.AsyncClient(
+            http2=HTTP2,
+            limits=_pool_limits(),
+            timeout=REQUEST_TIMEOUT,
+            event_hooks={"request": [_attach_trace_async]}
+        )
+        _async_clients[provider] = AsyncOpenAI(http_client=http_client, **_client_settings(provider))
+    return _async_clients[provider]
+
+def close_clients():
+    for client in _clients.values():
+        client.close()
+    _clients.clear()
+
+async def close_async_clients():
+    for client in _async_clients.values():
+        await client.close()
+    _async_clients.clear()
+
+def build_request(model, system_prompt, user_content, schema_name, schema, format_prompt="", provider=None,
+                  max_output_tokens=None, reasoning_effort=None, examples=()):
+    # Build the request body in the format of the provider's API
+    # max_output_tokens caps the generated tokens (reasoning included), reasoning_effort applies to OpenAI reasoning models
+    # examples: fixed few-shot (user content, assistant content) pairs, placed between the system prompt and the user content
+    provider = provider or provider_for_model(model)
+    example_messages = [
+        message
+        for example_content, example_answer in examples
+        for message in ({"role": "user", "content": example_content}, {"role": "assistant", "content": example_answer})
+    ]
+    if PROVIDERS[provider]["api"] == "responses":
+        body = {
+            "model": model,
+            "input": [
+                {"role": "system", "content": system_prompt},
+                *example_messages,
+                {"role": "user", "content": user_content}
+            ],
+            "text": {
+                "format": {
+                    "type": "json_schema",
+                    "name": schema_name,
+                    "strict": True,
+                    "schema": schema
+                }
+            }
+        }
+        if max_output_tokens is not None:
+            body["max_output_tokens"] = max_output_tokens
+        if reasoning_effort is not None:
+            body["reasoning"] = {"effort": reasoning_effort}
+        return body
+    # Json mode does not enforce a schema, so the expected format is described in the prompt
+    body = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt + format_prompt},
+            *example_messages,
+            {"role": "user", "content": user_content}
+        ],
+        "response_format": {
+            "type": "json_object"
+        }
+    }
+    if reasoning_effort is not None:
+        raise ValueError(f"Provider {provider} does not support a reasoning effort (OpenAI Responses API only)")
+    if max_output_tokens is not None:
+        body["max_tokens"] = max_output_tokens
+    return body
+
+def response_text(provider, response):
+    if PROVIDERS[provider]["api"] == "responses":
+        return response.output_text
+    return response.choices[0].message.content
+
+def batch_request_line(custom_id, body, provider=None):
+    # One line of an offline batch input file for a request built by build_request()
+    provider = provider or provider_for_model(body["model"])
+    batch_url = PROVIDERS[provider]["batch_url"]
+    if batch_url is None:
+        raise ValueError(f"Provider {provider} has no batch API")
+    return {"custom_id": custom_id, "method": "POST", "url": batch_url, "body": body}
+
+def batch_result(provider, result_line):
+    # Parse one line of a batch output file into (custom_id, json response or None, error message or None)
+    custom_id = result_line.get("custom_id")
+    response = result_line.get("response") or {}
+    if result_line.get("error") or response.get("status_code") != 200:
+        error = result_line.get("error") or response.get("body", {}).get("error") or f"status {response.get('status_code')}"
+        return custom_id, None, str(error)
+    body = response.get("body", {})
+    try:
+        if PROVIDERS[provider]["api"] == "responses":
+            # The raw response has no output_text, collect the text parts of the output messages
+            text = "".join(
+                content.get("text", "")
+                for item in body.get("output", []) if item.get("type") == "message"
+                for content in item.get("content", []) if content.get("type") == "output_text"
+            )
+        else:
+            text = body["choices"][0]["message"]["content"]
+        return custom_id, json.loads(text), None
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+        return custom_id, None, f"unparsable response: {e}"
+
+def _record_usage(timing, provider, response):
+    # Token counts reported by the API, missing details are recorded as None
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    if PROVIDERS[provider]["api"] == "responses":
+        input_details = getattr(usage, "input_tokens_details", None)
+        output_details = getattr(usage, "output_tokens_details", None)
+        timing["input_tokens"] = usage.input_tokens
+        timing["output_tokens"] = usage.output_tokens
+        timing["cached_tokens"] = getattr(input_details, "cached_tokens", None)
+        timing["reasoning_tokens"] = getattr(output_details, "reasoning_tokens", None)
+    else:
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        completion_details = getattr(usage, "completion_tokens_details", None)
+        timing["input_tokens"] = usage.prompt_tokens
+        timing["output_tokens"] = usage.completion_tokens
+        # DeepSeek reports its context cache hits as prompt_cache_hit_tokens
+        cached_tokens = getattr(prompt_details, "cached_tokens", None)
+        timing["cached_tokens"] = cached_tokens if cached_tokens is not None else getattr(usage, "prompt_cache_hit_tokens", None)
+        timing["reasoning_tokens"] = getattr(completion_details, "reasoning_tokens", None)
+
+def _send(client, provider, body):
+    if PROVIDERS[provider]["api"] == "responses":
+        return client.responses.create(**body)
+    return client.chat.completions.create(**body)
+
+def _new_timing(body):
+    return {
+        "model": body["model"], "api_time": 0, "connect_time": 0, "model_time": 0, "new_connections": 0,
+        "request_bytes": len(json.dumps(body)), "attempts": 0, "retries": 0,
+        "input_tokens": None, "cached_tokens": None, "output_tokens": None, "reasoning_tokens": None
+    }
+
+def _finish_timing(timing, start_time):
+    timing.pop("_connect_started", None)
+    timing["api_time"] = time.perf_counter() - start_time
+    timing["model_time"] = timing["api_time"] - timing["connect_time"]
+    timing["retries"] = max(timing["attempts"] - 1, 0)
+    return timing
+
+def query_model(body, provider=None):
+    # Send a request built by build_request() and return (json response or None, timing)
+    # timing holds the latency, request size, retries and the token usage reported by the API
+    provider = provider or provider_for_model(body["model"])
+    timing = _new_timing(body)
+    token = _call_timing.set(timing)
+    start_time = time.perf_counter()
+    try:
+        response = _send(get_client(provider), provider, body)
+        _record_usage(timing, provider, response)
+        return json.loads(response_text(provider, response)), _finish_timing(timing, start_time)
+    except Exception as e:
+        print(f"Error querying {body['model']}: {e}")
+        return None, _finish_timing(timing, start_time)
+    finally:
+        _call_timing.reset(token)
+
+async def _stream_deltas(client, provider, body, timing):
+    # Yield (kind, text) deltas of a streamed response, kind is "text" or "reasoning", usage is recorded at the end
+    if PROVIDERS[provider]["api"] == "responses":
+        stream = await client.responses.create(**body, stream=True)
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                yield "text", event.delta
+            elif event.type in ("response.reasoning_text.delta", "response.reasoning_summary_text.delta"):
+                yield "reasoning", event.delta
+            elif event.type in ("response.completed", "response.incomplete"):
+                _record_usage(timing, provider, event.response)
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(f"{event.type}: {getattr(event, 'message', None) or getattr(event, 'response', None)}")
+        return
+    stream = await client.chat.completions.create(**body, stream=True, stream_options={"include_usage": True})
+    async for chunk in stream:
+        if chunk.usage is not None:
+            _record_usage(timing, provider, chunk)
+        if chunk.choices:
+            delta = chunk.choices[0].delta
+            # deepseek-reasoner streams its chain of thought as reasoning_content before the answer
+            reasoning = getattr(delta, "reasoning_content", None)
+            if reasoning:
+                yield "reasoning", reasoning
+            if delta.content:
+                yield "text", delta.content
+
+async def query_model_stream_async(body, provider=None, on_text=None):
+    # Like query_model_async, but the response is streamed: on_text(text so far) is called after every text delta
+    # until it returns True, i.e. the caller has what it needs from the partial response (e.g. the routing decision).
+    # timing additionally holds time_to_first_token (text or reasoning) and time_to_decision (when on_text returned True)
+    provider = provider or provider_for_model(body["model"])
+    timing = _new_timing(body)
+    timing.update({"time_to_first_token": None, "time_to_decision": None})
+    token = _call_timing.set(timing)
+    start_time = time.perf_counter()
+    text = ""
+    try:
+        async for kind, delta in _stream_deltas(get_async_client(provider), provider, body, timing):
+            if timing["time_to_first_token"] is None:
+                timing["time_to_first_token"] = time.perf_counter() - start_time
+            if kind == "text":
+                text += delta
+                if on_text is not None and timing["time_to_decision"] is None and on_text(text):
+                    timing["time_to_decision"] = time.perf_counter() - start_time
+        return json.loads(text), _finish_timing(timing, start_time)
+    except Exception as e:
+        print(f"Error querying {body['model']}: {e}")
+        return None, _finish_timing(timing, start_time)
+    finally:
+        _call_timing.reset(token)
+
+async def query_model_async(body, provider=None):
+    provider = provider or provider_for_model(body["model"])
+    timing = _new_timing(body)
+    token = _call_timing.set(timing)
+    start_time = time.perf_counter()
+    try:
+        response = await _send(get_async_client(provider), provider, body)
+        _record_usage(timing, provider, response)
+        return json.loads(response_text(provider, response)), _finish_timing(timing, start_time)
+    except Exception as e:
+        print(f"Error querying {body['model']}: {e}")
+        return None, _finish_timing(timing, start_time)
+    finally:
+        _call_timing.reset(token)
\ No newline at end of file
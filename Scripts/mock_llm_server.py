@@ -0,0 +1,372 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from alert_tokens import count_tokens
+
+# Local stand-in for the OpenAI Responses API and the (DeepSeek) chat completions API, e.g. to benchmark the pipeline
+# without API costs: start it and point the scripts at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:8000/v1 DEEPSEEK_BASE_URL=http://127.0.0.1:8000
+# Verdicts are replayed by alert id from earlier stage 3 outputs, alerts without a recorded verdict get a
+# deterministic synthetic one. Latency, errors and malformed answers are drawn from a random generator seeded with
+# the seed, model, alert and attempt, so a run sees the same behaviour every time
+
+# Stage 3 outputs whose verdicts are replayed, runs are matched to the requested model by the model of their rows
+# or by their Results folder (e.g. 20250712_Run_2_gpt-41 for gpt-4.1)
+RESULTS_GLOB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Results", "*", "3_*.jsonl")
+# Latency of a response: fixed:SECONDS, uniform:LOW:HIGH, normal:MEAN:STD or lognormal:MEDIAN:SIGMA
+LATENCY = "lognormal:0.3:0.4"
+# Share of the latency before the first streamed token, the rest is spread over the chunks
+FIRST_TOKEN_SHARE = 0.3
+# Characters per streamed chunk
+STREAM_CHUNK_CHARS = 16
+# Shares of requests answered with 429 (with retry-after-ms), 500, truncated json or json with values outside the enums
+RATE_LIMIT_RATE = 0.0
+SERVER_ERROR_RATE = 0.0
+MALFORMED_RATE = 0.0
+INVALID_RATE = 0.0
+RETRY_AFTER_MS = 100
+# Prompt prefixes (everything before the last message) are reported as cached input tokens from their second use on,
+# in steps of 128 tokens above 1024 tokens like OpenAI's prompt caching
+PREFIX_CACHE_MIN_TOKENS = 1024
+PREFIX_CACHE_STEP = 128
+# Reasoning tokens reported by reasoning models (deepseek-reasoner, o-series)
+REASONING_TOKENS = 300
+REASONING_MODEL_PREFIXES = ("deepseek-reasoner", "o1", "o3", "o4")
+# Pending connections the listening socket holds (socketserver's default of 5 overflows at the default concurrency)
+LISTEN_BACKLOG = 128
+SEED = 0
+# Values outside the enums, as models without a strict schema sometimes answer
+INVALID_VALUES = {"classification": ["TRUE POSITIVE (TP)", "Likely FP", None], "priority": ["Medium-High", "P2", "Informational"]}
+
+def model_key(model):
+    # gpt-4.1-mini and the folder name gpt-41-mini map to the same key
+    return (model or "").replace(".", "").lower()
+
+def load_verdicts(results_glob=RESULTS_GLOB):
+    # {model key: {alert id: verdict}} of the replayed runs and {alert id: verdict} of the first run that has the alert
+    verdicts = {}
+    any_verdicts = {}
+    for results_file in sorted(glob.glob(results_glob)):
+        folder = os.path.basename(os.path.dirname(results_file))
+        # 20250712_Run_2_gpt-41 -> gpt-41
+        folder_model = folder.split("_Run_", 1)[-1].partition("_")[2] or folder
+        with open(results_file, 'r', encoding='utf-8') as in_file:
+            for row in in_file:
+                if not row.strip():
+                    continue
+                alert_row = json.loads(row)
+                response = alert_row.get('chatgpt_response')
+                if not isinstance(response, dict) or str(response.get('classification', '')).upper() == "ERROR":
+                    continue
+                verdict = {field: response.get(field) for field in ("classification", "priority", "justification")}
+                verdicts.setdefault(model_key(alert_row.get('model') or folder_model), {})[alert_row.get('id')] = verdict
+                any_verdicts.setdefault(alert_row.get('id'), verdict)
+    return verdicts, any_verdicts
+
+def parse_latency(spec):
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    samplers = {
+        "fixed": lambda rng: values[0],
+        "uniform": lambda rng: rng.uniform(values[0], values[1]),
+        "normal": lambda rng: max(0.0, rng.gauss(values[0], values[1])),
+        "lognormal": lambda rng: rng.lognormvariate(0, values[1]) * values[0]
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution {spec} (fixed, uniform, normal or lognormal)")
+    return samplers[kind]
+
+def message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+def alert_ids(messages):
+    # Alert id(s) of a request: the last message holding an alert (single requests) or an array of alerts (batch requests)
+    for message in reversed(messages):
+        if message.get("role") != "user":
+            continue
+        try:
+            content = json.loads(message_text(message))
+        except (json.JSONDecodeError, TypeError):
+            # Repair requests end with the instructions, the alert is in an earlier message
+            continue
+        if isinstance(content, list):
+            return [item.get("alert_id", "MISSING") for item in content if isinstance(item, dict)]
+        if isinstance(content, dict):
+            return content.get("_id", "MISSING")
+    return "MISSING"
+
+class MockState:
+    # Replayed verdicts, behaviour settings and counters shared by the request threads
+    def __init__(self, results_glob=RESULTS_GLOB, latency=LATENCY, seed=SEED, rate_limit_rate=RATE_LIMIT_RATE, server_error_rate=SERVER_ERROR_RATE,
+                 malformed_rate=MALFORMED_RATE, invalid_rate=INVALID_RATE):
+        self.verdicts, self.any_verdicts = load_verdicts(results_glob)
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.seed = seed
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.malformed_rate = malformed_rate
+        self.invalid_rate = invalid_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def settings(self):
+        return {
+            "latency": self.latency, "seed": self.seed, "rate_limit_rate": self.rate_limit_rate, "server_error_rate": self.server_error_rate,
+            "malformed_rate": self.malformed_rate, "invalid_rate": self.invalid_rate, "replayed_verdicts": len(self.any_verdicts)
+        }
+
+    def reset(self):
+        # Forget attempts and cached prefixes too, so the next run sees the same behaviour as the first
+        with self.lock:
+            self.attempts = {}
+            self.prefixes = set()
+            self.stats = {"requests": 0, "rate_limited": 0, "server_errors": 0, "malformed": 0, "invalid": 0, "replayed": 0, "synthetic": 0, "streamed": 0}
+
+    def count(self, field, amount=1):
+        with self.lock:
+            self.stats[field] += amount
+
+    def request_rng(self, model, ids):
+        # Seeded per model, alert(s) and attempt, so retries of the same alert draw new values
+        key = f"{model}|{json.dumps(ids)}"
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        digest = hashlib.sha256(f"{self.seed}|{key}|{attempt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+    def verdict(self, model, id):
+        verdict = self.verdicts.get(model_key(model), {}).get(id) or self.any_verdicts.get(id)
+        if verdict is not None:
+            self.count("replayed")
+            return {"alert_id": id, **verdict}
+        # Unknown alert (e.g. synthetic data): a deterministic verdict from the id
+        self.count("synthetic")
+        id_rng = random.Random(int.from_bytes(hashlib.sha256(str(id).encode("utf-8")).digest()[:8], "little"))
+        return {
+            "alert_id": id,
+            "classification": id_rng.choice(["TP", "FP"]),
+            "priority": id_rng.choice(["Low", "Low", "Low", "Medium", "High", "Critical"]),
+            "justification": "Synthetic verdict of the mock server for an alert without a recorded verdict."
+        }
+
+    def cached_tokens(self, messages):
+        prefix = json.dumps(messages[:-1])
+        tokens = count_tokens(prefix)
+        if tokens < PREFIX_CACHE_MIN_TOKENS:
+            return 0
+        digest = hashlib.sha256(prefix.encode("utf-8")).digest()
+        with self.lock:
+            seen = digest in self.prefixes
+            self.prefixes.add(digest)
+        return tokens // PREFIX_CACHE_STEP * PREFIX_CACHE_STEP if seen else 0
+
+def enum_schema(body):
+    # Strict schemas restricted to the enums (the stage 4 repair) cannot be answered with invalid values
+    schema = body.get("text", {}).get("format", {}).get("schema", {})
+    return "enum" in json.dumps(schema)
+
+def answer(state, body, rng):
+    # Response text of a request, possibly malformed or invalid
+    messages = body.get("input") or body.get("messages") or []
+    ids = alert_ids(messages)
+    if isinstance(ids, list):
+        answer_object = {"verdicts": [state.verdict(body["model"], id) for id in ids]}
+        verdicts = answer_object["verdicts"]
+    else:
+        answer_object = state.verdict(body["model"], ids)
+        verdicts = [answer_object]
+    if verdicts and not enum_schema(body) and rng.random() < state.invalid_rate:
+        state.count("invalid")
+        field = rng.choice(list(INVALID_VALUES))
+        rng.choice(verdicts)[field] = rng.choice(INVALID_VALUES[field])
+    text = json.dumps(answer_object)
+    if rng.random() < state.malformed_rate:
+        state.count("malformed")
+        text = text[:rng.randint(1, max(1, len(text) - 2))]
+    return messages, text
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, content, headers=()):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, data, event=None):
+        # One server-sent event as a chunk of the chunked response
+        message = ((f"event: {event}\n" if event else "") + f"data: {data}\n\n").encode("utf-8")
+        self.wfile.write(f"{len(message):x}\r\n".encode("ascii") + message + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, {**self.state.stats, "settings": self.state.settings()})
+        else:
+            self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        state = self.state
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        responses_api = self.path.rstrip("/").endswith("/responses")
+        if not responses_api and not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+            return
+        state.count("requests")
+        messages = body.get("input") or body.get("messages") or []
+        rng = state.request_rng(body.get("model"), alert_ids(messages))
+        latency = state.sample_latency(rng)
+        # Errors are decided first so the answer does not depend on whether an error was drawn
+        error_draw = rng.random()
+        messages, text = answer(state, body, rng)
+        if error_draw < state.rate_limit_rate:
+            state.count("rate_limited")
+            time.sleep(latency * FIRST_TOKEN_SHARE)
+            self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                           [("retry-after-ms", str(RETRY_AFTER_MS))])
+            return
+        if error_draw < state.rate_limit_rate + state.server_error_rate:
+            state.count("server_errors")
+            time.sleep(latency * FIRST_TOKEN_SHARE)
+            self.send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+            return
+        input_tokens = count_tokens(json.dumps(messages))
+        cached_tokens = state.cached_tokens(messages)
+        reasoning_tokens = REASONING_TOKENS if str(body.get("model", "")).startswith(REASONING_MODEL_PREFIXES) else 0
+        # Output cap (max_output_tokens / max_tokens) counts reasoning tokens too
+        cap = body.get("max_output_tokens") or body.get("max_tokens")
+        output_tokens = count_tokens(text)
+        incomplete = cap is not None and reasoning_tokens + output_tokens > cap
+        if incomplete:
+            text = text[:max(0, cap - reasoning_tokens) * 4]
+            output_tokens = count_tokens(text) if text else 0
+        usage = (input_tokens, cached_tokens, output_tokens + reasoning_tokens, reasoning_tokens)
+        if body.get("stream"):
+            state.count("streamed")
+            self.stream(body, responses_api, text, latency, usage, incomplete)
+            return
+        time.sleep(latency)
+        if responses_api:
+            self.send_json(200, responses_body(body, text, usage, incomplete))
+        else:
+            self.send_json(200, chat_completions_body(body, text, usage, incomplete))
+
+    def stream(self, body, responses_api, text, latency, usage, incomplete):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [text[start:start + STREAM_CHUNK_CHARS] for start in range(0, len(text), STREAM_CHUNK_CHARS)]
+        time.sleep(latency * FIRST_TOKEN_SHARE)
+        chunk_delay = latency * (1 - FIRST_TOKEN_SHARE) / max(len(chunks), 1)
+        for index, chunk in enumerate(chunks):
+            if responses_api:
+                self.send_event(json.dumps({
+                    "type": "response.output_text.delta", "item_id": "msg_mock", "output_index": 0, "content_index": 0,
+                    "delta": chunk, "sequence_number": index, "logprobs": []
+                }), "response.output_text.delta")
+            else:
+                self.send_event(json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
+                }))
+            time.sleep(chunk_delay)
+        if responses_api:
+            event = "response.incomplete" if incomplete else "response.completed"
+            response = responses_body(body, text, usage, incomplete)
+            self.send_event(json.dumps({"type": event, "sequence_number": len(chunks), "response": response}), event)
+        else:
+            self.send_event(json.dumps({
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"],
+                "choices": [], "usage": chat_completions_body(body, text, usage, incomplete)["usage"]
+            }))
+            self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def responses_body(body, text, usage, incomplete):
+    input_tokens, cached_tokens, output_tokens, reasoning_tokens = usage
+    return {
+        "id": "resp_mock", "object": "response", "created_at": int(time.time()), "model": body["model"],
+        "status": "incomplete" if incomplete else "completed",
+        "incomplete_details": {"reason": "max_output_tokens"} if incomplete else None,
+        "output": [{
+            "type": "message", "id": "msg_mock", "status": "incomplete" if incomplete else "completed", "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}]
+        }],
+        "usage": {
+            "input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": cached_tokens},
+            "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": reasoning_tokens},
+            "total_tokens": input_tokens + output_tokens
+        },
+        "parallel_tool_calls": False, "tool_choice": "auto", "tools": []
+    }
+
+def chat_completions_body(body, text, usage, incomplete):
+    input_tokens, cached_tokens, output_tokens, reasoning_tokens = usage
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "length" if incomplete else "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {
+            "prompt_tokens": input_tokens, "completion_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+            # DeepSeek reports its context cache hits like this
+            "prompt_cache_hit_tokens": cached_tokens, "prompt_cache_miss_tokens": input_tokens - cached_tokens,
+            "completion_tokens_details": {"reasoning_tokens": reasoning_tokens}
+        }
+    }
+
+class MockServer(ThreadingHTTPServer):
+    request_queue_size = LISTEN_BACKLOG
+    daemon_threads = True
+
+def start_mock_server(state, host="127.0.0.1", port=0):
+    # Serve in a background thread, returns (server, base url), stop with server.shutdown()
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def client_environment(base_url):
+    # Environment variables that point llm_backends at the mock server
+    return {"OPENAI_BASE_URL": f"{base_url}/v1", "DEEPSEEK_BASE_URL": base_url, "OPENAI_API_KEY": "mock", "DEEPSEEK_API_KEY": "mock"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI / DeepSeek compatible mock server replaying recorded verdicts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--results", default=RESULTS_GLOB, help="glob of stage 3 outputs whose verdicts are replayed")
+    parser.add_argument("--latency", default=LATENCY, help=f"fixed:S, uniform:LOW:HIGH, normal:MEAN:STD or lognormal:MEDIAN:SIGMA (default {LATENCY})")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--rate-limit-rate", type=float, default=RATE_LIMIT_RATE, help="share of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=SERVER_ERROR_RATE, help="share of requests answered with 500")
+    parser.add_argument("--malformed-rate", type=float, default=MALFORMED_RATE, help="share of answers cut off mid json")
+    parser.add_argument("--invalid-rate", type=float, default=INVALID_RATE, help="share of answers with a value outside the enums")
+    args = parser.parse_args()
+    state = MockState(args.results, args.latency, args.seed, args.rate_limit_rate, args.server_error_rate, args.malformed_rate, args.invalid_rate)
+    server, base_url = start_mock_server(state, args.host, args.port)
+    print(f"Mock server with {len(state.any_verdicts)} replayed verdicts on {base_url}, point the scripts at it with:")
+    print(" ".join(f"{name}={value}" for name, value in client_environment(base_url).items()))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
\ No newline at end of file
@@ -0,0 +1,218 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from results_store import ResultStore, WRITE_BATCH
+
+# The stage scripts start with a digit and can only be imported via importlib
+preprocessing = importlib.import_module("1_alert_preprocessing")
+merging = importlib.import_module("2_alert_random_merging")
+fast_path = importlib.import_module("1b_alert_fast_path")
+clustering = importlib.import_module("2b_alert_clustering")
+ml_first_tier = importlib.import_module("2c_alert_ml_first_tier")
+triage = importlib.import_module("3_alert_classification_prioritisation")
+postprocessing = importlib.import_module("4_alert_postprocessing")
+evaluation = importlib.import_module("5_result_evaluation")
+export = importlib.import_module("6_jsonl_result_to_excel")
+
+def read_lines(input_file):
+    with open(input_file, 'r', encoding='utf-8') as in_file:
+        for row in in_file:
+            if row.strip():
+                yield row
+
+def write_rows(rows, output_file):
+    # Pass rows through unchanged while saving them as an intermediate file
+    with open(output_file, "w", encoding="utf-8") as out_file:
+        for alert_row in rows:
+            out_file.write(json.dumps(alert_row) + "\n")
+            yield alert_row
+
+def load_alerts(raw_inputs, preprocessed_inputs, output_path, seed=None):
+    # Stages 1 and 2: preprocess raw exports (FILE:LABEL) and/or read preprocessed files, then merge them in random order
+    row_sources = []
+    for raw_input in raw_inputs:
+        input_file, _, input_label = raw_input.rpartition(":")
+        stats = {}
+        rows = list(preprocessing.preprocess_alerts(read_lines(input_file), input_label, stats))
+        if output_path is not None:
+            list(write_rows(rows, output_path(f"1_{input_label}_alerts_preprocessed")))
+        print(f"Preprocessed {input_file}: {stats['alerts']} {input_label} alerts, duplicate IDs: {stats['duplicates']}")
+        preprocessing.print_preprocessing_stats(stats)
+        row_sources.append(rows)
+    for input_file in preprocessed_inputs:
+        row_sources.append([json.loads(row) for row in read_lines(input_file)])
+    merged_rows = merging.merge_rows(row_sources, seed)
+    if output_path is not None:
+        list(write_rows(merged_rows, output_path("2_alerts_preprocessed_merged")))
+    return merged_rows
+
+async def triage_and_postprocess(alert_rows, stats, cache, journal, out_file, on_row, repair=False):
+    # Stages 3 and 4: triage alerts in input order and postprocess each verdict as soon as it arrives,
+    # returns the repaired rows by id (--repair) once every alert is triaged
+    invalid_rows = {}
+    try:
+        async for alert_row, timing in triage.triage_alerts(alert_rows, cache):
+            triage.record_stats(stats, alert_row, timing)
+            if journal is not None:
+                triage.append_row(journal, alert_row)
+            alert_row = postprocessing.postprocess_row(alert_row, stats['bad_priorities'])
+            if 'validation_errors' in alert_row:
+                invalid_rows[alert_row.get('id', 'MISSING')] = alert_row
+            out_file.write(json.dumps(alert_row) + "\n")
+            on_row(alert_row)
+        stats['invalid'] = len(invalid_rows)
+        if repair and invalid_rows:
+            return invalid_rows, await postprocessing.repair_rows_async(invalid_rows, stats)
+        return invalid_rows, {}
+    finally:
+        await triage.close_async_clients()
+        triage.close_decisions()
+
+def run_pipeline(raw_inputs=(), preprocessed_inputs=(), output_dir=".", seed=None, cluster=False,
+                 keep_intermediate=False, evaluate=True, excel=True, fast_path_rules=None, ml_models=None, store_path=None, repair=False):
+    script_start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run_name = f"alerts_classified_prioritised_{timestamp}"
+
+    def output_path(name):
+        return os.path.join(output_dir, f"{name}_{timestamp}.jsonl")
+
+    merged_rows = load_alerts(raw_inputs, preprocessed_inputs, output_path if keep_intermediate else None, seed)
+    alert_rows = merged_rows
+    if fast_path_rules is not None:
+        # Resolve obvious alerts with the fast path rules, stage 3 passes their verdicts through
+        fast_path_stats = {}
+        merged_rows = list(fast_path.apply_fast_path(merged_rows, fast_path.compile_rules(fast_path_rules), fast_path_stats))
+        fast_path.print_fast_path_stats(fast_path_stats)
+        alert_rows = merged_rows
+    if cluster:
+        cluster_stats = {}
+        alert_rows = clustering.tag_clusters(lambda: iter(merged_rows), cluster_stats)
+        if keep_intermediate:
+            alert_rows = write_rows(alert_rows, output_path("2b_alerts_preprocessed_merged_clustered"))
+    if ml_models is not None:
+        # Resolve confidently predicted alerts locally, only the rest reaches stage 3
+        ml_stats = {}
+        alert_rows = ml_first_tier.score_alerts(ml_models, alert_rows, ml_stats)
+
+    output_file = os.path.join(output_dir, f"4_{run_name}_postprocessed.jsonl")
+    # Collect what stages 5 and 6 need while the rows stream past, alerts are read again from the output if needed
+    predictions = evaluation.new_predictions(lambda: evaluation.read_rows(output_file))
+    store = None
+    store_rows = []
+    if store_path is not None:
+        store = ResultStore(store_path)
+        store.add_run(run_name, triage.MODEL, "pipeline.py")
+
+    def on_row(alert_row):
+        if store is not None:
+            store_rows.append(alert_row)
+            if len(store_rows) >= WRITE_BATCH:
+                store.write_rows(run_name, store_rows)
+                store_rows.clear()
+        if evaluate:
+            evaluation.add_prediction(predictions, alert_row)
+
+    stats = triage.new_stats()
+    stats['bad_priorities'] = []
+    cache = triage.open_cache()
+    try:
+        with ExitStack() as files:
+            out_file = files.enter_context(open(output_file, "w", encoding="utf-8"))
+            journal = None
+            if keep_intermediate:
+                journal = files.enter_context(open(os.path.join(output_dir, f"3_{run_name}.jsonl"), "w", encoding="utf-8"))
+            invalid_rows, repaired_rows = asyncio.run(triage_and_postprocess(alert_rows, stats, cache, journal, out_file, on_row, repair))
+        if repaired_rows:
+            # Merge the repaired verdicts back by id, the store replaces the rows of the run by id too
+            postprocessing.merge_repaired(output_file, repaired_rows)
+            store_rows.extend(repaired_rows.values())
+            if evaluate:
+                predictions = evaluation.new_predictions(lambda: evaluation.read_rows(output_file))
+                for alert_row in evaluation.read_rows(output_file):
+                    evaluation.add_prediction(predictions, alert_row)
+    finally:
+        if cache is not None:
+            stats['cache'] = cache.stats()
+            cache.close()
+        if store is not None:
+            store.write_rows(run_name, store_rows)
+            store.close()
+
+    triage.print_stats(stats, time.perf_counter() - script_start)
+    if ml_models is not None:
+        ml_first_tier.print_scoring_stats(ml_stats)
+    if cluster:
+        print(f"Clusters: {cluster_stats['clusters']} for {cluster_stats['alerts']} alerts (clusters with mixed labels: {cluster_stats['mixed_label_clusters']})")
+    print(f"\nPost processed alerts have been saved to: {output_file}\nBad Priorities: {stats['bad_priorities']}")
+    print(f"Invalid verdicts: {stats['invalid']}")
+    if repaired_rows:
+        postprocessing.print_repair_stats(invalid_rows, repaired_rows)
+    if store is not None:
+        print(f"Run {run_name} has been saved to the results store: {store_path}")
+
+    if evaluate and predictions['true_labels']:
+        evaluation.evaluate_predictions(predictions, os.path.join(output_dir, f"5_{run_name}"))
+    if excel:
+        output_xlsx = os.path.join(output_dir, f"6_{run_name}.xlsx")
+        # Streamed from the postprocessed file so the rows are not held in memory
+        export.write_excel(export.read_excel_rows(output_file), output_xlsx)
+        print(f"Excel saved to {output_xlsx}")
+    return stats
+
+# Run all stages without prompts, e.g. from cron
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run preprocessing, merging, triage, postprocessing, evaluation and Excel export in one go")
+    parser.add_argument("--input", action="append", default=[], metavar="FILE:LABEL", help="raw Wazuh export and its label (TP or FP), repeatable")
+    parser.add_argument("--preprocessed", action="append", default=[], metavar="FILE", help="already preprocessed (or merged) jsonl, repeatable")
+    parser.add_argument("--output-dir", default=".", help="directory for the output files")
+    parser.add_argument("--seed", type=int, help="seed for the random merge order")
+    parser.add_argument("--cluster", action="store_true", help="query one representative per alert cluster (see 2b_alert_clustering.py)")
+    parser.add_argument("--fast-path", action="store_true", help="resolve obvious alerts with the fast path rules (see 1b_alert_fast_path.py)")
+    parser.add_argument("--fast-path-rules", help="json file with fast path rules instead of the built-in ones (implies --fast-path)")
+    parser.add_argument("--ml-model", metavar="MODEL_FILE", help="resolve confident alerts with a local model trained by 2c_alert_ml_first_tier.py --train")
+    parser.add_argument("--model", help=f"model to use (default {triage.MODEL})")
+    parser.add_argument("--minimise", action="store_true", help="minimise alerts during preprocessing")
+    parser.add_argument("--keep-intermediate", action="store_true", help="also write the stage 1, 2 and 3 files")
+    parser.add_argument("--store", help="also write the run to this results store (results_store.py)")
+    parser.add_argument("--stream", action="store_true", help="stream responses (see 3_alert_classification_prioritisation.py --stream)")
+    parser.add_argument("--decisions", metavar="DECISIONS_FILE", help="append routing decisions to this jsonl file as soon as they are known (implies --stream)")
+    parser.add_argument("--max-output-tokens", type=int, help="cap of generated tokens per request (reasoning included)")
+    parser.add_argument("--prefix-cache", action="store_true", help="prompt prefix cache friendly alert layout (see prompt_builder.py)")
+    parser.add_argument("--few-shot", metavar="EXAMPLES_FILE", help="labelled jsonl whose alerts are sent as fixed few-shot examples")
+    parser.add_argument("--repair", action="store_true", help="re-query the model for verdicts that are still invalid after postprocessing (see 4_alert_postprocessing.py --repair)")
+    parser.add_argument("--metrics", metavar="METRICS_FILE", help="append per-call latency, token and cost records to this jsonl file")
+    parser.add_argument("--prometheus", metavar="PROM_FILE", help="write the triage summary in Prometheus text format")
+    parser.add_argument("--no-evaluation", action="store_true", help="skip stage 5")
+    parser.add_argument("--plot-format", choices=["png", "svg", "none"], default=evaluation.PLOT_FORMAT, help="format of the confusion matrix figures")
+    parser.add_argument("--no-excel", action="store_true", help="skip stage 6")
+    args = parser.parse_args()
+    if not args.input and not args.preprocessed:
+        parser.error("at least one --input or --preprocessed file is required")
+    if args.model:
+        triage.MODEL = args.model
+    evaluation.PLOT_FORMAT = args.plot_format
+    triage.METRICS_PATH = args.metrics
+    triage.STREAM_RESPONSES = args.stream or args.decisions is not None
+    triage.DECISIONS_PATH = args.decisions
+    triage.MAX_OUTPUT_TOKENS = args.max_output_tokens
+    triage.PREFIX_CACHE_LAYOUT = args.prefix_cache
+    if args.few_shot:
+        triage.FEW_SHOT_EXAMPLES = triage.load_examples(args.few_shot, triage.alert_content)
+    triage.PROMETHEUS_PATH = args.prometheus
+    if args.minimise:
+        preprocessing.MINIMISE_ALERTS = True
+    fast_path_rules = None
+    if args.fast_path_rules:
+        fast_path_rules = fast_path.load_rules(args.fast_path_rules)
+    elif args.fast_path:
+        fast_path_rules = fast_path.FAST_PATH_RULES
+    ml_models = ml_first_tier.load_models(args.ml_model) if args.ml_model else None
+    run_pipeline(args.input, args.preprocessed, args.output_dir, args.seed, args.cluster,
+                 args.keep_intermediate, not args.no_evaluation, not args.no_excel, fast_path_rules, ml_models, args.store, args.repair)
\ No newline at end of file
@@ -0,0 +1,62 @@
+import json
+from alert_tokens import count_tokens
+
+# Providers cache the longest previously seen prompt prefix (OpenAI from 1024 tokens on, in steps of 128 tokens),
+# so everything that is the same for every alert goes first and the alert is serialised from its most to its least
+# shared fields: alerts of the same rule on the same agent then share a long prefix as well
+
+# Field order per object (dotted path from the top of the export): (fields first, in this order; fields last, in this order),
+# all other fields are sorted in between. Stable fields repeat across alerts of the same rule / agent, volatile ones
+# differ for every occurrence
+FIELD_ORDER = {
+    "": (["_source"], ["_index", "_id", "_version", "_score", "fields", "sort"]),
+    "_source": (["rule", "decoder", "agent", "manager", "location", "input"], ["data", "full_log", "previous_output", "predecoder", "id", "timestamp", "@timestamp"]),
+    # Number of times the rule fired so far
+    "_source.rule": ([], ["firedtimes"])
+}
+
+def ordered_value(value, path=""):
+    # Objects with a deterministic key order so equal content is always serialised the same way
+    if isinstance(value, dict):
+        first, last = FIELD_ORDER.get(path, ([], []))
+        keys = [key for key in first if key in value]
+        keys += sorted(key for key in value if key not in first and key not in last)
+        keys += [key for key in last if key in value]
+        return {key: ordered_value(value[key], f"{path}.{key}" if path else key) for key in keys}
+    if isinstance(value, list):
+        return [ordered_value(item, path) for item in value]
+    return value
+
+def ordered_alert(alert):
+    # The alert from its most to its least shared fields: _source first (rule, decoder, agent, ..., volatile fields last),
+    # then the other top level fields
+    return ordered_value(alert)
+
+def serialise_alert(alert):
+    return json.dumps(ordered_alert(alert))
+
+def load_examples(examples_file, serialise=json.dumps):
+    # Fixed few-shot examples from a labelled jsonl file (preprocessed rows or result rows):
+    # the alert as user message and its ground truth verdict as the assistant answer
+    examples = []
+    with open(examples_file, 'r', encoding='utf-8') as in_file:
+        for row in in_file:
+            if not row.strip():
+                continue
+            alert_row = json.loads(row)
+            # A run's justification argues for the run's verdict, it only fits the ground truth where the run got both right
+            run_justification = alert_row.get('chatgpt_justification') if alert_row.get('classification_match') and alert_row.get('priority_match') else None
+            verdict = {
+                "alert_id": alert_row.get('id', 'MISSING'),
+                "classification": alert_row.get('label', 'MISSING').strip().upper(),
+                "priority": alert_row.get('rule_priority', 'MISSING').strip().capitalize(),
+                "justification": alert_row.get('justification') or run_justification or "Example verdict"
+            }
+            examples.append((serialise(alert_row.get('alert', {})), json.dumps(verdict)))
+    return examples
+
+def static_prefix_tokens(body):
+    # Estimated tokens of everything before the alert message, the part every request of a run shares
+    messages = body.get('input') or body.get('messages') or []
+    static = {key: value for key, value in body.items() if key not in ('input', 'messages')}
+    return count_tokens(json.dumps(static) + json.dumps(messages[:-1]))
\ No newline at end of file
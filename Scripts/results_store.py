@@ -0,0 +1,183 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+# Fields of a result row that describe the alert and its ground truth, stored once per distinct alert
+ALERT_FIELDS = ["description", "label", "rule_level", "rule_priority"]
+# Verdict fields stored as columns, every other field of a row (telemetry, cache_hit, ...) goes to details
+VERDICT_COLUMNS = {
+    "chatgpt_classification": "classification",
+    "chatgpt_priority": "priority",
+    "chatgpt_justification": "justification",
+    "classification_match": "classification_match",
+    "priority_match": "priority_match",
+    "triage_status": "triage_status",
+    "triage_source": "triage_source"
+}
+# Fields left out of details, iter_rows rebuilds chatgpt_response from the verdict columns
+DERIVED_FIELDS = ["chatgpt_response"]
+# Rows written per transaction
+WRITE_BATCH = 1000
+
+def alert_hash(alert):
+    return hashlib.sha256(json.dumps(alert, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class ResultStore:
+    # Alert corpus stored once (by content hash, so minimised and full variants of an alert can coexist)
+    # and the verdicts of every run as narrow rows keyed by run and alert id
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            "alert_hash TEXT PRIMARY KEY, id TEXT, description TEXT, label TEXT, rule_level INTEGER, rule_priority TEXT, alert TEXT);"
+            "CREATE INDEX IF NOT EXISTS alerts_id ON alerts(id);"
+            "CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, model TEXT, created_at TEXT, source TEXT);"
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "run TEXT, id TEXT, model TEXT, alert_hash TEXT, classification TEXT, priority TEXT, justification TEXT, "
+            "classification_match INTEGER, priority_match INTEGER, triage_status TEXT, triage_source TEXT, details TEXT, "
+            "PRIMARY KEY (run, id));"
+            "CREATE INDEX IF NOT EXISTS verdicts_id ON verdicts(id);"
+            "CREATE INDEX IF NOT EXISTS verdicts_model ON verdicts(model, run);"
+        )
+
+    def add_run(self, run, model=None, source=None):
+        # Register a run, rows written again for an existing run replace the earlier ones
+        self.conn.execute(
+            "INSERT INTO runs (run, model, created_at, source) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(run) DO UPDATE SET model = COALESCE(excluded.model, model), source = COALESCE(excluded.source, source)",
+            (run, model, datetime.now().isoformat(timespec="seconds"), source)
+        )
+        self.conn.commit()
+
+    def write_rows(self, run, rows, model=None):
+        # Store result rows of one run, returns the number of rows written
+        count = 0
+        alert_batch = []
+        verdict_batch = []
+        for alert_row in rows:
+            alert = alert_row.get('alert')
+            content_hash = alert_hash(alert) if alert is not None else None
+            if alert is not None:
+                alert_batch.append((content_hash, alert_row.get('id', 'MISSING'), *(alert_row.get(field) for field in ALERT_FIELDS), json.dumps(alert)))
+            details = {
+                field: value for field, value in alert_row.items()
+                if field not in VERDICT_COLUMNS and field not in ALERT_FIELDS and field not in DERIVED_FIELDS and field not in ("id", "alert", "model")
+            }
+            verdict_batch.append((
+                run, alert_row.get('id', 'MISSING'), alert_row.get('model', model), content_hash,
+                *(alert_row.get(field) for field in VERDICT_COLUMNS), json.dumps(details)
+            ))
+            count += 1
+            if len(verdict_batch) >= WRITE_BATCH:
+                self._write_batch(alert_batch, verdict_batch)
+        self._write_batch(alert_batch, verdict_batch)
+        return count
+
+    def _write_batch(self, alert_batch, verdict_batch):
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?)", alert_batch)
+            self.conn.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", verdict_batch)
+        alert_batch.clear()
+        verdict_batch.clear()
+
+    def runs(self):
+        return self.conn.execute(
+            "SELECT runs.run, runs.model, runs.created_at, COUNT(verdicts.id) FROM runs "
+            "LEFT JOIN verdicts ON verdicts.run = runs.run GROUP BY runs.run ORDER BY runs.run"
+        ).fetchall()
+
+    def iter_rows(self, run, with_alert=True):
+        # Result rows of a run in the format of the postprocessed JSONL files
+        alert_column = "alerts.alert" if with_alert else "NULL"
+        cursor = self.conn.execute(
+            f"SELECT verdicts.id, verdicts.model, alerts.description, alerts.label, alerts.rule_level, alerts.rule_priority, {alert_column}, "
+            "verdicts.classification, verdicts.priority, verdicts.justification, verdicts.classification_match, "
+            "verdicts.priority_match, verdicts.triage_status, verdicts.triage_source, verdicts.details "
+            "FROM verdicts LEFT JOIN alerts ON alerts.alert_hash = verdicts.alert_hash WHERE verdicts.run = ? ORDER BY verdicts.rowid",
+            (run,)
+        )
+        for id, model, *alert_values, alert, classification, priority, justification, classification_match, priority_match, triage_status, triage_source, details in cursor:
+            alert_row = {"id": id}
+            alert_row.update(zip(ALERT_FIELDS, alert_values))
+            if alert is not None:
+                alert_row['alert'] = json.loads(alert)
+            alert_row.update(json.loads(details))
+            verdict = dict(zip(VERDICT_COLUMNS, (classification, priority, justification, classification_match, priority_match, triage_status, triage_source)))
+            verdict['classification_match'] = None if classification_match is None else bool(classification_match)
+            verdict['priority_match'] = None if priority_match is None else bool(priority_match)
+            alert_row.update({field: value for field, value in verdict.items() if value is not None})
+            # Rows stored by earlier versions still hold the response in details
+            if 'chatgpt_response' not in alert_row and classification is not None:
+                alert_row['chatgpt_response'] = {"alert_id": id, "classification": classification, "priority": priority, "justification": justification}
+            if model is not None:
+                alert_row['model'] = model
+            yield alert_row
+
+    def run_predictions(self, run):
+        # {id: (label, rule_priority, classification, priority)} of a run, only narrow columns are read
+        return {
+            id: (label or 'MISSING', rule_priority or 'MISSING', classification or 'MISSING', priority or 'MISSING')
+            for id, label, rule_priority, classification, priority in self.conn.execute(
+                "SELECT verdicts.id, alerts.label, alerts.rule_priority, verdicts.classification, verdicts.priority "
+                "FROM verdicts LEFT JOIN alerts ON alerts.alert_hash = verdicts.alert_hash WHERE verdicts.run = ?",
+                (run,)
+            )
+        }
+
+    def delete_run(self, run):
+        with self.conn:
+            self.conn.execute("DELETE FROM verdicts WHERE run = ?", (run,))
+            self.conn.execute("DELETE FROM runs WHERE run = ?", (run,))
+            # Alerts no longer referenced by any run
+            self.conn.execute("DELETE FROM alerts WHERE alert_hash NOT IN (SELECT DISTINCT alert_hash FROM verdicts WHERE alert_hash IS NOT NULL)")
+
+    def close(self):
+        self.conn.close()
+
+def run_name(input_file):
+    # Result folder name (e.g. 20250712_Run_1_gpt-4o) for files in Results/, the file name otherwise
+    folder = os.path.basename(os.path.dirname(os.path.abspath(input_file)))
+    if folder.lower() != "results" and "_Run_" in folder:
+        return folder
+    return os.path.splitext(os.path.basename(input_file))[0]
+
+def import_runs(store_path, input_files, model=None):
+    # Import postprocessed JSONL runs, e.g. python results_store.py results.sqlite --import ../Results/*/4_*.jsonl
+    store = ResultStore(store_path)
+    try:
+        for input_file in input_files:
+            run = run_name(input_file)
+            store.add_run(run, model, input_file)
+            with open(input_file, 'r', encoding='utf-8') as in_file:
+                count = store.write_rows(run, (json.loads(row) for row in in_file if row.strip()), model)
+            print(f"Imported {count} rows of {input_file} as run {run}")
+    finally:
+        store.close()
+
+def list_runs(store_path):
+    store = ResultStore(store_path)
+    try:
+        for run, model, created_at, verdicts in store.runs():
+            print(f"{run}\t{model or '-'}\t{created_at}\t{verdicts} verdicts")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Results store holding the alert corpus once and the verdicts of every run")
+    parser.add_argument("store", help="SQLite results store (created if missing)")
+    parser.add_argument("--import", dest="import_files", nargs="+", metavar="RUN_FILE", help="import postprocessed JSONL runs")
+    parser.add_argument("--model", help="model of the imported runs (if the rows do not record it)")
+    parser.add_argument("--delete", metavar="RUN", help="remove a run")
+    args = parser.parse_args()
+    if args.import_files:
+        import_runs(args.store, args.import_files, args.model)
+    elif args.delete:
+        store = ResultStore(args.store)
+        store.delete_run(args.delete)
+        store.close()
+    list_runs(args.store)
\ No newline at end of file
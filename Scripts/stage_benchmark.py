@@ -0,0 +1,186 @@
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from benchmark import git_commit
+from synthetic_alert_amplifier import RAW_INPUTS, DUPLICATE_RATIO, BURST_RATIO, SEED, write_amplified
+
+# Microbenchmarks of stages 1, 2, 4, 5 and 6 on synthetic alerts (synthetic_alert_amplifier.py). Every stage runs in a
+# fresh process on the output of the stage before it, so its time and peak memory are its own. Stage 3 is replaced
+# by drawn verdicts, no model is queried. Results go to a json file that benchmark.py --compare reads as well
+
+STAGES = ["1", "2", "4", "5", "6"]
+# Outputs of every stage in its working directory
+STAGE_OUTPUTS = {
+    "1": "1_*_alerts_preprocessed_*.jsonl",
+    "2": "2_alerts_merged.jsonl",
+    "4": "4_*_postprocessed.jsonl",
+    "5": "5_*_evaluation_report.xlsx",
+    "6": "6_*"
+}
+# Stage whose output every stage reads ("0": the synthetic raw exports, "3": the drawn verdicts)
+STAGE_INPUTS = {"1": "0", "2": "1", "4": "3", "5": "4", "6": "4"}
+# Drawn in place of stage 3: share of classifications equal to the label and of priorities equal to the rule priority
+VERDICT_ACCURACY = 0.9
+PRIORITY_ACCURACY = 0.7
+# Share of verdicts formatted the way stage 4 normalises ("TRUE POSITIVE (TP)", "Priority: HIGH")
+VERDICT_NOISE_RATE = 0.05
+# Share of verdicts stage 4 cannot normalise (left invalid, there is no repair without a model)
+INVALID_VERDICT_RATE = 0.001
+TRIAGED_FILE = "3_alerts_triaged.jsonl"
+
+def import_stage(name):
+    return importlib.import_module(name)
+
+def run_stage(stage, input_files, seed=SEED, workers=None, export_format="xlsx", plot_format="none"):
+    # Child process: run one stage on the output of the stage before it, in the working directory
+    if stage == "1":
+        preprocessing = import_stage("1_alert_preprocessing")
+        for input_file in input_files:
+            # The label is the prefix of the synthetic file name (TP_alerts_synthetic.jsonl)
+            label = os.path.basename(input_file).split("_")[0]
+            preprocessing.alerts_raw_preprocessing(input_file, label, workers)
+    elif stage == "2":
+        import_stage("2_alert_random_merging").merge_files(input_files, STAGE_OUTPUTS["2"], seed)
+    elif stage == "4":
+        import_stage("4_alert_postprocessing").alert_postprocesing_from_jsonl(input_files[0])
+    elif stage == "5":
+        evaluation = import_stage("5_result_evaluation")
+        evaluation.PLOT_FORMAT = plot_format
+        evaluation.evaluate_from_jsonl(input_files[0])
+    elif stage == "6":
+        import_stage("6_jsonl_result_to_excel").jsonl_to_excel(input_files[0], export_format)
+
+def drawn_verdict(rng, alert_row):
+    # Verdict of a model that is right most of the time and sometimes formats its answer loosely
+    label = alert_row.get('label', 'TP')
+    classification = label if rng.random() < VERDICT_ACCURACY else ("FP" if label == "TP" else "TP")
+    priority = alert_row.get('rule_priority', 'Low')
+    if rng.random() >= PRIORITY_ACCURACY:
+        priority = rng.choice(["Low", "Medium", "High", "Critical"])
+    if rng.random() < VERDICT_NOISE_RATE:
+        classification = f"{'TRUE' if classification == 'TP' else 'FALSE'} POSITIVE ({classification})"
+        priority = f"Priority: {priority.upper()}"
+    if rng.random() < INVALID_VERDICT_RATE:
+        classification = "UNSURE"
+    return {
+        "alert_id": alert_row.get('id', 'MISSING'),
+        "classification": classification,
+        "priority": priority,
+        "justification": f"Rule {alert_row.get('rule_level')} alert: {alert_row.get('description', '')}"
+    }
+
+def draw_verdicts(input_file, output_file, seed=SEED):
+    # Stage 3 output with drawn verdicts, built like stage 3 builds its rows
+    triage = import_stage("3_alert_classification_prioritisation")
+    rng = random.Random(seed)
+    with open(input_file, 'r', encoding='utf-8') as in_file, open(output_file, 'w', encoding='utf-8') as out_file:
+        for row in in_file:
+            if row.strip():
+                alert_row = json.loads(row)
+                out_file.write(json.dumps(triage.build_result_row(alert_row, drawn_verdict(rng, alert_row))) + "\n")
+
+def count_lines(input_files):
+    lines = 0
+    for input_file in input_files:
+        with open(input_file, 'rb') as in_file:
+            lines += sum(chunk.count(b"\n") for chunk in iter(lambda: in_file.read(1 << 20), b""))
+    return lines
+
+def measure_stage(stage, input_files, work_dir, seed=SEED, workers=None, export_format="xlsx", plot_format="none"):
+    # Run one stage in a fresh process and collect its time, memory and output files
+    # Stages name their outputs after their inputs, so the inputs are given relative to the working directory
+    relative_inputs = [os.path.relpath(input_file, work_dir) for input_file in input_files]
+    command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--input", *relative_inputs, "--seed", str(seed),
+               "--format", export_format, "--plot-format", plot_format]
+    if workers is not None:
+        command += ["--workers", str(workers)]
+    rows = count_lines(input_files)
+    before = set(glob.glob(os.path.join(work_dir, STAGE_OUTPUTS[stage])))
+    with open(os.path.join(work_dir, f"stage_{stage}.log"), "w", encoding="utf-8") as log_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, cwd=work_dir)
+        # wait4 returns the resource usage of this child only
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start_time
+    output_files = sorted(set(glob.glob(os.path.join(work_dir, STAGE_OUTPUTS[stage]))) - before) or sorted(before)
+    return {
+        "exit_code": os.waitstatus_to_exitcode(status),
+        "input_rows": rows,
+        "wall_time": wall_time,
+        "alerts_per_second": rows / wall_time if wall_time else 0.0,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "output_files": [os.path.basename(name) for name in output_files],
+        "output_mb": sum(os.path.getsize(name) for name in output_files) / 2 ** 20
+    }
+
+def run_stage_benchmark(count, work_dir=None, output_file=None, seed=SEED, duplicate_ratio=DUPLICATE_RATIO, burst_ratio=BURST_RATIO,
+                        workers=None, export_format="xlsx", plot_format="none"):
+    commit, dirty = git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = output_file or f"stage_benchmark_{commit or 'nogit'}_{timestamp}.json"
+    work_dir = os.path.abspath(work_dir or f"stage_benchmark_{timestamp}")
+    os.makedirs(work_dir, exist_ok=True)
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "synthetic": {"count": count, "seed": seed, "duplicate_ratio": duplicate_ratio, "burst_ratio": burst_ratio},
+        "settings": {"workers": workers, "export_format": export_format, "plot_format": plot_format},
+        "stages": {}
+    }
+    start_time = time.perf_counter()
+    raw_files = write_amplified(RAW_INPUTS, count, work_dir, seed, duplicate_ratio, burst_ratio)
+    results["generation_time"] = time.perf_counter() - start_time
+    outputs = {"0": list(raw_files.values())}
+    for stage in STAGES:
+        if stage == "4":
+            # Stage 3 is not benchmarked, its rows are drawn from the merged alerts
+            draw_verdicts(outputs["2"][0], os.path.join(work_dir, TRIAGED_FILE), seed)
+            outputs["3"] = [os.path.join(work_dir, TRIAGED_FILE)]
+        print(f"Running stage {stage} ...", flush=True)
+        metrics = measure_stage(stage, outputs[STAGE_INPUTS[stage]], work_dir, seed, workers, export_format, plot_format)
+        results["stages"][f"stage_{stage}"] = metrics
+        status = "" if metrics['exit_code'] == 0 else f" (exit code {metrics['exit_code']}, see {os.path.join(work_dir, f'stage_{stage}.log')})"
+        print(f"  {metrics['input_rows']} rows in {metrics['wall_time']:.2f}s ({metrics['alerts_per_second']:.0f} per second), "
+              f"CPU {metrics['cpu_time']:.2f}s, peak RSS {metrics['peak_rss_mb']:.0f} MB{status}")
+        if metrics['exit_code'] != 0 or not metrics['output_files']:
+            break
+        outputs[stage] = [os.path.join(work_dir, name) for name in metrics['output_files']]
+    with open(output_file, "w", encoding="utf-8") as out_file:
+        json.dump(results, out_file, indent=2)
+    print(f"\nStage benchmark results have been saved to: {output_file}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark stages 1, 2, 4, 5 and 6 on synthetic alerts, one fresh process per stage")
+    parser.add_argument("--count", type=int, default=1_000_000, help="synthetic alerts to generate (see synthetic_alert_amplifier.py)")
+    parser.add_argument("--output", help="benchmark json file (default stage_benchmark_<commit>_<timestamp>.json)")
+    parser.add_argument("--work-dir", help="directory for the synthetic alerts, the stage outputs and logs")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--duplicate-ratio", type=float, default=DUPLICATE_RATIO)
+    parser.add_argument("--burst-ratio", type=float, default=BURST_RATIO)
+    parser.add_argument("--workers", type=int, help="run stage 1 on N processes (0: one per CPU)")
+    parser.add_argument("--format", choices=["xlsx", "csv", "parquet"], default="xlsx", help="output format of stage 6")
+    parser.add_argument("--plot-format", choices=["png", "svg", "none"], default="none", help="confusion matrix figures of stage 5")
+    # Internal: run one stage in this process
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_stage:
+        run_stage(args.run_stage, args.input, args.seed, args.workers, args.format, args.plot_format)
+    else:
+        run_stage_benchmark(args.count, args.work_dir, args.output, args.seed, args.duplicate_ratio, args.burst_ratio,
+                            args.workers, args.format, args.plot_format)
\ No newline at end of file
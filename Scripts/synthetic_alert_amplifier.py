@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import random
+import re
+import string
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+# Amplifies the raw TP/FP exports into any number of realistic variants for scale testing: every variant is one of the
+# raw alerts with its GUIDs, PIDs, timestamps, host, user (and so the user profile paths) and ids replaced consistently
+# in every field and in the event message text, while the rule (level, id, description) and the label stay those of the
+# original alert. The variants are written as raw exports per label, ready for stage 1
+
+RAW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data", "0_Raw")
+RAW_INPUTS = {"TP": os.path.join(RAW_DIR, "TP_alerts_raw.jsonl"), "FP": os.path.join(RAW_DIR, "FP_alerts_raw.jsonl")}
+# Share of the output lines that repeat an earlier line (same _id, removed again by stage 1)
+DUPLICATE_RATIO = 0.02
+# Earlier lines a duplicate is drawn from
+DUPLICATE_WINDOW = 10000
+# Share of the variants that start a burst: the same alert on the same host for the same user, seconds apart
+BURST_RATIO = 0.01
+BURST_SIZE = 50
+BURST_GAP_SECONDS = 2
+# Variants are spread uniformly over this window
+START_TIME = datetime(2025, 7, 1, tzinfo=timezone.utc)
+SPAN_DAYS = 30
+# Hosts per original agent and users per original user account
+HOST_COUNT = 1000
+USER_COUNT = 5000
+SEED = 0
+
+GUID_PATTERN = re.compile(r'\{?[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\}?')
+TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}')
+# Fields holding process and thread ids (the last part of the field name, lower case)
+PID_FIELDS = {"processid", "parentprocessid", "sourceprocessid", "targetprocessid", "threadid", "sourcethreadid"}
+# Shorter ids (e.g. 4, the System process) are left alone, they are neither unique nor volatile
+PID_MIN_DIGITS = 3
+# Fields with DOMAIN\user values, only domain accounts are replaced (not NT AUTHORITY\SYSTEM and the like)
+USER_FIELDS = {"user", "parentuser", "sourceuser", "targetuser"}
+SYSTEM_DOMAINS = {"NT AUTHORITY", "NT SERVICE", "WINDOW MANAGER", "FONT DRIVER HOST"}
+# GUIDs that name a component rather than an occurrence (event providers)
+CONSTANT_GUID_FIELDS = {"providerguid"}
+ID_ALPHABET = string.ascii_letters + string.digits + "-_"
+# Parts of _source that stay as they are, tokens also found in them are not replaced (e.g. an agent named after its decoder)
+PROTECTED_FIELDS = ["rule", "decoder", "manager"]
+# Placeholders for values too short or too common to be replaced by their text
+AGENT_ID_TOKEN = "__agent_id__"
+AGENT_NAME_TOKEN = "__agent_name__"
+SORT_TOKEN = "__sort__"
+# Tokens are replaced where they are not part of a longer word or number
+TOKEN_BOUNDARY = r'(?<![0-9A-Za-z]){}(?![0-9A-Za-z])'
+
+def walk_fields(value, name=""):
+    # (lower case field name, value) of every string or number in the alert
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from walk_fields(item, key.lower())
+    elif isinstance(value, list):
+        for item in value:
+            yield from walk_fields(item, name)
+    elif isinstance(value, (str, int)) and not isinstance(value, bool):
+        yield name, value
+
+def case_variants(text):
+    return {text, text.upper(), text.lower()}
+
+class AlertTemplate:
+    # One raw alert as json text and the tokens replaced in every variant, with how to replace them
+    def __init__(self, alert, label):
+        self.label = label
+        source = alert.setdefault('_source', {})
+        agent = source.get('agent', {})
+        self.agent_name = agent.get('name')
+        self.agent_number = int(agent['id']) if str(agent.get('id', '')).isdigit() else 0
+        self.timestamp = parse_time(source.get('timestamp', ''))
+        tokens = {}
+        constant_guids = {value.lower() for name, value in walk_fields(alert) if name in CONSTANT_GUID_FIELDS and isinstance(value, str)}
+        for name, value in walk_fields(alert):
+            if not isinstance(value, str):
+                continue
+            for guid in GUID_PATTERN.findall(value):
+                if guid.lower() not in constant_guids:
+                    tokens[guid] = ("guid", guid)
+            for match in TIME_PATTERN.finditer(value):
+                if parse_time(match.group(0)):
+                    tokens[match.group(0)] = ("time", parse_time(match.group(0)))
+            if name in PID_FIELDS and value.isdigit() and len(value) >= PID_MIN_DIGITS:
+                tokens[value] = ("pid", value)
+            if name in USER_FIELDS and "\\" in value:
+                domain, user = value.replace("\\\\", "\\").split("\\", 1)
+                if domain.upper() not in SYSTEM_DOMAINS and user:
+                    for variant in case_variants(user):
+                        tokens[variant] = ("user", (user, variant))
+        if self.agent_name:
+            for variant in case_variants(self.agent_name):
+                tokens[variant] = ("host", variant)
+            if agent.get('ip'):
+                tokens[agent['ip']] = ("ip", None)
+        protected = json.dumps([source.get(field) for field in PROTECTED_FIELDS])
+        tokens = {token: replacement for token, replacement in tokens.items() if token not in protected}
+        if self.agent_name:
+            agent['name'] = AGENT_NAME_TOKEN
+            tokens[AGENT_NAME_TOKEN] = ("host", self.agent_name)
+            agent['id'] = AGENT_ID_TOKEN
+            tokens[AGENT_ID_TOKEN] = ("agent_id", None)
+        if alert.get('_id'):
+            tokens[alert['_id']] = ("_id", None)
+        if source.get('id'):
+            tokens[source['id']] = ("source_id", None)
+        if alert.get('sort'):
+            alert['sort'] = [SORT_TOKEN]
+            tokens[f'"{SORT_TOKEN}"'] = ("sort", None)
+        # Without an alert timestamp all times are shifted relative to the earliest one
+        self.timestamp = self.timestamp or min((data for kind, data in tokens.values() if kind == "time"), default=START_TIME)
+        text = json.dumps(alert)
+        self.tokens = tokens
+        # The text is split once at every token, a variant only joins the parts with its replacements.
+        # Longest first so a token that contains another one (e.g. a host name in upper case) wins
+        alternatives = sorted(tokens, key=len, reverse=True)
+        self.parts, self.slots = [], []
+        position = 0
+        if alternatives:
+            pattern = re.compile("|".join(TOKEN_BOUNDARY.format(re.escape(token)) for token in alternatives))
+            for match in pattern.finditer(text):
+                self.parts.append(text[position:match.start()])
+                self.slots.append(match.group(0))
+                position = match.end()
+        self.parts.append(text[position:])
+
+    def render(self, variant):
+        # The alert text with every token replaced, the same token gets the same replacement in all fields
+        replacements = {}
+        pieces = [self.parts[0]]
+        for token, part in zip(self.slots, self.parts[1:]):
+            if token not in replacements:
+                kind, data = self.tokens[token]
+                replacements[token] = variant.value(kind, data, token, self)
+            pieces.append(replacements[token])
+            pieces.append(part)
+        return "".join(pieces)
+
+class Variant:
+    # Random values of one variant: its time, host and user, and new GUIDs, PIDs and ids
+    def __init__(self, rng, alert_time, host, user):
+        self.rng = rng
+        self.alert_time = alert_time
+        self.host = host
+        self.user = user
+        # The same GUID can be written in upper and lower case
+        self.guids = {}
+
+    def value(self, kind, data, token, template):
+        rng = self.rng
+        if kind == "guid":
+            guid = self.guids.setdefault(token.strip("{}").lower(), "-".join(f"{rng.getrandbits(digits * 4):0{digits}x}" for digits in (8, 4, 4, 4, 12)))
+            guid = guid.upper() if token.upper() == token else guid
+            return f"{{{guid}}}" if token.startswith("{") else guid
+        if kind == "time":
+            shifted = data + (self.alert_time - template.timestamp)
+            return shifted.strftime(f"%Y-%m-%d{token[10]}%H:%M:%S")
+        if kind == "pid":
+            return str(rng.randrange(10 ** (len(data) - 1), 10 ** len(data)))
+        if kind == "user":
+            user, variant = data
+            return case_like(f"{user}{self.user:04d}", variant, user)
+        if kind == "host":
+            return case_like(f"{template.agent_name}-{self.host:04d}", data, template.agent_name)
+        if kind == "ip":
+            return f"10.{template.agent_number % 256}.{self.host // 250}.{self.host % 250 + 1}"
+        if kind == "agent_id":
+            return f"{template.agent_number * HOST_COUNT + self.host + 1:06d}"
+        if kind == "_id":
+            return "".join(rng.choice(ID_ALPHABET) for _ in range(20))
+        if kind == "source_id":
+            return f"{int(self.alert_time.timestamp())}.{rng.randrange(10 ** 7)}"
+        if kind == "sort":
+            return str(int(self.alert_time.timestamp() * 1000) + rng.randrange(1000))
+        return token
+
+def case_like(value, variant, original):
+    # value in the case of variant (the original as written, upper or lower case)
+    if variant == original:
+        return value
+    return value.upper() if variant == original.upper() else value.lower()
+
+def parse_time(text):
+    try:
+        return datetime.strptime(text[:19].replace("T", " "), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def load_templates(raw_inputs):
+    templates = []
+    for label, input_file in raw_inputs.items():
+        with open(input_file, 'r', encoding='utf-8') as in_file:
+            templates.extend(AlertTemplate(json.loads(row), label) for row in in_file if row.strip())
+    return templates
+
+def amplify_alerts(templates, count, seed=SEED, duplicate_ratio=DUPLICATE_RATIO, burst_ratio=BURST_RATIO):
+    # Generator of (label, raw export line): count lines in total including duplicates and bursts,
+    # the labels keep the share of the templates
+    rng = random.Random(seed)
+    span = SPAN_DAYS * 24 * 3600
+    recent = deque(maxlen=DUPLICATE_WINDOW)
+    burst = 0
+    for _ in range(count):
+        if recent and rng.random() < duplicate_ratio:
+            yield recent[rng.randrange(len(recent))]
+            continue
+        if burst:
+            # Next alert of the burst: same template, host and user, a few seconds later
+            burst -= 1
+            alert_time = alert_time + timedelta(seconds=int(rng.expovariate(1 / BURST_GAP_SECONDS)))
+        else:
+            template = templates[rng.randrange(len(templates))]
+            alert_time = START_TIME + timedelta(seconds=rng.randrange(span))
+            host, user = rng.randrange(HOST_COUNT), rng.randrange(USER_COUNT)
+            if rng.random() < burst_ratio:
+                burst = BURST_SIZE - 1
+        line = (template.label, template.render(Variant(rng, alert_time, host, user)) + "\n")
+        recent.append(line)
+        yield line
+
+def write_amplified(raw_inputs, count, output_dir=".", seed=SEED, duplicate_ratio=DUPLICATE_RATIO, burst_ratio=BURST_RATIO):
+    # Write the variants to one raw export per label, returns {label: file}
+    templates = load_templates(raw_inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    output_files = {label: os.path.join(output_dir, f"{label}_alerts_synthetic.jsonl") for label in raw_inputs}
+    out_files = {label: open(name, 'w', encoding='utf-8') for label, name in output_files.items()}
+    counts = dict.fromkeys(raw_inputs, 0)
+    start_time = time.perf_counter()
+    try:
+        for label, line in amplify_alerts(templates, count, seed, duplicate_ratio, burst_ratio):
+            out_files[label].write(line)
+            counts[label] += 1
+    finally:
+        for out_file in out_files.values():
+            out_file.close()
+    elapsed = time.perf_counter() - start_time
+    print(f"\nGenerated {count} alerts from {len(templates)} templates in {elapsed:.1f}s (seed {seed})")
+    for label, name in output_files.items():
+        print(f"  {label}: {counts[label]} alerts saved to: {name}")
+    return output_files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate realistic variants of the raw TP/FP exports for scale testing")
+    parser.add_argument("--count", type=int, default=1_000_000, help="alerts to generate, duplicates and bursts included")
+    parser.add_argument("--tp", default=RAW_INPUTS["TP"], help="raw export of the true positives")
+    parser.add_argument("--fp", default=RAW_INPUTS["FP"], help="raw export of the false positives")
+    parser.add_argument("--output-dir", default=".", help="directory of TP_alerts_synthetic.jsonl and FP_alerts_synthetic.jsonl")
+    parser.add_argument("--duplicate-ratio", type=float, default=DUPLICATE_RATIO, help="share of lines repeating an earlier alert id")
+    parser.add_argument("--burst-ratio", type=float, default=BURST_RATIO, help=f"share of alerts starting a burst of {BURST_SIZE}")
+    parser.add_argument("--burst-size", type=int, default=BURST_SIZE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+    BURST_SIZE = args.burst_size
+    write_amplified({"TP": args.tp, "FP": args.fp}, args.count, args.output_dir, args.seed, args.duplicate_ratio, args.burst_ratio)
\ No newline at end of file
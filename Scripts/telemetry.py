@@ -0,0 +1,195 @@
+import json
+import os
+import time
+from collections import deque
+import numpy as np
+
+# USD per million tokens: (input, cached input, output), models are matched by the longest prefix
+# (so dated snapshots like gpt-4.1-mini-2025-04-14 use the price of gpt-4.1-mini), reasoning tokens are billed as output
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.5-preview": (75.00, 37.50, 150.00),
+    "deepseek-chat": (0.27, 0.07, 1.10),
+    "deepseek-reasoner": (0.55, 0.14, 2.19)
+}
+# Latency percentiles reported at the end of a run and exported for Prometheus
+LATENCY_PERCENTILES = [50, 95, 99]
+# Token fields recorded per call by llm_backends.query_model
+TOKEN_FIELDS = ["input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens"]
+# Latencies of streamed calls (seconds from the request), reported like the total latency when present
+STREAM_LATENCY_FIELDS = ["time_to_first_token", "time_to_decision"]
+
+def model_price(model):
+    matches = [prefix for prefix in MODEL_PRICES if model and model.startswith(prefix)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+def call_cost(timing):
+    # Estimated cost of one call in USD, None if the model has no price or the response reported no usage
+    price = model_price(timing.get('model'))
+    if price is None or timing.get('input_tokens') is None:
+        return None
+    input_price, cached_price, output_price = price
+    cached_tokens = timing.get('cached_tokens') or 0
+    return (
+        (timing['input_tokens'] - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + (timing.get('output_tokens') or 0) * output_price
+    ) / 1e6
+
+class CallTelemetry:
+    # Per-call latency, token and cost records of a run, optionally appended to a metrics jsonl file as they arrive.
+    # Counters are running totals; latencies are kept for the last window calls per model (None = all calls of the run),
+    # so a long-running service (live_triage.py) has bounded memory and its percentiles cover the recent calls
+    def __init__(self, metrics_path=None, window=None):
+        self.calls = {}
+        self.window = window
+        self.metrics_file = open(metrics_path, "a", encoding="utf-8") if metrics_path else None
+
+    def record(self, timing, alert_id=None):
+        model = timing.get('model', 'MISSING')
+        calls = self.calls.setdefault(model, {
+            "latencies": deque(maxlen=self.window), "prefix_cached": deque(maxlen=self.window),
+            **{field: deque(maxlen=self.window) for field in STREAM_LATENCY_FIELDS},
+            "calls": 0, "latency_sum": 0.0, "prefix_cached_calls": 0, "request_bytes": 0, "retries": 0, "cost": 0.0, "unpriced_calls": 0,
+            **{field: 0 for field in TOKEN_FIELDS}
+        })
+        calls["calls"] += 1
+        calls["latency_sum"] += timing['api_time']
+        calls["latencies"].append(timing['api_time'])
+        # Whether the provider served part of the prompt from its prefix cache
+        prefix_cached = bool(timing.get('cached_tokens'))
+        calls["prefix_cached_calls"] += prefix_cached
+        calls["prefix_cached"].append(prefix_cached)
+        for field in STREAM_LATENCY_FIELDS:
+            if timing.get(field) is not None:
+                calls[field].append(timing[field])
+        calls["request_bytes"] += timing.get('request_bytes', 0)
+        calls["retries"] += timing.get('retries', 0)
+        for field in TOKEN_FIELDS:
+            calls[field] += timing.get(field) or 0
+        cost = timing.get('cost_usd')
+        if cost is None:
+            calls["unpriced_calls"] += 1
+        else:
+            calls["cost"] += cost
+        if self.metrics_file is not None:
+            self.metrics_file.write(json.dumps({"timestamp": time.time(), "alert_id": alert_id, **timing}) + "\n")
+            self.metrics_file.flush()
+
+    def summary(self, wall_time):
+        # Per model: calls, latency percentiles, tokens, tokens per second, cost and throughput over wall_time
+        summary = {}
+        for model, calls in self.calls.items():
+            # Percentiles and medians over the window, everything else over the whole run
+            latencies = np.array(calls["latencies"])
+            prefix_cached = np.array(calls["prefix_cached"], dtype=bool)
+            api_time = calls["latency_sum"]
+            generated_tokens = calls["output_tokens"]
+            price = model_price(model)
+            summary[model] = {
+                "calls": calls["calls"],
+                "latency_percentiles": dict(zip(LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES))),
+                "latency_sum": api_time,
+                **{
+                    f"{field}_percentiles": dict(zip(LATENCY_PERCENTILES, np.percentile(calls[field], LATENCY_PERCENTILES)))
+                    for field in STREAM_LATENCY_FIELDS if calls[field]
+                },
+                "request_bytes": calls["request_bytes"],
+                "retries": calls["retries"],
+                **{field: calls[field] for field in TOKEN_FIELDS},
+                # Output tokens per second of request time, i.e. the generation speed a single call sees
+                "output_tokens_per_second": generated_tokens / api_time if api_time else 0.0,
+                # Tokens (input and output) per second of wall time, i.e. what the run pushed through
+                "tokens_per_second": (calls["input_tokens"] + generated_tokens) / wall_time if wall_time else 0.0,
+                "calls_per_second": calls["calls"] / wall_time if wall_time else 0.0,
+                "cost": calls["cost"],
+                "unpriced_calls": calls["unpriced_calls"],
+                # Prefix cache: calls with cached input tokens, their share of the input and the median latency with and without
+                "prefix_cached_calls": calls["prefix_cached_calls"],
+                "cached_input_share": calls["cached_tokens"] / calls["input_tokens"] if calls["input_tokens"] else 0.0,
+                "latency_p50_cached": float(np.median(latencies[prefix_cached])) if prefix_cached.any() else None,
+                "latency_p50_uncached": float(np.median(latencies[~prefix_cached])) if (~prefix_cached).any() else None,
+                "cache_savings": calls["cached_tokens"] * (price[0] - price[1]) / 1e6 if price else 0.0
+            }
+        return summary
+
+    def close(self):
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
+
+def print_telemetry(summary):
+    for model, metrics in summary.items():
+        percentiles = " / ".join(f"p{p} {value:.3f}s" for p, value in metrics['latency_percentiles'].items())
+        print(f"\n{model}: {metrics['calls']} calls ({metrics['calls_per_second']:.2f} per second), {metrics['retries']} retries")
+        print(f"  Latency: {percentiles}")
+        for field in STREAM_LATENCY_FIELDS:
+            if f"{field}_percentiles" in metrics:
+                stream_percentiles = " / ".join(f"p{p} {value:.3f}s" for p, value in metrics[f"{field}_percentiles"].items())
+                print(f"  {field.replace('_', ' ').capitalize()}: {stream_percentiles}")
+        print(f"  Tokens: {metrics['input_tokens']} input ({metrics['cached_tokens']} cached), {metrics['output_tokens']} output"
+              f" ({metrics['reasoning_tokens']} reasoning), {metrics['request_bytes']/1e6:.2f} MB sent")
+        if metrics['prefix_cached_calls']:
+            latency_cached = metrics['latency_p50_cached']
+            latency_uncached = metrics['latency_p50_uncached']
+            print(f"  Prefix cache: {metrics['prefix_cached_calls']} calls with cached input, {metrics['cached_input_share']:.2%} of input tokens cached,"
+                  f" p50 latency {latency_cached:.3f}s cached / {f'{latency_uncached:.3f}s' if latency_uncached is not None else '-'} uncached,"
+                  f" saved ${metrics['cache_savings']:.4f}")
+        print(f"  Tokens per second: {metrics['tokens_per_second']:.1f} (output {metrics['output_tokens_per_second']:.1f} per second of request time)")
+        cost = f"${metrics['cost']:.4f}"
+        if metrics['unpriced_calls']:
+            cost += f" ({metrics['unpriced_calls']} calls without usage or price not included)"
+        print(f"  Estimated cost: {cost}")
+
+def prometheus_metric(lines, name, metric_type, help_text, samples, job="alert_triage"):
+    # Append one metric in Prometheus text exposition format to lines
+    # samples: (labels, value) or (name suffix, labels, value) for the _sum and _count samples of a summary
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for sample in samples:
+        suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+        label_text = ",".join(f'{key}="{label}"' for key, label in {"job": job, **labels}.items())
+        lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+def prometheus_lines(summary, job="alert_triage"):
+    # LLM call metrics of a telemetry summary
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        prometheus_metric(lines, name, metric_type, help_text, samples, job)
+
+    models = list(summary.items())
+    metric("llm_request_latency_seconds", "summary", "Latency of LLM API calls",
+           [({"model": model, "quantile": str(p / 100)}, round(value, 6)) for model, metrics in models for p, value in metrics['latency_percentiles'].items()]
+           + [("_sum", {"model": model}, round(metrics['latency_sum'], 6)) for model, metrics in models]
+           + [("_count", {"model": model}, metrics['calls']) for model, metrics in models])
+    for field in STREAM_LATENCY_FIELDS:
+        streamed = [(model, metrics) for model, metrics in models if f"{field}_percentiles" in metrics]
+        if streamed:
+            metric(f"llm_{field}_seconds", "summary", f"{field.replace('_', ' ').capitalize()} of streamed LLM API calls",
+                   [({"model": model, "quantile": str(p / 100)}, round(value, 6))
+                    for model, metrics in streamed for p, value in metrics[f"{field}_percentiles"].items()])
+    metric("llm_requests_total", "counter", "LLM API calls", [({"model": model}, metrics['calls']) for model, metrics in models])
+    metric("llm_retries_total", "counter", "Retried HTTP requests of LLM API calls", [({"model": model}, metrics['retries']) for model, metrics in models])
+    metric("llm_tokens_total", "counter", "Tokens reported by the API",
+           [({"model": model, "type": field.replace("_tokens", "")}, metrics[field]) for model, metrics in models for field in TOKEN_FIELDS])
+    metric("llm_prefix_cached_requests_total", "counter", "LLM API calls with input tokens served from the prompt prefix cache",
+           [({"model": model}, metrics['prefix_cached_calls']) for model, metrics in models])
+    metric("llm_request_bytes_total", "counter", "Bytes of request bodies", [({"model": model}, metrics['request_bytes']) for model, metrics in models])
+    metric("llm_cost_usd_total", "counter", "Estimated cost in USD", [({"model": model}, round(metrics['cost'], 6)) for model, metrics in models])
+    metric("llm_throughput_calls_per_second", "gauge", "API calls per second of wall time",
+           [({"model": model}, round(metrics['calls_per_second'], 4)) for model, metrics in models])
+    return lines
+
+def write_prometheus(summary, output_file, job="alert_triage", extra_lines=()):
+    # Prometheus text exposition format, e.g. for the node_exporter textfile collector
+    # Written to a temporary file and renamed so a scrape never sees a partial file
+    lines = [*extra_lines, *prometheus_lines(summary, job)]
+    temp_file = output_file + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as out_file:
+        out_file.write("\n".join(lines) + "\n")
+    os.replace(temp_file, output_file)
\ No newline at end of file
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Fields that differ between re-exports of the same alert and are stripped before hashing
+VOLATILE_FIELDS = [
+    "_index",
+    "_id",
+    "_version",
+    "_score",
+    "sort",
+    "fields.timestamp",
+    "_source.id",
+    "_source.timestamp"
+]
+# Run a full eviction pass after this many new entries
+PRUNE_INTERVAL = 1000
+
+def canonical_alert(alert):
+    # Deep copy via json so the alert sent to the model is not modified
+    alert = json.loads(json.dumps(alert))
+    if not isinstance(alert, dict):
+        return alert
+    for field in VOLATILE_FIELDS:
+        *parents, leaf = field.split(".")
+        node = alert
+        for parent in parents:
+            node = node.get(parent) if isinstance(node, dict) else None
+        if isinstance(node, dict):
+            node.pop(leaf, None)
+    return alert
+
+def cache_key(alert, model, *prompt_parts):
+    # Hash of the canonicalised alert, the model and everything in the prompt that shapes the verdict
+    canonical = json.dumps(
+        {"alert": canonical_alert(alert), "model": model, "prompt": prompt_parts},
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class VerdictCache:
+    def __init__(self, path, ttl_seconds=None, max_entries=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # Autocommit and WAL so every stored verdict is on disk without blocking readers
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts(last_used)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS verdicts_created_at ON verdicts(created_at)")
+        self.prune()
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and created_at < now - self.ttl_seconds
+
+    def get(self, key):
+        now = time.time()
+        row = self.conn.execute("SELECT response, created_at FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        response, created_at = row
+        # Expired entries count as a miss and are removed right away
+        if self._expired(created_at, now):
+            self.conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(response)
+
+    def put(self, key, model, response):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO verdicts (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, model, json.dumps(response), now, now)
+        )
+        self.stores += 1
+        if self.stores % PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self):
+        # Drop expired entries, then the least recently used ones above max_entries
+        if self.ttl_seconds is not None:
+            cursor = self.conn.execute("DELETE FROM verdicts WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self.conn.execute(
+                "DELETE FROM verdicts WHERE key IN ("
+                "SELECT key FROM verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += cursor.rowcount
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        }
+
+    def close(self):
+        self.prune()
+        self.conn.close()
\ No newline at end of file